@@ -0,0 +1,109 @@
+"""
+Admission control for the synchronous API.
+
+At most ADMISSION_MAX_ACTIVE analyses run per process. Up to
+ADMISSION_MAX_QUEUE further requests wait for a slot, each for at most
+ADMISSION_QUEUE_TIMEOUT_SECONDS. Anything beyond that is shed immediately:
+
+    429  the wait queue is full
+    503  the request waited in the queue past its timeout
+
+Both carry a Retry-After estimated from recent run durations. Active and
+queued counts are exported as gauges on /metrics.
+"""
+import os
+import math
+import time
+import asyncio
+from contextlib import asynccontextmanager
+
+from telemetry import registry
+
+registry.describe("analyzer_admission_active", "gauge", "Analyses currently running")
+registry.describe("analyzer_admission_queued", "gauge", "Analyses waiting for a slot")
+registry.describe("analyzer_admission_rejected_total", "counter", "Requests shed by admission control")
+registry.describe("analyzer_admission_wait_seconds", "histogram", "Time admitted requests waited for a slot")
+
+
+class AdmissionRejected(Exception):
+    """The request was shed; respond with status_code and a Retry-After header"""
+
+    def __init__(self, status_code: int, detail: str, retry_after: int):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """Concurrency limit with a bounded, time-limited wait queue (one per event loop)"""
+
+    def __init__(self, name: str = "analyze", max_active: int = None, max_queue: int = None,
+                 queue_timeout: float = None):
+        self.name = name
+        self.max_active = max(int(max_active if max_active is not None else os.getenv("ADMISSION_MAX_ACTIVE", "2")), 1)
+        self.max_queue = int(max_queue if max_queue is not None else os.getenv("ADMISSION_MAX_QUEUE", "8"))
+        self.queue_timeout = float(queue_timeout if queue_timeout is not None
+                                   else os.getenv("ADMISSION_QUEUE_TIMEOUT_SECONDS", "30"))
+        self.default_retry_after = int(os.getenv("ADMISSION_RETRY_AFTER_SECONDS", "30"))
+        self.active = 0
+        self.queued = 0
+        self.avg_run_seconds = None
+        self._semaphore = None
+
+    def _publish(self):
+        labels = {"pool": self.name}
+        registry.set("analyzer_admission_active", self.active, labels)
+        registry.set("analyzer_admission_queued", self.queued, labels)
+
+    def retry_after(self) -> int:
+        """Seconds until a slot is likely to free up, from the average run time"""
+        if self.avg_run_seconds is None:
+            return self.default_retry_after
+        estimate = self.avg_run_seconds * (self.queued + 1) / self.max_active
+        return min(max(math.ceil(estimate), 1), 600)
+
+    def _reject(self, status_code: int, reason: str, detail: str):
+        registry.inc("analyzer_admission_rejected_total", labels={"pool": self.name, "reason": reason})
+        raise AdmissionRejected(status_code, detail, self.retry_after())
+
+    async def acquire(self):
+        """Take a slot, waiting in the bounded queue if needed; raises AdmissionRejected"""
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_active)
+        started = time.monotonic()
+        if not self._semaphore.locked():
+            # A slot is free: acquire() returns without suspending
+            await self._semaphore.acquire()
+        else:
+            if self.queued >= self.max_queue:
+                self._reject(429, "queue_full", "Server is at capacity; retry later")
+            self.queued += 1
+            self._publish()
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), timeout=self.queue_timeout)
+            except asyncio.TimeoutError:
+                self._reject(503, "queue_timeout", "Timed out waiting for an analysis slot; retry later")
+            finally:
+                self.queued -= 1
+                self._publish()
+        registry.observe("analyzer_admission_wait_seconds", time.monotonic() - started, {"pool": self.name})
+        self.active += 1
+        self._publish()
+        return time.monotonic()
+
+    def release(self, admitted_at: float):
+        """Free a slot taken by acquire() and fold the run time into the Retry-After estimate"""
+        elapsed = time.monotonic() - admitted_at
+        self.avg_run_seconds = elapsed if self.avg_run_seconds is None else 0.8 * self.avg_run_seconds + 0.2 * elapsed
+        self.active -= 1
+        self._publish()
+        self._semaphore.release()
+
+    @asynccontextmanager
+    async def slot(self):
+        admitted_at = await self.acquire()
+        try:
+            yield
+        finally:
+            self.release(admitted_at)
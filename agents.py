@@ -2,18 +2,16 @@ import os
 from dotenv import load_dotenv
 from crewai import Agent
 
-# This is the new, recommended way to import ChatLiteLLM
-from langchain_litellm import ChatLiteLLM
-
-from tools import search_tool, financial_document_tool, investment_analysis_tool, risk_assessment_tool
+from tools import (search_tool, knowledge_tools, financial_document_tools, investment_analysis_tool,
+                   risk_assessment_tool)
+from model_routing import route_llm
 
 load_dotenv()
 
 # The library will now automatically find and use the GEMINI_API_KEY from your .env file.
-llm = ChatLiteLLM(
-    model="gemini/gemini-1.5-flash",
-    temperature=0.1
-)
+# Each agent gets its own routed model (see model_routing.py); `llm` is the shared
+# fast-tier model used as the crew manager and for chunk summaries.
+llm = route_llm("shared", escalate=False)
 
 # --- All the agent definitions below this line remain exactly the same ---
 # (financial_analyst, verifier, investment_advisor, risk_assessor)
@@ -31,8 +29,8 @@ financial_analyst = Agent(
         "You always base your recommendations on solid financial data and established analytical frameworks. "
         "You provide clear, professional, and well-reasoned financial advice while highlighting important risks and assumptions."
     ),
-    tools=[financial_document_tool, search_tool],
-    llm=llm,
+    tools=[*financial_document_tools, *knowledge_tools, search_tool],
+    llm=route_llm("financial_analyst"),
     max_iter=3,
     max_rpm=10,
     allow_delegation=True
@@ -50,8 +48,8 @@ verifier = Agent(
         "You ensure that all financial data is properly formatted, complete, and suitable for analysis. "
         "You identify any missing information, inconsistencies, or potential data quality issues that could affect the analysis."
     ),
-    tools=[financial_document_tool],
-    llm=llm,
+    tools=financial_document_tools,
+    llm=route_llm("verifier"),
     max_iter=2,
     max_rpm=10,
     allow_delegation=True
@@ -70,8 +68,8 @@ investment_advisor = Agent(
         "You have a track record of helping clients make informed investment decisions based on thorough financial analysis. "
         "You always provide balanced recommendations with clear risk disclosures and compliance with financial regulations."
     ),
-    tools=[investment_analysis_tool, search_tool],
-    llm=llm,
+    tools=[investment_analysis_tool, *knowledge_tools, search_tool],
+    llm=route_llm("investment_advisor"),
     max_iter=3,
     max_rpm=10,
     allow_delegation=False
@@ -90,8 +88,8 @@ risk_assessor = Agent(
         "You provide practical risk management recommendations and help stakeholders understand risk-return trade-offs. "
         "You stay current with regulatory requirements and industry best practices in risk management."
     ),
-    tools=[risk_assessment_tool, search_tool],
-    llm=llm,
+    tools=[risk_assessment_tool, *knowledge_tools, search_tool],
+    llm=route_llm("risk_assessor"),
     max_iter=3,
     max_rpm=10,
     allow_delegation=False
@@ -0,0 +1,175 @@
+"""
+Similarity index over past analyses.
+
+Every stored analysis gets a hashed TF-IDF vector of its document (the same
+sampled pages triage reads, so the API can vectorize an upload without
+parsing all of it). On upload the index finds:
+
+- near-duplicate filings (cosine >= SIMILAR_DUPLICATE_THRESHOLD) whose stored
+  answer for the same query can be served as-is. Similarity alone never
+  qualifies: the company, the period and the exact figures of the sampled
+  pages (figures_fingerprint) must match too, so a restatement or the next
+  quarter's update from the same template is analyzed afresh;
+- related earlier analyses (cosine >= SIMILAR_RELATED_THRESHOLD, or the same
+  company), condensed into a short prior summary for the crew.
+
+Vectors are term counts hashed into ANALYSIS_INDEX_DIM buckets with a stable
+hash, so the API and the workers produce identical vectors. IDF weights are
+dampened (square root) so a handful of new words in an amended filing does
+not hide that it is otherwise identical. Rows live in one NumPy matrix. Below ANALYSIS_INDEX_EXACT_MAX rows the search is an exact scan;
+above it, random-hyperplane LSH tables (ANALYSIS_INDEX_TABLES x
+ANALYSIS_INDEX_BITS) pick the candidates that are then scored exactly.
+"""
+import os
+import re
+import math
+import zlib
+import hashlib
+import threading
+
+import numpy as np
+
+ANALYSIS_INDEX_DIM = int(os.getenv("ANALYSIS_INDEX_DIM", "2048"))
+ANALYSIS_INDEX_TABLES = int(os.getenv("ANALYSIS_INDEX_TABLES", "16"))
+ANALYSIS_INDEX_BITS = int(os.getenv("ANALYSIS_INDEX_BITS", "8"))
+ANALYSIS_INDEX_EXACT_MAX = int(os.getenv("ANALYSIS_INDEX_EXACT_MAX", "5000"))
+SIMILAR_DUPLICATE_THRESHOLD = float(os.getenv("SIMILAR_DUPLICATE_THRESHOLD", "0.97"))
+SIMILAR_RELATED_THRESHOLD = float(os.getenv("SIMILAR_RELATED_THRESHOLD", "0.6"))
+# Characters of each earlier analysis included in the prior summary
+PRIOR_SUMMARY_CHARS = int(os.getenv("PRIOR_SUMMARY_CHARS", "600"))
+
+_TOKEN_PATTERN = re.compile(r"[a-z][a-z0-9&'\-]{1,}|\d[\d,.]*%?")
+_FIGURE_PATTERN = re.compile(r"\d[\d,.]*%?")
+
+
+def vectorize(text: str, dim: int = ANALYSIS_INDEX_DIM) -> np.ndarray:
+    """Hashed, sublinear term-frequency vector of words and word bigrams"""
+    tokens = _TOKEN_PATTERN.findall(text.lower())
+    # Exact figures vary between filings; keep their magnitude, not their digits
+    tokens = [f"#{len(token)}" if token[0].isdigit() else token for token in tokens]
+    counts = {}
+    for token in tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]:
+        bucket = zlib.crc32(token.encode("utf-8"))
+        counts[bucket] = counts.get(bucket, 0) + 1
+    vector = np.zeros(dim, dtype=np.float32)
+    for bucket, count in counts.items():
+        # The top hash bit picks the sign so colliding terms tend to cancel
+        sign = -1.0 if bucket & 0x80000000 else 1.0
+        vector[bucket % dim] += sign * (1.0 + math.log(count))
+    return vector
+
+
+def figures_fingerprint(text: str) -> str:
+    """SHA-256 of every figure in the text, in order (the digits vectorize deliberately drops)"""
+    figures = [figure.rstrip(",.") for figure in _FIGURE_PATTERN.findall(text.lower())]
+    return hashlib.sha256(" ".join(figures).encode("utf-8")).hexdigest()
+
+
+def summarize(text: str, limit: int = PRIOR_SUMMARY_CHARS) -> str:
+    """Whitespace-collapsed prefix of an analysis, cut at a word boundary"""
+    collapsed = " ".join((text or "").split())
+    if len(collapsed) <= limit:
+        return collapsed
+    return collapsed[:limit].rsplit(" ", 1)[0] + " ..."
+
+
+class AnalysisIndex:
+    """Cosine-similarity index of TF-IDF vectors with LSH candidate selection"""
+
+    def __init__(self, dim: int = ANALYSIS_INDEX_DIM, tables: int = ANALYSIS_INDEX_TABLES,
+                 bits: int = ANALYSIS_INDEX_BITS, exact_max: int = ANALYSIS_INDEX_EXACT_MAX):
+        self.dim = dim
+        self.exact_max = exact_max
+        self.ids = []
+        self.meta = []
+        self._rows = np.zeros((0, dim), dtype=np.float32)
+        self._size = 0
+        self._doc_freq = np.zeros(dim, dtype=np.float32)
+        self._norms = None  # TF-IDF row norms, recomputed lazily after inserts
+        # Fixed seed: the hyperplanes must not change between processes or restarts
+        self._planes = np.random.default_rng(7).standard_normal((tables, bits, dim)).astype(np.float32)
+        self._powers = 1 << np.arange(bits, dtype=np.int64)
+        self._buckets = [{} for _ in range(tables)]
+        self._known = set()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __contains__(self, entry_id) -> bool:
+        return entry_id in self._known
+
+    def _signatures(self, vectors: np.ndarray) -> np.ndarray:
+        # (tables, n) bucket keys from the sign pattern of each vector against each table's hyperplanes
+        projections = np.einsum("tbd,nd->tnb", self._planes, vectors)
+        return ((projections > 0) * self._powers).sum(axis=2)
+
+    def add(self, entry_id, vector: np.ndarray, meta: dict = None):
+        """Index one document vector (from vectorize) under entry_id; re-adding an id is a no-op"""
+        vector = np.asarray(vector, dtype=np.float32)
+        with self._lock:
+            if entry_id in self._known:
+                return
+            if self._size == len(self._rows):
+                grown = np.zeros((max(2 * len(self._rows), 64), self.dim), dtype=np.float32)
+                grown[:self._size] = self._rows[:self._size]
+                self._rows = grown
+            row = self._size
+            self._rows[row] = vector
+            self._size += 1
+            self._doc_freq += vector != 0
+            self._norms = None
+            self.ids.append(entry_id)
+            self.meta.append(meta or {})
+            self._known.add(entry_id)
+            for table, key in enumerate(self._signatures(vector[None, :])[:, 0]):
+                self._buckets[table].setdefault(int(key), []).append(row)
+
+    def latest(self, key: str, value, limit: int = 3) -> list:
+        """Most recently added (entry_id, meta) pairs whose meta[key] equals value"""
+        found = []
+        with self._lock:
+            for position in range(self._size - 1, -1, -1):
+                if self.meta[position].get(key) == value:
+                    found.append((self.ids[position], self.meta[position]))
+                    if len(found) >= limit:
+                        break
+        return found
+
+    def near_duplicates(self, vector: np.ndarray, min_score: float = SIMILAR_DUPLICATE_THRESHOLD, **exact) -> list:
+        """search() hits scoring at least min_score whose meta equals every keyword given (figures, query, ...)"""
+        return [(score, entry_id, meta) for score, entry_id, meta in self.search(vector, min_score=min_score)
+                if all(key in meta and meta[key] == value for key, value in exact.items())]
+
+    def _idf(self) -> np.ndarray:
+        return np.sqrt(np.log((1.0 + self._size) / (1.0 + self._doc_freq)) + 1.0)
+
+    def _candidates(self, vector: np.ndarray):
+        if self._size <= self.exact_max:
+            return slice(0, self._size)
+        rows = set()
+        for table, key in enumerate(self._signatures(vector[None, :])[:, 0]):
+            rows.update(self._buckets[table].get(int(key), ()))
+        return np.fromiter(rows, dtype=np.int64, count=len(rows))
+
+    def search(self, vector: np.ndarray, k: int = 5, min_score: float = 0.0) -> list:
+        """Up to k (score, entry_id, meta) tuples, best first, with cosine similarity >= min_score"""
+        vector = np.asarray(vector, dtype=np.float32)
+        with self._lock:
+            if not self._size:
+                return []
+            idf = self._idf()
+            norm = np.linalg.norm(vector * idf)
+            if not norm:
+                return []
+            rows = self._rows[:self._size]
+            if self._norms is None:
+                # Norms of the TF-IDF rows without materialising them
+                self._norms = np.maximum(np.sqrt(np.einsum("ij,ij,j->i", rows, rows, idf * idf)), 1e-12)
+            candidates = self._candidates(vector)
+            # cos(r*idf, v*idf) = r . (v*idf^2) / (|r*idf| |v*idf|)
+            scores = (rows[candidates] @ (vector * idf * idf / norm)) / self._norms[candidates]
+            positions = np.arange(self._size)[candidates]
+            top = np.argsort(-scores)[:k]
+            return [(float(scores[i]), self.ids[positions[i]], self.meta[positions[i]])
+                    for i in top if scores[i] >= min_score]
@@ -0,0 +1,379 @@
+#!/usr/bin/env python3
+"""
+End-to-end benchmark harness for the API entry points.
+
+Each entry point is started in a subprocess with LLM_BACKEND=mock, so no
+Gemini key or network access is needed, then hammered with concurrent
+uploads of a synthetic PDF. Reports throughput, p50/p95/p99 latency, error
+count and peak server RSS.
+
+Usage:
+    python benchmark.py                                   # all entry points
+    python benchmark.py --entry main_working --concurrency 16 --requests 200
+    python benchmark.py --latency-ms 50 --error-rate 0.02 --json bench.json
+    python benchmark.py --memory --sizes-mb 100,250,500   # PDF reader peak RSS by size and page count
+    python benchmark.py --pools prefork,threads,gevent --concurrency 32 --latency-ms 2000
+
+new_main.py additionally needs Redis (Celery broker/backend) and MongoDB;
+a Celery worker is started alongside the API automatically. --pools runs
+new_main.py once per Celery pool type with the "llm" worker profile
+(worker_profiles.py); prefork keeps Celery's default of one child per core
+as the baseline.
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import argparse
+import subprocess
+import urllib.request
+import urllib.error
+from concurrent.futures import ThreadPoolExecutor
+
+ENTRY_POINTS = {
+    "main": {"cmd": ["-m", "uvicorn", "main:app"], "async": False},
+    "new_main": {"cmd": ["-m", "uvicorn", "new_main:app"], "async": True,
+                 "worker": ["-m", "celery", "-A", "celery_tasks", "worker", "--loglevel=warning"]},
+    "main_working": {"cmd": ["-m", "uvicorn", "main_working:app"], "async": False},
+    "standalone_server": {"cmd": ["standalone_server.py"], "async": False, "port_env": True},
+}
+
+QUERY = "Provide a comprehensive financial analysis of this document"
+
+
+def make_synthetic_pdf(pages: int = 5, lines_per_page: int = 40, image_bytes: int = 0) -> bytes:
+    """
+    Build a valid, uncompressed PDF with financial-looking text on every page.
+
+    image_bytes draws a grayscale image of about that size on every page, as
+    in a scanned filing, so large files grow with their page count and each
+    page's resources instead of carrying dead bytes the reader never touches.
+    """
+    objects = []
+
+    def add(body: bytes) -> int:
+        objects.append(body)
+        return len(objects)
+
+    font_id = add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    pages_id = add(b"")  # placeholder, filled in once the kids are known
+    kids = []
+    image_height = max(image_bytes // 1000, 1)
+    for number in range(pages):
+        lines = [f"Synthetic Corp quarterly report page {number + 1}: net income, operating income and cash flow"]
+        for line in range(lines_per_page - 1):
+            value = (number * lines_per_page + line) * 37 % 9973
+            lines.append(f"Revenue segment {line}: ${value:,} million, margin {value % 40}.{line % 10}%")
+        text_ops = "BT /F1 9 Tf 40 800 Td 11 TL " + " ".join(
+            "(" + l.replace("(", "[").replace(")", "]") + ") '" for l in lines
+        ) + " ET"
+        resources = b"/Font << /F1 %d 0 R >>" % font_id
+        if image_bytes:
+            image = os.urandom(1000 * image_height)
+            image_id = add(b"<< /Type /XObject /Subtype /Image /Width 1000 /Height %d /ColorSpace /DeviceGray "
+                           b"/BitsPerComponent 8 /Length %d >>\nstream\n" % (image_height, len(image))
+                           + image + b"\nendstream")
+            resources += b" /XObject << /Im1 %d 0 R >>" % image_id
+            text_ops = "q 612 0 0 842 0 0 cm /Im1 Do Q " + text_ops
+        stream = text_ops.encode("latin-1")
+        content_id = add(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        kids.append(add(
+            b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 612 842] "
+            b"/Resources << %s >> /Contents %d 0 R >>" % (pages_id, resources, content_id)
+        ))
+    objects[pages_id - 1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (
+        b" ".join(b"%d 0 R" % kid for kid in kids), len(kids)
+    )
+    catalog_id = add(b"<< /Type /Catalog /Pages %d 0 R >>" % pages_id)
+
+    out = bytearray(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref_at = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        out += b"%010d 00000 n \n" % offset
+    out += b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, catalog_id, xref_at)
+    return bytes(out)
+
+
+def encode_multipart(fields: dict, file_field: str, filename: str, content: bytes):
+    """Encode form fields and one file as multipart/form-data"""
+    boundary = uuid.uuid4().hex
+    body = bytearray()
+    for name, value in fields.items():
+        body += f"--{boundary}\r\nContent-Disposition: form-data; name=\"{name}\"\r\n\r\n{value}\r\n".encode()
+    body += (
+        f"--{boundary}\r\nContent-Disposition: form-data; name=\"{file_field}\"; filename=\"{filename}\"\r\n"
+        f"Content-Type: application/pdf\r\n\r\n"
+    ).encode()
+    body += content + f"\r\n--{boundary}--\r\n".encode()
+    return bytes(body), f"multipart/form-data; boundary={boundary}"
+
+
+def percentile(values: list, pct: float) -> float:
+    """Nearest-rank percentile"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(int(round(pct / 100.0 * len(ordered) + 0.5)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+def rss_kb(pids: list) -> int:
+    """Total resident set size of the given processes in KB"""
+    try:
+        output = subprocess.run(
+            ["ps", "-o", "rss=", "-p", ",".join(str(pid) for pid in pids)],
+            capture_output=True, text=True
+        ).stdout
+        return sum(int(line) for line in output.split() if line.strip().isdigit())
+    except Exception:
+        return 0
+
+
+def wait_until_ready(base_url: str, timeout: float = 60.0) -> bool:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with urllib.request.urlopen(base_url + "/", timeout=2):
+                return True
+        except Exception:
+            time.sleep(0.25)
+    return False
+
+
+def run_request(base_url: str, body: bytes, content_type: str, is_async: bool, timeout: float):
+    """Send one analysis request and wait for the final result"""
+    start = time.perf_counter()
+    request = urllib.request.Request(base_url + "/analyze", data=body, headers={"Content-Type": content_type})
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        payload = json.loads(response.read() or b"{}")
+    if is_async:
+        task_id = payload["task_id"]
+        while True:
+            with urllib.request.urlopen(f"{base_url}/results/{task_id}", timeout=timeout) as response:
+                status = json.loads(response.read()).get("status")
+            if status == "SUCCESS":
+                break
+            if status == "FAILURE":
+                raise RuntimeError(f"task {task_id} failed")
+            if time.perf_counter() - start > timeout:
+                raise TimeoutError(f"task {task_id} timed out")
+            time.sleep(0.1)
+    return time.perf_counter() - start
+
+
+def benchmark_entry(name: str, args, pool: str = None) -> dict:
+    """Start one entry point, load it, and collect statistics (with its Celery worker on pool, if given)"""
+    spec = ENTRY_POINTS[name]
+    env = dict(os.environ, LLM_BACKEND="mock", PYTHONUNBUFFERED="1")
+    if pool is not None:
+        concurrency = str(os.cpu_count() if pool == "prefork" else args.worker_concurrency)
+        env.update({"CELERY_WORKER_PROFILE": "llm", "CELERY_POOL": pool, "CELERY_CONCURRENCY": concurrency})
+        spec = dict(spec, worker=["-m", "celery", "-A", "celery_tasks", "worker", "--pool", pool,
+                                  "--concurrency", concurrency, "--loglevel=warning"])
+        name = f"{name}[{pool}]"
+    env.update({
+        "MOCK_LLM_LATENCY_MS": str(args.latency_ms),
+        "MOCK_LLM_TOKENS_PER_SEC": str(args.tokens_per_sec),
+        "MOCK_LLM_ERROR_RATE": str(args.error_rate),
+        # Every request should reach the (mock) model, not the shared response cache
+        "LLM_CACHE_TTL_SECONDS": "0",
+    })
+    cmd = [sys.executable] + spec["cmd"]
+    if spec.get("port_env"):
+        env["PORT"] = str(args.port)
+    else:
+        cmd += ["--port", str(args.port), "--log-level", "warning"]
+
+    processes = [subprocess.Popen(cmd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)]
+    if spec.get("worker"):
+        processes.append(subprocess.Popen([sys.executable] + spec["worker"], env=env,
+                                          stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+    base_url = f"http://127.0.0.1:{args.port}"
+    try:
+        if not wait_until_ready(base_url):
+            return {"entry": name, "error": "server did not start"}
+
+        pdf = make_synthetic_pdf(pages=args.pages)
+        body, content_type = encode_multipart({"query": QUERY}, "file", "SYNTH-Q2-2025-Update.pdf", pdf)
+        pids = [process.pid for process in processes]
+        baseline_rss = rss_kb(pids)
+        peak_rss = baseline_rss
+        latencies, errors = [], 0
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            futures = [
+                pool.submit(run_request, base_url, body, content_type, spec["async"], args.timeout)
+                for _ in range(args.requests)
+            ]
+            pending = set(futures)
+            while pending:
+                peak_rss = max(peak_rss, rss_kb(pids))
+                pending = {future for future in pending if not future.done()}
+                time.sleep(0.05)
+            for future in futures:
+                try:
+                    latencies.append(future.result())
+                except Exception:
+                    errors += 1
+        elapsed = time.perf_counter() - started
+
+        return {
+            "entry": name,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "errors": errors,
+            "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+            "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+            "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+            "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+            "baseline_rss_mb": round(baseline_rss / 1024, 1),
+            "peak_rss_mb": round(peak_rss / 1024, 1),
+        }
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+
+# Peak RSS of one PDF read, measured in a fresh interpreter so runs do not share a high-water mark.
+# VmHWM is used where available: ru_maxrss carries over the parent's peak across fork/exec.
+# Anonymous memory is sampled after every page: a mapped file's pages also count towards RSS,
+# but they are clean page cache the kernel can reclaim, unlike a private copy of the file.
+READER_PROBE = """
+import io, sys, json, time, resource
+mode, path = sys.argv[1], sys.argv[2]
+from pypdf import PdfReader
+from ingestion import iter_page_texts
+
+def status_kb(key):
+    try:
+        with open("/proc/self/status") as f:
+            return next(int(line.split()[1]) for line in f if line.startswith(key + ":"))
+    except (OSError, StopIteration):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss if key == "VmHWM" else 0
+
+baseline, baseline_anon = status_kb("VmHWM"), status_kb("RssAnon")
+peak_anon = 0
+
+def texts():
+    global peak_anon
+    if mode == "bytes":
+        with open(path, "rb") as f:
+            reader = PdfReader(io.BytesIO(f.read()))
+        pages = (page.extract_text() or "" for page in reader.pages)
+    else:
+        pages = iter_page_texts(path)
+    for text in pages:
+        peak_anon = max(peak_anon, status_kb("RssAnon") - baseline_anon)
+        yield text
+
+started = time.perf_counter()
+chars = sum(len(text) for text in texts())
+print(json.dumps({"chars": chars, "seconds": time.perf_counter() - started,
+                  "peak_rss_kb": status_kb("VmHWM") - baseline, "peak_anon_kb": peak_anon}))
+"""
+
+
+def benchmark_reader(size_mb: int, pages_per_mb: float) -> dict:
+    """
+    Compare peak RSS of loading a PDF into memory vs. the memory-mapped page reader.
+
+    The page count grows with the size (pages_per_mb, with a scanned image
+    filling out each page), so peak RSS is also reported per page.
+    """
+    root = os.path.dirname(os.path.abspath(__file__))
+    path = os.path.join(root, "data", f"bench-{size_mb}mb.pdf")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    pages = max(int(size_mb * pages_per_mb), 1)
+    with open(path, "wb") as f:
+        f.write(make_synthetic_pdf(pages=pages, image_bytes=size_mb * 1024 * 1024 // pages))
+    try:
+        result = {"size_mb": round(os.path.getsize(path) / 1024 ** 2, 1), "pages": pages}
+        for mode in ("bytes", "mmap"):
+            output = subprocess.run([sys.executable, "-c", READER_PROBE, mode, path], capture_output=True,
+                                    text=True, check=True, cwd=root).stdout
+            probe = json.loads(output)
+            result[f"{mode}_peak_mb"] = round(probe["peak_rss_kb"] / 1024, 1)
+            result[f"{mode}_anon_mb"] = round(probe["peak_anon_kb"] / 1024, 1)
+            result[f"{mode}_kb_per_page"] = round(probe["peak_rss_kb"] / pages, 1)
+            result[f"{mode}_seconds"] = round(probe["seconds"], 2)
+        return result
+    finally:
+        os.remove(path)
+
+
+def print_table(results: list):
+    if results and "size_mb" in results[0]:
+        columns = ["size_mb", "pages", "bytes_peak_mb", "mmap_peak_mb", "bytes_anon_mb", "mmap_anon_mb",
+                   "bytes_kb_per_page", "mmap_kb_per_page", "bytes_seconds", "mmap_seconds"]
+        print(" | ".join(f"{c:>17}" for c in columns))
+        print("-" * (20 * len(columns)))
+        for result in results:
+            print(" | ".join(f"{str(result[c]):>17}" for c in columns))
+        return
+    columns = ["entry", "throughput_rps", "p50_ms", "p95_ms", "p99_ms", "errors", "peak_rss_mb"]
+    print(" | ".join(f"{c:>16}" for c in columns))
+    print("-" * (19 * len(columns)))
+    for result in results:
+        if "error" in result:
+            print(f"{result['entry']:>16} | {result['error']}")
+            continue
+        print(" | ".join(f"{str(result[c]):>16}" for c in columns))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the analyzer entry points against the mock LLM")
+    parser.add_argument("--entry", action="append", choices=sorted(ENTRY_POINTS), help="entry point(s) to run (default: all)")
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--pages", type=int, default=5, help="pages in the synthetic PDF")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--timeout", type=float, default=300.0)
+    parser.add_argument("--latency-ms", type=float, default=200.0)
+    parser.add_argument("--tokens-per-sec", type=float, default=400.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--pools", help="comma-separated Celery pools to compare on new_main (prefork,threads,gevent)")
+    parser.add_argument("--worker-concurrency", type=int, default=32,
+                        help="Celery worker concurrency for the threads and gevent pools in --pools")
+    parser.add_argument("--memory", action="store_true",
+                        help="benchmark PDF reader memory instead of the entry points")
+    parser.add_argument("--sizes-mb", default="100,250", help="synthetic PDF sizes for --memory")
+    parser.add_argument("--pages-per-mb", type=float, default=4.0,
+                        help="page count per MB of the --memory PDFs (scanned filings run at about 2-10)")
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+
+    results = []
+    if args.memory:
+        for size_mb in (int(size) for size in args.sizes_mb.split(",")):
+            print(f"Reading a {size_mb} MB PDF...")
+            results.append(benchmark_reader(size_mb, args.pages_per_mb))
+    elif args.pools:
+        for pool in args.pools.split(","):
+            print(f"Benchmarking new_main with the {pool} pool...")
+            results.append(benchmark_entry("new_main", args, pool=pool.strip()))
+    else:
+        for name in args.entry or list(ENTRY_POINTS):
+            print(f"Benchmarking {name}...")
+            results.append(benchmark_entry(name, args))
+
+    print()
+    print_table(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
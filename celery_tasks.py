@@ -1,13 +1,35 @@
 import os
+import time
+import uuid
+import hashlib
+import threading
+import numpy as np
+from bson import ObjectId
 from celery import Celery
+from celery.exceptions import Reject
 from dotenv import load_dotenv
-from pymongo import MongoClient
-from datetime import datetime, timezone
+from pymongo import MongoClient, ReturnDocument
+from pymongo.errors import DuplicateKeyError, PyMongoError
+from datetime import datetime, timezone, timedelta
 
 from crewai import Crew, Process
 from agents import financial_analyst, verifier, investment_advisor, risk_assessor, llm
-from task import analyze_financial_document, investment_analysis, risk_assessment, verification
-from tools import financial_document_tool
+from task import analyze_financial_document, investment_analysis, risk_assessment, verification, quick_analysis
+from ingestion import get_pages, hash_page, detect_company_period
+from knowledge_store import current_subject
+from triage import sample_pages
+from analysis_index import AnalysisIndex, vectorize, figures_fingerprint, summarize, SIMILAR_RELATED_THRESHOLD
+from incremental import (find_previous_analysis, run_incremental_analysis, collect_task_outputs, seed_chunk_summaries,
+                         TASK_NAMES)
+from telemetry import setup_telemetry, stage, record_queue_wait, CrewTaskTimer
+from token_budget import TokenBudget, current_budget, chain_task_callbacks
+from model_routing import ModelUsage, current_usage
+from profiling import profile_run, profiled, list_artifacts, requested as profiling_requested
+from document_store import get_store
+from document_transport import materialize
+from structured_output import StructuredOutputCollector, llm_repairer, msgpack
+from run_control import RunControl, RunCancelled, current_control
+from worker_profiles import apply_worker_profile, task_deadline, delivery_exceeded
 
 load_dotenv()
 
@@ -16,58 +38,383 @@ celery_app = Celery(
     broker=os.getenv("CELERY_BROKER_URL", "redis://localhost:6379/0"),
     backend=os.getenv("CELERY_RESULT_BACKEND", "redis://localhost:6379/0")
 )
+if msgpack is not None:
+    # Smaller task messages and stored results than JSON; JSON is still accepted from older producers
+    celery_app.conf.update(task_serializer="msgpack", result_serializer="msgpack",
+                           accept_content=["msgpack", "json"])
+# Prefetch, acks_late, time limits and recycling for long LLM-bound tasks (CELERY_WORKER_PROFILE)
+apply_worker_profile(celery_app)
 
-mongo_client = MongoClient(os.getenv("MONGO_URI"))
-db = mongo_client.financial_analyzer_db
-results_collection = db.analysis_results
+# This process's MongoDB client, created on first use (see _database)
+_mongo = {"pid": None, "db": None}
+_mongo_lock = threading.Lock()
 
-def run_financial_crew(query: str, file_path: str):
-    """Initializes and runs the financial analysis crew."""
+# Window during which identical submissions share one task and its stored result
+RESULT_TTL_SECONDS = int(os.getenv("RESULT_TTL_SECONDS", "3600"))
+# How often the API's similarity index picks up analyses stored by the workers
+ANALYSIS_INDEX_REFRESH_SECONDS = float(os.getenv("ANALYSIS_INDEX_REFRESH_SECONDS", "5"))
+
+# Fields returned to the client when a stored analysis is served instead of a new run
+CACHED_RESULT_FIELDS = {"_id": 0, "analysis_output": 1, "structured": 1, "filename": 1, "mode": 1, "document_type": 1}
+
+def _database():
+    """
+    MongoDB database of this process.
+
+    PyMongo clients are not fork-safe, and this module is imported before
+    forking by a preloaded API (serve.py) and by Celery's prefork pool, so the
+    client is created on first use in each process instead of at import.
+    """
+    if _mongo["pid"] != os.getpid():
+        with _mongo_lock:
+            if _mongo["pid"] != os.getpid():
+                database = MongoClient(os.getenv("MONGO_URI")).financial_analyzer_db
+                try:
+                    # Mongo drops expired in-flight entries itself; claims also check expiry so the TTL is exact
+                    database.inflight_tasks.create_index("expires_at", expireAfterSeconds=0)
+                except PyMongoError as e:
+                    print(f"Could not create in-flight TTL index: {e}")
+                _mongo.update(pid=os.getpid(), db=database)
+    return _mongo["db"]
+
+def results_collection():
+    return _database().analysis_results
+
+def inflight_collection():
+    """One entry per (content hash, query) currently being analyzed, so identical uploads share a task"""
+    return _database().inflight_tasks
+
+setup_telemetry()
+# Evicts idle documents from this node's store, which is also the worker's locality cache
+get_store().start_janitor()
+
+# Crew layouts chosen by pre-flight triage: (agents, tasks, task names)
+PIPELINES = {
+    "full": (
+        [verifier, financial_analyst, investment_advisor, risk_assessor],
+        [verification, analyze_financial_document, investment_analysis, risk_assessment],
+        TASK_NAMES
+    ),
+    "light": ([financial_analyst], [quick_analysis], ["quick_analysis"]),
+}
+
+def find_duplicate_result(content_hash: str, query: str):
+    """Most recent completed analysis of identical content for the same query within the result TTL, if any."""
+    fresh_after = datetime.now(timezone.utc) - timedelta(seconds=RESULT_TTL_SECONDS)
+    return results_collection().find_one(
+        {"content_hash": content_hash, "query": query, "status": "completed", "created_at": {"$gte": fresh_after}},
+        CACHED_RESULT_FIELDS,
+        sort=[("created_at", -1)]
+    )
+
+# In-process similarity index over stored analyses, synced from MongoDB
+analysis_index = AnalysisIndex()
+_index_sync = {"checked": 0.0, "after": None}
+_index_sync_lock = threading.Lock()
+
+def _sync_analysis_index():
+    """Add analyses stored (by any worker) since the last sync to the in-process index."""
+    with _index_sync_lock:
+        if time.monotonic() - _index_sync["checked"] < ANALYSIS_INDEX_REFRESH_SECONDS:
+            return
+        _index_sync["checked"] = time.monotonic()
+        criteria = {"embedding": {"$exists": True}, "status": "completed"}
+        if _index_sync["after"] is not None:
+            # Overlap a little so entries from workers with skewed clocks are not missed; add() skips known ids
+            criteria["indexed_at"] = {"$gte": _index_sync["after"] - timedelta(seconds=60)}
+        entries = results_collection().find(
+            criteria, {"embedding": 1, "figures": 1, "indexed_at": 1, "query": 1, "company": 1, "period": 1,
+                       "filename": 1, "summary": 1, "created_at": 1}
+        ).sort("indexed_at", 1)
+        for entry in entries:
+            analysis_index.add(str(entry["_id"]), np.frombuffer(entry["embedding"], dtype=np.float32), {
+                "query": entry.get("query"), "company": entry.get("company"), "period": entry.get("period"),
+                "figures": entry.get("figures"), "filename": entry.get("filename"), "summary": entry.get("summary", ""),
+                "created_at": entry.get("created_at"),
+            })
+            _index_sync["after"] = entry["indexed_at"]
+
+def find_similar_analyses(sample_text: str, query: str, filename: str = ""):
+    """
+    Look up stored analyses similar to an upload (triage's lookup_similar hook).
+
+    A near-identical filing of the same company and period, with exactly the
+    same figures on the sampled pages, analyzed for the same query within the
+    result TTL is returned as cached_result. Similar filings that differ in
+    any figure (a restatement, the next quarter) and earlier analyses of the
+    same company are only condensed into prior_summary for the crew.
+    """
+    try:
+        _sync_analysis_index()
+    except PyMongoError as e:
+        print(f"Could not refresh the analysis index: {e}")
+    vector = vectorize(sample_text)
+    matches = analysis_index.search(vector, k=5, min_score=SIMILAR_RELATED_THRESHOLD)
+    company, period = detect_company_period(sample_text, filename)
+
+    cached_result = None
+    fresh_after = datetime.now(timezone.utc) - timedelta(seconds=RESULT_TTL_SECONDS)
+    for score, analysis_id, meta in analysis_index.near_duplicates(
+            vector, query=query, company=company, period=period, figures=figures_fingerprint(sample_text)):
+        cached_result = results_collection().find_one(
+            {"_id": ObjectId(analysis_id), "status": "completed", "created_at": {"$gte": fresh_after}},
+            CACHED_RESULT_FIELDS
+        )
+        if cached_result is not None:
+            cached_result["similarity"] = round(score, 4)
+            break
+
+    related = [(score, analysis_id, meta) for score, analysis_id, meta in matches]
+    if company:
+        seen = {analysis_id for _, analysis_id, _ in related}
+        related += [(None, analysis_id, meta) for analysis_id, meta in analysis_index.latest("company", company)
+                    if analysis_id not in seen]
+
+    prior = []
+    for score, analysis_id, meta in related[:3]:
+        match = "same company" if score is None else f"similarity {score:.2f}"
+        prior.append(f"- {meta['filename']} ({meta['company'] or 'unknown company'}, "
+                     f"{meta['period'] or 'unknown period'}; {match}): {meta['summary']}")
+    return {
+        "matches": [{"analysis_id": analysis_id, "score": None if score is None else round(score, 4),
+                     "filename": meta["filename"], "company": meta["company"], "period": meta["period"]}
+                    for score, analysis_id, meta in related],
+        "prior_summary": "\n".join(prior),
+        "cached_result": cached_result,
+    }
+
+def _inflight_key(content_hash: str, query: str) -> str:
+    return f"{content_hash}:{hashlib.sha256(query.encode('utf-8')).hexdigest()[:16]}"
+
+def claim_inflight_task(content_hash: str, query: str, task_id: str):
+    """
+    Register task_id as the run for this content and query.
+
+    Returns None if the caller now owns the run and should enqueue it, or the
+    id of the live task it should attach to instead. Entries older than
+    RESULT_TTL_SECONDS, or whose task failed, are taken over by the caller.
+    """
+    key = _inflight_key(content_hash, query)
+    now = time.time()
+    claim = {"task_id": task_id, "expires_ts": now + RESULT_TTL_SECONDS,
+             "expires_at": datetime.now(timezone.utc) + timedelta(seconds=RESULT_TTL_SECONDS)}
+    try:
+        existing = inflight_collection().find_one_and_update(
+            {"_id": key}, {"$setOnInsert": claim}, upsert=True, return_document=ReturnDocument.BEFORE
+        )
+    except DuplicateKeyError:
+        # Another API process inserted the same key between our lookup and upsert
+        existing = inflight_collection().find_one({"_id": key})
+    if existing is None:
+        return None
+
+    state = process_document_task.AsyncResult(existing["task_id"]).state
+    if existing["expires_ts"] > now and state not in ("FAILURE", "REVOKED"):
+        return existing["task_id"]
+    # Stale or failed: take it over unless another request got there first
+    taken = inflight_collection().find_one_and_update(
+        {"_id": key, "task_id": existing["task_id"]}, {"$set": claim}
+    )
+    if taken is not None:
+        return None
+    winner = inflight_collection().find_one({"_id": key})
+    return winner["task_id"] if winner else None
+
+def release_inflight_task(content_hash: str, query: str, task_id: str):
+    """Drop a claim whose task could not be enqueued."""
+    inflight_collection().delete_one({"_id": _inflight_key(content_hash, query), "task_id": task_id})
+
+def run_financial_crew(query: str, file_path: str, pipeline: str = "full", usage: ModelUsage = None,
+                       prior_summary: str = None, structured: StructuredOutputCollector = None):
+    """
+    Initializes and runs the financial analysis crew, optionally primed with earlier analyses.
+
+    structured, if given, collects each task's validated JSON output.
+    """
+    agents, tasks, task_names = PIPELINES[pipeline]
+    timer = CrewTaskTimer(task_names)
+    budget = TokenBudget(task_names)
+    usage = usage or ModelUsage()
+
+    budget_token = current_budget.set(budget)
+    usage_token = current_usage.set(usage)
     try:
         financial_crew = Crew(
-            agents=[verifier, financial_analyst, investment_advisor, risk_assessor],
-            tasks=[verification, analyze_financial_document, investment_analysis, risk_assessment],
+            agents=agents,
+            tasks=tasks,
             process=Process.sequential,
             memory=True,  # This is the correct way to enable context sharing
             verbose=True,
-            manager_llm=llm
+            manager_llm=llm,
+            task_callback=chain_task_callbacks(budget, timer, structured)
         )
 
         # The line "verification.shared = True" has been removed as it is no longer supported.
 
-        result = financial_crew.kickoff({'query': query, 'file_path': file_path})
+        if prior_summary:
+            query = f"{query}\n\nEarlier analyses of similar filings (use as background, verify against this document):\n{prior_summary}"
+        with stage("crew.kickoff", tasks=len(task_names), pipeline=pipeline):
+            result = financial_crew.kickoff({'query': query, 'file_path': file_path})
         return result
     except Exception as e:
+        # Fail the run rather than store the error as a completed analysis
         print(f"Error running financial crew: {e}")
-        return {"error": str(e)}
+        raise
+    finally:
+        current_budget.reset(budget_token)
+        current_usage.reset(usage_token)
+        budget.log_summary()
+        usage.log_summary()
 
 @celery_app.task
-def process_document_task(query: str, file_path: str, original_filename: str):
+def process_document_task(query: str, file_path: str, original_filename: str,
+                          incremental: bool = False, company: str = None, period: str = None,
+                          enqueued_at: float = None, profile: bool = False,
+                          pipeline: str = "full", content_hash: str = None, document_type: str = None,
+                          document_id: str = None, document_ref: str = None, prior_summary: str = None):
     """
     Celery task to process a document, run the AI crew, and save to MongoDB.
+
+    With incremental=True, an amended document is diffed page by page against the
+    most recent analysis of the same company/period and only the changed chunks
+    are re-analyzed. pipeline is the crew layout chosen by triage ("full" or
+    "light"). prior_summary, from the similarity index, primes the crew with
+    earlier analyses of similar filings. Documents handed over through the
+    document store (document_id) are read from this node's store, fetched
+    through the document transport if they are not already here, and released
+    when done instead of deleted; document_ref is the API's reference when the
+    API and the worker share one store. With
+    profile=True (or PROFILE_ENABLED on the worker), profiling artifacts are
+    stored under the task id. The run's LLM calls stop at the worker profile's
+    soft time limit, also under pools that cannot interrupt a task.
     """
     print(f"Starting analysis for: {original_filename}")
-    
-    financial_document_tool.file_path = file_path
-    
-    analysis_result = run_financial_crew(query=query, file_path=file_path)
-    
+    if delivery_exceeded(process_document_task.request.id):
+        # Every earlier delivery died with its worker; drop the message instead of crashing the next one
+        if document_id is not None and document_ref is not None:
+            get_store().release(document_id, document_ref)
+        raise Reject(f"{original_filename} was delivered too many times without finishing", requeue=False)
+    if enqueued_at is not None:
+        record_queue_wait(max(time.time() - enqueued_at, 0.0))
+
+    profile_id = process_document_task.request.id or str(uuid.uuid4())
+    profile_enabled = profiling_requested(flag=profile)
+    local_ref = None
+    if document_id is not None:
+        # Locality cache: documents already on this node are not fetched again
+        try:
+            file_path, local_ref = materialize(document_id)
+        except Exception:
+            if document_ref is not None:
+                get_store().release(document_id, document_ref)
+            raise
+    deadline = task_deadline()
+    control_token = current_control.set(RunControl(deadline)) if deadline else None
+    with profile_run(profile_id, enabled=profile_enabled):
+        try:
+            return _process_document(query, file_path, original_filename, incremental, company, period,
+                                     profile_id if profile_enabled else None, pipeline, content_hash, document_type,
+                                     prior_summary)
+        except RunCancelled as e:
+            # A BaseException would escape Celery's failure handling; record it as a failed task
+            raise TimeoutError(str(e)) from e
+        finally:
+            if control_token is not None:
+                current_control.reset(control_token)
+            if document_id is not None:
+                get_store().release(document_id, local_ref)
+                if document_ref is not None:
+                    get_store().release(document_id, document_ref)
+            elif os.path.exists(file_path):
+                os.remove(file_path)
+                print(f"Cleaned up temporary file: {file_path}")
+
+def _process_document(query, file_path, original_filename, incremental, company, period, profile_id,
+                      pipeline="full", content_hash=None, document_type=None, prior_summary=None):
+    """Parse, analyze (fully or incrementally) and store one document."""
+    with stage("pdf.parse"), profiled("extract_pages"):
+        pages = get_pages(file_path)
+    page_hashes = [hash_page(text) for text in pages]
+    detected_company, detected_period = detect_company_period("\n".join(pages), original_filename)
+    company = company or detected_company
+    period = period or detected_period
+
+    previous = None
+    if incremental:
+        with stage("mongo.find_previous"):
+            previous = find_previous_analysis(results_collection(), company, period)
+
     db_entry = {
         "filename": original_filename,
         "query": query,
-        "analysis_output": str(analysis_result),
+        "company": company,
+        "period": period,
+        "page_hashes": page_hashes,
+        "content_hash": content_hash,
+        "document_type": document_type,
         "status": "completed",
         "created_at": datetime.now(timezone.utc)
     }
+
+    usage = ModelUsage()
+    subject_token = current_subject.set((company, period))
+    try:
+        if previous is not None:
+            usage_token = current_usage.set(usage)
+            try:
+                incremental_result = run_incremental_analysis(query, file_path, pages, previous)
+            finally:
+                current_usage.reset(usage_token)
+            analysis_result = incremental_result["analysis_output"]
+            db_entry.update({
+                "mode": "incremental",
+                "based_on": previous.get("_id"),
+                "chunk_summaries": incremental_result["chunk_summaries"],
+                "task_outputs": incremental_result["task_outputs"],
+                "carried_over": incremental_result["carried_over"],
+                "changed_pages": incremental_result["changed_pages"],
+                "structured": incremental_result["structured"],
+            })
+        else:
+            structured = StructuredOutputCollector(PIPELINES[pipeline][2], repair=llm_repairer(llm))
+            with profiled("run_financial_crew"):
+                analysis_result = run_financial_crew(query=query, file_path=file_path, pipeline=pipeline, usage=usage,
+                                                     prior_summary=prior_summary, structured=structured)
+            db_entry.update({
+                "mode": pipeline,
+                # Extractive until an amendment re-summarizes the chunks it changes
+                "chunk_summaries": seed_chunk_summaries(pages),
+                "task_outputs": collect_task_outputs(analysis_result, PIPELINES[pipeline][2]),
+                "structured": structured.structured,
+            })
+    except Exception as e:
+        # Kept for the record, but never served as a cached result, coalesced on or indexed
+        db_entry.update({"status": "failed", "error": str(e), "model_usage": usage.summary()})
+        try:
+            results_collection().insert_one(db_entry)
+        except Exception as insert_error:
+            print(f"Error saving failed analysis to MongoDB: {insert_error}")
+        raise
+    finally:
+        current_subject.reset(subject_token)
+
+    db_entry["analysis_output"] = str(analysis_result)
+    db_entry["model_usage"] = usage.summary()
+    # Indexed for similarity lookups on later uploads (same page sample as triage)
+    sample_text = "\n".join(sample_pages(pages))
+    db_entry["embedding"] = vectorize(sample_text).tobytes()
+    db_entry["figures"] = figures_fingerprint(sample_text)
+    db_entry["summary"] = summarize(db_entry["analysis_output"])
+    if profile_id:
+        db_entry["profile_id"] = profile_id
+        db_entry["profile_artifacts"] = list_artifacts(profile_id)
     
     try:
-        results_collection.insert_one(db_entry)
+        with stage("mongo.insert"):
+            db_entry["indexed_at"] = datetime.now(timezone.utc)
+            results_collection().insert_one(db_entry)
         print(f"Successfully saved analysis for {original_filename} to MongoDB.")
     except Exception as e:
         print(f"Error saving to MongoDB: {e}")
-    finally:
-        if os.path.exists(file_path):
-            os.remove(file_path)
-            print(f"Cleaned up temporary file: {file_path}")
-            
-    return str(analysis_result)
\ No newline at end of file
+
+    return {"analysis_output": db_entry["analysis_output"], "structured": db_entry["structured"]}
@@ -0,0 +1,120 @@
+"""
+Bounded, paginated access to a parsed document for the agents.
+
+Instead of handing an agent the whole file in one tool call, agents pull
+only the slices they need: a page range, keyword hits with context, or a
+named financial statement. Every result is capped at MAX_TOOL_CHARS.
+"""
+import os
+import re
+
+MAX_TOOL_CHARS = int(os.getenv("MAX_TOOL_CHARS", "6000"))
+MAX_SEARCH_HITS = int(os.getenv("MAX_SEARCH_HITS", "10"))
+SEARCH_CONTEXT_CHARS = 240
+
+# Headings each named section is commonly printed under
+SECTION_ALIASES = {
+    "balance sheet": ["balance sheet", "statement of financial position", "statements of financial position"],
+    "income statement": ["income statement", "statement of operations", "statements of operations",
+                         "statement of income", "statements of income", "profit and loss", "statement of earnings"],
+    "cash flow": ["statement of cash flows", "statements of cash flows", "cash flow statement", "cash flows"],
+    "equity": ["stockholders' equity", "shareholders' equity", "statement of changes in equity"],
+    "risk factors": ["risk factors"],
+    "md&a": ["management's discussion and analysis", "management’s discussion and analysis", "md&a"],
+    "notes": ["notes to consolidated financial statements", "notes to the financial statements"],
+    "highlights": ["financial summary", "highlights", "financial highlights"],
+    "outlook": ["outlook", "guidance"],
+}
+
+_NUMBER = re.compile(r"\(?-?[$€£]?\d[\d,]*\.?\d*\)?%?")
+
+
+def _clip(text: str, limit: int = MAX_TOOL_CHARS) -> str:
+    if len(text) <= limit:
+        return text
+    return text[:limit] + f"\n[... {len(text) - limit} more characters; request a narrower range]"
+
+
+def _aliases(section: str) -> list:
+    key = section.strip().lower()
+    for name, aliases in SECTION_ALIASES.items():
+        if key == name or key in aliases:
+            return aliases
+    return [key]
+
+
+def read_pages(pages: list, start: int, end: int = None) -> str:
+    """Text of pages start..end (1-based, inclusive)"""
+    if not pages:
+        return "The document has no extractable text."
+    end = start if end is None else end
+    start = max(int(start), 1)
+    end = min(int(end), len(pages))
+    if start > end:
+        return f"Invalid page range. The document has {len(pages)} pages."
+    parts = [f"--- Page {number} of {len(pages)} ---\n{pages[number - 1]}" for number in range(start, end + 1)]
+    return _clip("\n".join(parts))
+
+
+def search(pages: list, term: str) -> str:
+    """Keyword hits with surrounding context and page numbers"""
+    if not term or not term.strip():
+        return "Provide a search term."
+    pattern = re.compile(re.escape(term.strip()), re.IGNORECASE)
+    hits = []
+    for number, text in enumerate(pages, start=1):
+        for match in pattern.finditer(text):
+            left = max(match.start() - SEARCH_CONTEXT_CHARS // 2, 0)
+            right = min(match.end() + SEARCH_CONTEXT_CHARS // 2, len(text))
+            snippet = " ".join(text[left:right].split())
+            hits.append(f"[page {number}] ...{snippet}...")
+            if len(hits) >= MAX_SEARCH_HITS:
+                break
+        if len(hits) >= MAX_SEARCH_HITS:
+            break
+    if not hits:
+        return f"No matches for '{term}'."
+    return _clip(f"{len(hits)} match(es) for '{term}':\n" + "\n".join(hits))
+
+
+def find_section_page(pages: list, section: str):
+    """
+    Page number (1-based) where a section most likely starts, or None.
+
+    A heading can also appear in the table of contents, so among pages that
+    mention it, the one with the densest figures is taken as the statement itself.
+    """
+    aliases = _aliases(section)
+    best, best_score = None, 0.0
+    for number, text in enumerate(pages, start=1):
+        lowered = text.lower()
+        if not any(alias in lowered for alias in aliases):
+            continue
+        heading_bonus = 2.0 if any(re.search(rf"^\s*(consolidated\s+)?{re.escape(a)}", lowered, re.MULTILINE) for a in aliases) else 1.0
+        score = heading_bonus * (len(_NUMBER.findall(text)) + 1)
+        if score > best_score:
+            best, best_score = number, score
+    return best
+
+
+def get_section(pages: list, section: str) -> str:
+    """Text of a named section (e.g. "balance sheet"), starting at its page"""
+    number = find_section_page(pages, section)
+    if number is None:
+        return f"Section '{section}' was not found. Try the search tool with a related term."
+    return read_pages(pages, number, min(number + 1, len(pages)))
+
+
+def outline(pages: list) -> str:
+    """Page count, detected sections and the start of the first page"""
+    found = []
+    for name in SECTION_ALIASES:
+        number = find_section_page(pages, name)
+        if number is not None:
+            found.append(f"- {name}: page {number}")
+    first_page = " ".join((pages[0] if pages else "").split())[:600]
+    return _clip(
+        f"Pages: {len(pages)}\n"
+        f"Detected sections:\n" + ("\n".join(found) or "- none detected") +
+        f"\nFirst page excerpt: {first_page}"
+    )
@@ -0,0 +1,250 @@
+"""
+Content-addressed store for uploaded documents.
+
+Uploads are written once to DOCUMENT_STORE_DIR under their SHA-256, so
+identical uploads share one file. The default is a directory on tmpfs
+(/dev/shm) when available, otherwise data/store. The API and Celery
+workers must see the same directory. Each holder takes a reference, which
+is a small marker file, so counting works across processes. Taking a
+reference and the janitor's final check-and-remove run under an flock on
+the document's lock file, so a document cannot be removed between another
+process taking a reference and finding the file. Readers get read-only
+memory-mapped views instead of copies.
+
+A janitor thread sweeps the store every DOCUMENT_STORE_SWEEP_SECONDS:
+
+- files with no references are removed after DOCUMENT_STORE_IDLE_SECONDS;
+- references older than DOCUMENT_STORE_MAX_AGE_SECONDS are treated as
+  leaked (e.g. a crashed worker) and dropped;
+- while the store is above DOCUMENT_STORE_MAX_BYTES, unreferenced files
+  are evicted oldest first;
+- resumable uploads (uploads.py) idle for DOCUMENT_STORE_MAX_AGE_SECONDS
+  are removed.
+
+memfd was not used because the descriptor would not be visible to the
+worker process.
+"""
+import os
+import mmap
+import time
+import uuid
+import shutil
+import hashlib
+import threading
+from contextlib import contextmanager
+
+from telemetry import registry
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+def _default_root() -> str:
+    if os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK):
+        return "/dev/shm/financial-analyzer"
+    return os.path.join("data", "store")
+
+
+DOCUMENT_STORE_DIR = os.getenv("DOCUMENT_STORE_DIR") or _default_root()
+DOCUMENT_STORE_MAX_BYTES = int(os.getenv("DOCUMENT_STORE_MAX_BYTES", str(2 * 1024 ** 3)))
+DOCUMENT_STORE_IDLE_SECONDS = int(os.getenv("DOCUMENT_STORE_IDLE_SECONDS", "300"))
+DOCUMENT_STORE_MAX_AGE_SECONDS = int(os.getenv("DOCUMENT_STORE_MAX_AGE_SECONDS", str(6 * 3600)))
+DOCUMENT_STORE_SWEEP_SECONDS = int(os.getenv("DOCUMENT_STORE_SWEEP_SECONDS", "60"))
+
+registry.describe("analyzer_document_store_bytes", "gauge", "Bytes held by the document store")
+registry.describe("analyzer_document_store_files", "gauge", "Documents held by the document store")
+registry.describe("analyzer_document_store_evictions_total", "counter", "Documents removed by the janitor")
+
+
+class DocumentStore:
+    """Content-addressed, reference-counted document files"""
+
+    def __init__(self, root: str = DOCUMENT_STORE_DIR):
+        self.root = root
+        self.objects_dir = os.path.join(root, "objects")
+        self.refs_dir = os.path.join(root, "refs")
+        # Lock files, one per hash prefix so their number stays bounded; never removed
+        self.locks_dir = os.path.join(root, "locks")
+        # Resumable uploads being assembled (uploads.py); same filesystem, so adopting one is a rename
+        self.uploads_dir = os.path.join(root, "uploads")
+        os.makedirs(self.objects_dir, exist_ok=True)
+        os.makedirs(self.refs_dir, exist_ok=True)
+        os.makedirs(self.locks_dir, exist_ok=True)
+        self._janitor = None
+
+    def path(self, doc_id: str) -> str:
+        return os.path.join(self.objects_dir, f"{doc_id}.pdf")
+
+    def put(self, content: bytes) -> tuple:
+        """Store content (once per hash) and take a reference; returns (doc_id, ref)"""
+        doc_id = hashlib.sha256(content).hexdigest()
+        ref = self.acquire(doc_id)
+        path = self.path(doc_id)
+        if not os.path.exists(path):
+            # Write-then-rename so readers never see a partial file
+            temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+            with open(temp_path, "wb") as f:
+                f.write(content)
+            os.replace(temp_path, path)
+        return doc_id, ref
+
+    def adopt(self, path: str, doc_id: str) -> str:
+        """Move a fully written file into the store as doc_id (its SHA-256) and take a reference"""
+        ref = self.acquire(doc_id)
+        if os.path.exists(self.path(doc_id)):
+            os.remove(path)
+        else:
+            os.replace(path, self.path(doc_id))
+        return ref
+
+    @contextmanager
+    def _locked(self, doc_id: str):
+        """Exclusive lock on a document across threads and processes (flock on a separate descriptor)"""
+        if fcntl is None:
+            yield
+            return
+        with open(os.path.join(self.locks_dir, doc_id[:2]), "a") as lock:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock.fileno(), fcntl.LOCK_UN)
+
+    def acquire(self, doc_id: str) -> str:
+        """Take a reference on a document; hold it until release()"""
+        ref_dir = os.path.join(self.refs_dir, doc_id)
+        ref = uuid.uuid4().hex
+        with self._locked(doc_id):
+            os.makedirs(ref_dir, exist_ok=True)
+            open(os.path.join(ref_dir, ref), "w").close()
+        return ref
+
+    def release(self, doc_id: str, ref: str):
+        """Drop a reference; the janitor removes the file once it is unreferenced and idle"""
+        # Removing the marker also bumps the refs directory's mtime, which the janitor reads as last use
+        try:
+            os.remove(os.path.join(self.refs_dir, doc_id, ref))
+        except FileNotFoundError:
+            pass
+
+    def refcount(self, doc_id: str) -> int:
+        try:
+            return len(os.listdir(os.path.join(self.refs_dir, doc_id)))
+        except FileNotFoundError:
+            return 0
+
+    @contextmanager
+    def view(self, doc_id: str):
+        """Read-only memory-mapped view of a document"""
+        with open_view(self.path(doc_id)) as mapped:
+            yield mapped
+
+    def _remove(self, doc_id: str, reason: str) -> bool:
+        with self._locked(doc_id):
+            if self.refcount(doc_id):
+                # Re-referenced since the sweep looked at it
+                return False
+            for path in (self.path(doc_id), os.path.join(self.refs_dir, doc_id)):
+                try:
+                    os.rmdir(path) if os.path.isdir(path) else os.remove(path)
+                except OSError:
+                    pass
+        registry.inc("analyzer_document_store_evictions_total", labels={"reason": reason})
+        return True
+
+    def sweep(self) -> dict:
+        """One janitor pass: drop leaked references, then idle and over-budget files"""
+        now = time.time()
+        entries = []
+        for name in os.listdir(self.objects_dir):
+            path = os.path.join(self.objects_dir, name)
+            if name.endswith(".tmp"):
+                # Leftover from a writer that died mid-upload
+                try:
+                    if now - os.path.getmtime(path) > DOCUMENT_STORE_MAX_AGE_SECONDS:
+                        os.remove(path)
+                except FileNotFoundError:
+                    pass
+                continue
+            doc_id = name[:-len(".pdf")]
+            ref_dir = os.path.join(self.refs_dir, doc_id)
+            try:
+                stat = os.stat(path)
+                last_used = stat.st_mtime
+                if os.path.isdir(ref_dir):
+                    for ref in os.listdir(ref_dir):
+                        ref_path = os.path.join(ref_dir, ref)
+                        if now - os.path.getmtime(ref_path) > DOCUMENT_STORE_MAX_AGE_SECONDS:
+                            os.remove(ref_path)
+                    last_used = max(last_used, os.path.getmtime(ref_dir))
+            except FileNotFoundError:
+                # Removed concurrently by another process's janitor
+                continue
+            entries.append((last_used, stat.st_size, doc_id, self.refcount(doc_id)))
+
+        removed = 0
+        total = sum(size for _, size, _, _ in entries)
+        for last_used, size, doc_id, refs in sorted(entries):
+            idle = refs == 0 and now - last_used > DOCUMENT_STORE_IDLE_SECONDS
+            over_budget = refs == 0 and total > DOCUMENT_STORE_MAX_BYTES
+            if (idle or over_budget) and self._remove(doc_id, "idle" if idle else "size"):
+                total -= size
+                removed += 1
+
+        if os.path.isdir(self.uploads_dir):
+            for upload_id in os.listdir(self.uploads_dir):
+                # Abandoned or long-finished resumable uploads; their document reference expires with them
+                upload_dir = os.path.join(self.uploads_dir, upload_id)
+                try:
+                    last_used = max(os.path.getmtime(upload_dir), os.path.getmtime(os.path.join(upload_dir, "ranges")))
+                except OSError:
+                    last_used = 0
+                if now - last_used > DOCUMENT_STORE_MAX_AGE_SECONDS:
+                    shutil.rmtree(upload_dir, ignore_errors=True)
+
+        registry.set("analyzer_document_store_bytes", total)
+        registry.set("analyzer_document_store_files", len(entries) - removed)
+        return {"files": len(entries) - removed, "bytes": total, "removed": removed}
+
+    def start_janitor(self, interval: int = DOCUMENT_STORE_SWEEP_SECONDS):
+        """Sweep periodically on a daemon thread (idempotent)"""
+        if self._janitor is not None:
+            return
+
+        def loop():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.sweep()
+                except Exception as e:
+                    print(f"Document store sweep failed: {e}")
+
+        self._janitor = threading.Thread(target=loop, name="document-store-janitor", daemon=True)
+        self._janitor.start()
+
+
+@contextmanager
+def open_view(path: str):
+    """Read-only memory map of a file; pypdf reads it like any other stream"""
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            yield f
+            return
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            yield mapped
+        finally:
+            mapped.close()
+
+
+_store = None
+
+
+def get_store() -> DocumentStore:
+    """The process-wide store"""
+    global _store
+    if _store is None:
+        _store = DocumentStore()
+    return _store
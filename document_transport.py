@@ -0,0 +1,349 @@
+"""
+How documents get from the API to the Celery workers.
+
+The document store (document_store.py) is local to a node. With the default
+"shared" transport, DOCUMENT_STORE_DIR must be one directory seen by the API
+and every worker, which ties them to one machine or a shared mount. The other
+transports (DOCUMENT_TRANSPORT) let N API nodes and M worker nodes share
+nothing but the broker and the blob store:
+
+    shared    workers read the API's store directory (single node, default)
+    object    content-addressed blobs in an object store: an S3/MinIO bucket
+              (DOCUMENT_OBJECT_STORE=s3://bucket/prefix, with
+              DOCUMENT_OBJECT_STORE_ENDPOINT for MinIO; needs boto3) or a
+              directory standing in for one (any other value)
+    broker    the blob is kept in the broker's Redis under its hash for
+              DOCUMENT_BROKER_TTL_SECONDS (default 6 hours), and the task
+              message carries only the hash; limited to
+              DOCUMENT_BROKER_MAX_BYTES (default 64 MiB)
+
+Blobs are keyed by SHA-256, so each document is published once however often
+it is submitted. Object-store blobs older than DOCUMENT_OBJECT_TTL_SECONDS are
+deleted by the publishing API (at most every DOCUMENT_OBJECT_SWEEP_SECONDS);
+a blob published again after half its TTL is re-uploaded, so a queued task
+always has at least half the TTL to fetch it. Set the TTL to 0 to leave
+retention to a bucket lifecycle rule instead.
+
+A completed resumable upload is published right away, with a small record
+under its upload_id, so /analyze?upload_id= works on any API node. Chunks are
+still assembled on the node that created the upload: route /uploads/{id}
+requests by upload_id. On the worker, the local document store is a locality cache:
+materialize() serves a document already on the node without fetching it,
+otherwise fetches it once, checks its hash, and keeps it until the store's
+janitor evicts it.
+"""
+import os
+import time
+import uuid
+import json
+import shutil
+import hashlib
+import threading
+from datetime import datetime, timezone
+
+from telemetry import record_cache, stage
+from document_store import get_store
+
+DOCUMENT_TRANSPORT = os.getenv("DOCUMENT_TRANSPORT", "shared")
+DOCUMENT_OBJECT_STORE = os.getenv("DOCUMENT_OBJECT_STORE", os.path.join("data", "objects"))
+DOCUMENT_OBJECT_STORE_ENDPOINT = os.getenv("DOCUMENT_OBJECT_STORE_ENDPOINT")
+DOCUMENT_BROKER_URL = os.getenv("DOCUMENT_BROKER_URL") or os.getenv("CELERY_BROKER_URL", "redis://localhost:6379/0")
+DOCUMENT_BROKER_TTL_SECONDS = int(os.getenv("DOCUMENT_BROKER_TTL_SECONDS", str(6 * 3600)))
+DOCUMENT_BROKER_MAX_BYTES = int(os.getenv("DOCUMENT_BROKER_MAX_BYTES", str(64 * 1024 ** 2)))
+DOCUMENT_OBJECT_TTL_SECONDS = int(os.getenv("DOCUMENT_OBJECT_TTL_SECONDS", str(6 * 3600)))
+DOCUMENT_OBJECT_SWEEP_SECONDS = int(os.getenv("DOCUMENT_OBJECT_SWEEP_SECONDS", "3600"))
+
+
+class SharedStoreTransport:
+    """Workers read the API's document store directly"""
+
+    name = "shared"
+    # The API's store reference must be held until the worker is done with the file
+    shared = True
+
+    def publish(self, doc_id: str, path: str):
+        pass
+
+    def fetch(self, doc_id: str, dest: str):
+        raise FileNotFoundError(f"Document {doc_id} is not in the shared store {get_store().root}; "
+                                "set DOCUMENT_STORE_DIR to the API's directory or use another DOCUMENT_TRANSPORT")
+
+
+class DirectoryBlobs:
+    """A directory standing in for an object store (a shared mount, or local for development)"""
+
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], key)
+
+    def age(self, key: str):
+        """Seconds since the blob was written, or None if it does not exist"""
+        try:
+            return time.time() - os.path.getmtime(self._path(key))
+        except FileNotFoundError:
+            return None
+
+    def put_file(self, key: str, path: str):
+        target = self._path(key)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        temp_path = f"{target}.{uuid.uuid4().hex}.tmp"
+        shutil.copyfile(path, temp_path)
+        os.replace(temp_path, target)
+
+    def get_file(self, key: str, dest: str):
+        shutil.copyfile(self._path(key), dest)
+
+    def put_bytes(self, key: str, data: bytes):
+        target = self._path(key)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        temp_path = f"{target}.{uuid.uuid4().hex}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, target)
+
+    def get_bytes(self, key: str):
+        try:
+            with open(self._path(key), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def delete_older_than(self, seconds: float) -> int:
+        removed = 0
+        cutoff = time.time() - seconds
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                try:
+                    if os.path.getmtime(path) < cutoff:
+                        os.remove(path)
+                        removed += 1
+                except FileNotFoundError:
+                    pass
+        return removed
+
+
+class S3Blobs:
+    """An S3 bucket, or MinIO through DOCUMENT_OBJECT_STORE_ENDPOINT"""
+
+    def __init__(self, url: str, endpoint: str = None):
+        import boto3
+        from botocore.exceptions import ClientError
+
+        self._missing = ClientError
+        bucket, _, prefix = url[len("s3://"):].partition("/")
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        self.client = boto3.client("s3", endpoint_url=endpoint)
+
+    def _key(self, key: str) -> str:
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    def age(self, key: str):
+        """Seconds since the blob was written, or None if it does not exist"""
+        try:
+            head = self.client.head_object(Bucket=self.bucket, Key=self._key(key))
+        except self._missing:
+            return None
+        return (datetime.now(timezone.utc) - head["LastModified"]).total_seconds()
+
+    def put_file(self, key: str, path: str):
+        # Multipart for large files, streamed from disk
+        self.client.upload_file(path, self.bucket, self._key(key))
+
+    def get_file(self, key: str, dest: str):
+        self.client.download_file(self.bucket, self._key(key), dest)
+
+    def put_bytes(self, key: str, data: bytes):
+        self.client.put_object(Bucket=self.bucket, Key=self._key(key), Body=data)
+
+    def get_bytes(self, key: str):
+        try:
+            return self.client.get_object(Bucket=self.bucket, Key=self._key(key))["Body"].read()
+        except self._missing:
+            return None
+
+    def delete_older_than(self, seconds: float) -> int:
+        removed = 0
+        now = datetime.now(timezone.utc)
+        pages = self.client.get_paginator("list_objects_v2").paginate(
+            Bucket=self.bucket, Prefix=f"{self.prefix}/" if self.prefix else "")
+        for page in pages:
+            expired = [{"Key": item["Key"]} for item in page.get("Contents", [])
+                       if (now - item["LastModified"]).total_seconds() > seconds]
+            if expired:
+                self.client.delete_objects(Bucket=self.bucket, Delete={"Objects": expired, "Quiet": True})
+                removed += len(expired)
+        return removed
+
+
+class ObjectStoreTransport:
+    """Content-addressed blobs in an object store"""
+
+    name = "object"
+    shared = False
+
+    def __init__(self, location: str = DOCUMENT_OBJECT_STORE, endpoint: str = DOCUMENT_OBJECT_STORE_ENDPOINT,
+                 ttl: int = DOCUMENT_OBJECT_TTL_SECONDS):
+        self.blobs = S3Blobs(location, endpoint) if location.startswith("s3://") else DirectoryBlobs(location)
+        self.ttl = ttl
+        self._swept = None
+        self._sweep_lock = threading.Lock()
+
+    def publish(self, doc_id: str, path: str):
+        age = self.blobs.age(doc_id)
+        # Re-written past half its TTL, so the sweep cannot delete it while the task is queued
+        if age is None or (self.ttl and age > self.ttl / 2):
+            self.blobs.put_file(doc_id, path)
+        self.sweep()
+
+    def fetch(self, doc_id: str, dest: str):
+        self.blobs.get_file(doc_id, dest)
+
+    @staticmethod
+    def _record_key(upload_id: str) -> str:
+        return f"upload-{upload_id}"
+
+    def put_record(self, upload_id: str, record: dict):
+        self.blobs.put_bytes(self._record_key(upload_id), json.dumps(record).encode("utf-8"))
+
+    def get_record(self, upload_id: str):
+        data = self.blobs.get_bytes(self._record_key(upload_id))
+        return json.loads(data) if data is not None else None
+
+    def sweep(self, force: bool = False) -> int:
+        """Delete blobs and upload records older than the TTL; at most every DOCUMENT_OBJECT_SWEEP_SECONDS"""
+        if not self.ttl:
+            return 0
+        with self._sweep_lock:
+            now = time.monotonic()
+            if not force and self._swept is not None and now - self._swept < DOCUMENT_OBJECT_SWEEP_SECONDS:
+                return 0
+            self._swept = now
+        with stage("document.sweep_blobs", transport=self.name):
+            return self.blobs.delete_older_than(self.ttl)
+
+
+class BrokerTransport:
+    """Blobs kept in the broker's Redis, referenced from the task message by hash"""
+
+    name = "broker"
+    shared = False
+
+    def __init__(self, url: str = DOCUMENT_BROKER_URL):
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+
+    @staticmethod
+    def _key(doc_id: str) -> str:
+        return f"financial-analyzer:document:{doc_id}"
+
+    def publish(self, doc_id: str, path: str):
+        size = os.path.getsize(path)
+        if size > DOCUMENT_BROKER_MAX_BYTES:
+            raise ValueError(f"Document is {size} bytes, above DOCUMENT_BROKER_MAX_BYTES; "
+                             "use DOCUMENT_TRANSPORT=object for large filings")
+        # Refresh the TTL of a blob that is already there instead of sending it again
+        if not self.client.expire(self._key(doc_id), DOCUMENT_BROKER_TTL_SECONDS):
+            with open(path, "rb") as f:
+                self.client.set(self._key(doc_id), f.read(), ex=DOCUMENT_BROKER_TTL_SECONDS)
+
+    def fetch(self, doc_id: str, dest: str):
+        content = self.client.get(self._key(doc_id))
+        if content is None:
+            raise FileNotFoundError(f"Document {doc_id} expired from the broker")
+        with open(dest, "wb") as f:
+            f.write(content)
+
+    def put_record(self, upload_id: str, record: dict):
+        self.client.set(f"financial-analyzer:upload:{upload_id}", json.dumps(record),
+                        ex=DOCUMENT_BROKER_TTL_SECONDS)
+
+    def get_record(self, upload_id: str):
+        data = self.client.get(f"financial-analyzer:upload:{upload_id}")
+        return json.loads(data) if data is not None else None
+
+
+TRANSPORTS = {"shared": SharedStoreTransport, "object": ObjectStoreTransport, "broker": BrokerTransport}
+
+_transport = None
+
+
+def get_transport():
+    """The configured transport (DOCUMENT_TRANSPORT)"""
+    global _transport
+    if _transport is None:
+        if DOCUMENT_TRANSPORT not in TRANSPORTS:
+            raise ValueError(f"Unknown DOCUMENT_TRANSPORT {DOCUMENT_TRANSPORT!r}; "
+                             f"expected one of {', '.join(TRANSPORTS)}")
+        _transport = TRANSPORTS[DOCUMENT_TRANSPORT]()
+    return _transport
+
+
+def publish(doc_id: str, path: str) -> bool:
+    """
+    Make a stored document reachable by the workers.
+
+    Returns True when the workers read the caller's copy (the shared
+    transport), so the caller's store reference has to travel with the task.
+    """
+    transport = get_transport()
+    with stage("document.publish", transport=transport.name):
+        transport.publish(doc_id, path)
+    return transport.shared
+
+
+def share_upload(upload_id: str, record: dict, path: str):
+    """
+    Publish a completed upload's document and its record (content_hash,
+    filename, ...) so any API node can resolve the upload_id. Nothing to do
+    with the shared transport, where every node sees the same sessions.
+    """
+    transport = get_transport()
+    if transport.shared:
+        return
+    publish(record["content_hash"], path)
+    transport.put_record(upload_id, record)
+
+
+def find_upload(upload_id: str):
+    """The record share_upload stored for upload_id, or None"""
+    transport = get_transport()
+    return None if transport.shared else transport.get_record(upload_id)
+
+
+def materialize(doc_id: str, store=None) -> tuple:
+    """
+    (local path, store reference) of a document on this node.
+
+    The reference is taken before looking, so the janitor cannot evict the
+    file in between; release it with store.release when done.
+    """
+    store = store or get_store()
+    ref = store.acquire(doc_id)
+    path = store.path(doc_id)
+    if os.path.exists(path):
+        record_cache("document_locality", True)
+        return path, ref
+    record_cache("document_locality", False)
+    temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    try:
+        with stage("document.fetch", transport=get_transport().name):
+            get_transport().fetch(doc_id, temp_path)
+        digest = hashlib.sha256()
+        with open(temp_path, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(block)
+        if digest.hexdigest() != doc_id:
+            raise ValueError(f"Fetched document does not match its hash {doc_id}")
+        os.replace(temp_path, path)
+    except BaseException:
+        store.release(doc_id, ref)
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return path, ref
@@ -0,0 +1,372 @@
+"""
+Numeric fact extraction into a columnar store.
+
+Every monetary amount, percentage and count in a document's text is parsed
+into one row of a NumPy structured array:
+
+    page, line, column   where it was found (column = position on a table row)
+    metric               canonical metric ("revenue", "net_income", ...) from the row label
+    label                the row label as printed
+    period               "Q2-2025", "H1-2025", "9M-2025" or "FY2025", from the line itself,
+                         the table's column headers, or the document
+    value                normalized float: scale words applied ("$1.2 billion",
+                         "(in millions)" table notes), parentheses as negatives,
+                         decreases ("down 12%") as negative percentages
+    unit                 "currency", "percent" or "number"
+    currency             ISO code for currency amounts
+
+Questions such as "all revenue figures by period" are answered with
+vectorized filters over these columns (FactTable.select / by_period)
+instead of LLM calls. The parser itself (iter_facts) is stdlib only, so the
+dependency-free servers can use it; FactTable needs NumPy.
+"""
+import os
+import re
+import threading
+from collections import OrderedDict
+
+from telemetry import record_cache
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+FACT_FIELDS = [
+    ("page", "i4"), ("line", "i4"), ("column", "i2"),
+    ("metric", "U24"), ("label", "U64"), ("period", "U10"),
+    ("value", "f8"), ("unit", "U8"), ("currency", "U3"),
+]
+FACT_DTYPE = np.dtype(FACT_FIELDS) if np is not None else None
+
+# Extracted tables kept in memory per parsed file
+FACT_CACHE_SIZE = int(os.getenv("FACT_CACHE_SIZE", "32"))
+
+# Canonical metric -> row labels it is printed under (longest match wins)
+METRIC_ALIASES = {
+    "revenue": ["total revenues", "total revenue", "revenues", "revenue", "total net sales", "net sales"],
+    "cost_of_revenue": ["total cost of revenues", "cost of revenues", "cost of revenue", "cost of sales"],
+    "gross_profit": ["gross profit"],
+    "gross_margin": ["gross margin"],
+    "operating_expenses": ["total operating expenses", "operating expenses"],
+    "operating_income": ["income from operations", "income (loss) from operations", "operating income",
+                         "operating profit", "operating loss"],
+    "operating_margin": ["operating margin"],
+    "net_income": ["net income attributable to common stockholders", "net income (loss)", "net income",
+                   "net earnings", "net loss"],
+    "eps": ["diluted eps", "earnings per share", "eps"],
+    "ebitda": ["adjusted ebitda", "ebitda"],
+    "operating_cash_flow": ["net cash provided by operating activities", "cash flows from operating activities",
+                            "operating cash flow"],
+    "capex": ["capital expenditures", "purchases of property and equipment"],
+    "free_cash_flow": ["free cash flow"],
+    "cash": ["cash, cash equivalents and investments", "cash and cash equivalents", "total cash"],
+    "inventory": ["inventory", "inventories"],
+    "current_assets": ["total current assets"],
+    "total_assets": ["total assets"],
+    "current_liabilities": ["total current liabilities"],
+    "total_liabilities": ["total liabilities"],
+    "total_debt": ["total debt", "long-term debt"],
+    "total_equity": ["total stockholders' equity", "total shareholders' equity", "total equity"],
+}
+_ALIASES = sorted(((alias, metric) for metric, aliases in METRIC_ALIASES.items() for alias in aliases),
+                  key=lambda item: -len(item[0]))
+
+# Metrics printed per share, which statement-wide scale notes do not apply to
+_PER_SHARE_METRICS = {"eps"}
+_SCALES = {"thousand": 1e3, "thousands": 1e3, "k": 1e3, "million": 1e6, "millions": 1e6, "mn": 1e6, "mm": 1e6,
+           "m": 1e6, "billion": 1e9, "billions": 1e9, "bn": 1e9, "b": 1e9, "trillion": 1e12, "t": 1e12}
+_CURRENCIES = {"$": "USD", "us$": "USD", "usd": "USD", "€": "EUR", "eur": "EUR", "£": "GBP", "gbp": "GBP",
+               "¥": "JPY", "jpy": "JPY"}
+
+_NUMBER = re.compile(
+    r"(?P<open>\()?"
+    r"(?P<sign>[-−–])?\s?"
+    r"(?P<currency>US\$|\$|€|£|¥|\b(?:USD|EUR|GBP|JPY)\s?)?"
+    r"(?P<digits>\d{1,3}(?:,\d{3})+(?:\.\d+)?|\d+(?:\.\d+)?)"
+    r"(?:(?P<short>[KMBT]|bn|mn|mm)\b|\s?(?P<word>thousand|million|billion|trillion)s?\b)?"
+    r"\s?(?P<percent>%|percent\b|bps\b|basis points\b)?"
+    r"(?P<close>\))?",
+    re.IGNORECASE,
+)
+_PAGE_SCALE = re.compile(r"\bin\s+(thousands|millions|billions)\b", re.IGNORECASE)
+_MONTHS_ENDED = re.compile(
+    r"\b(three|six|nine|twelve)\s+months\s+ended\s+([A-Za-z]+)\s+\d{1,2},?\s+(20\d{2})\b", re.IGNORECASE)
+_PERIOD = re.compile(
+    r"\b(?:(Q[1-4])[\s\-]*(?:FY)?[\s\-]*'?(20\d{2}|\d{2})\b"
+    r"|(first|second|third|fourth)\s+quarter\s+(?:of\s+)?(?:fiscal\s+)?(20\d{2})\b"
+    r"|(?:FY|fiscal\s+(?:year\s+)?)'?\s?(20\d{2}|\d{2})\b"
+    r"|(?:year\s+ended\s+[A-Za-z]+\s+\d{1,2},?\s+)(20\d{2})\b)",
+    re.IGNORECASE,
+)
+_YEAR = re.compile(r"\b(20\d{2})\b")
+# A percentage read as a decrease: "down 12%", "declined by 3%", "12% lower" (but not "fell to 12%", a level)
+_DECREASE_BEFORE = re.compile(r"\b(?:down|decreas\w*|declin\w*|fell|drop(?:ped)?|lower|reduc\w*)(?:\s+(?:by|of))?\s*$",
+                              re.IGNORECASE)
+_DECREASE_AFTER = re.compile(r"^\s*(?:decrease|decline|drop|lower|down)\b", re.IGNORECASE)
+_WORD = re.compile(r"[A-Za-z]{2,}")
+_QUARTER_WORDS = {"first": "Q1", "second": "Q2", "third": "Q3", "fourth": "Q4"}
+_MONTH_QUARTERS = {"mar": "Q1", "jun": "Q2", "sep": "Q3", "dec": "Q4"}
+_SPAN_PREFIX = {"six": "H1", "nine": "9M"}
+
+
+def _year(text: str) -> str:
+    return text if len(text) == 4 else f"20{text}"
+
+
+def find_periods(line: str) -> list:
+    """Normalized periods mentioned on a line, in order"""
+    found, spans = [], []
+    for match in _MONTHS_ENDED.finditer(line):
+        span, month, year = match.group(1).lower(), match.group(2)[:3].lower(), match.group(3)
+        spans.append((match.start(), match.end()))
+        if span == "three" and month in _MONTH_QUARTERS:
+            found.append((match.start(), f"{_MONTH_QUARTERS[month]}-{year}"))
+        elif span in _SPAN_PREFIX:
+            found.append((match.start(), f"{_SPAN_PREFIX[span]}-{year}"))
+        else:
+            found.append((match.start(), f"FY{year}"))
+    for match in _PERIOD.finditer(line):
+        if any(start <= match.start() < end for start, end in spans):
+            continue
+        quarter, quarter_year, word, word_year, fiscal_year, ended_year = match.groups()
+        if quarter:
+            found.append((match.start(), f"{quarter.upper()}-{_year(quarter_year)}"))
+        elif word:
+            found.append((match.start(), f"{_QUARTER_WORDS[word.lower()]}-{word_year}"))
+        else:
+            found.append((match.start(), f"FY{_year(fiscal_year or ended_year)}"))
+    return [period for _, period in sorted(found)]
+
+
+def _column_periods(line: str) -> list:
+    """Periods heading the columns of a table, if the line looks like a header row"""
+    periods = find_periods(line)
+    if len(periods) >= 2:
+        return periods
+    stripped = _YEAR.sub("", line)
+    years = _YEAR.findall(line)
+    # A header row of bare years ("2025   2024") with little else on it
+    if len(years) >= 2 and len(stripped.strip(" \t|$()-")) <= 40:
+        return [f"FY{year}" for year in years]
+    return []
+
+
+def _is_prose(line: str) -> bool:
+    """A sentence rather than a table row or a row label: it ends a table's column headers"""
+    words = len(_WORD.findall(line))
+    return words >= 12 or (words >= 6 and line.rstrip().endswith("."))
+
+
+def canonical_metric(label: str) -> str:
+    lowered = label.lower().replace("\u2019", "'")
+    for alias, metric in _ALIASES:
+        if alias in lowered:
+            return metric
+    return ""
+
+
+def _parse(match, page_scale: float, in_table: bool):
+    """(value, unit, currency) for one number match, or None if it is not a figure"""
+    digits = match.group("digits")
+    value = float(digits.replace(",", ""))
+    currency = match.group("currency")
+    scale_word = (match.group("short") or match.group("word") or "").lower()
+    percent = (match.group("percent") or "").lower()
+    grouped = "," in digits or "." in digits
+    negative = bool(match.group("sign")) or bool(match.group("open") and match.group("close"))
+    if not (currency or scale_word or percent or grouped or value >= 1000 or in_table or negative):
+        # Small bare integers in prose are list numbers, dates and footnotes, not figures
+        return None
+    if not (currency or scale_word or percent or grouped) and 1900 <= value <= 2100:
+        return None
+    if scale_word:
+        value *= _SCALES[scale_word]
+    elif not percent and page_scale:
+        value *= page_scale
+    if negative:
+        value = -value
+    if percent:
+        return (value / 100.0 if percent.startswith("b") else value), "percent", ""
+    if currency:
+        return value, "currency", _CURRENCIES[currency.strip().lower()]
+    # Figures in statements scaled by an "(in millions)" note are amounts in the filing's currency
+    return value, ("currency" if page_scale else "number"), ("USD" if page_scale else "")
+
+
+def _clean_label(text: str) -> str:
+    text = text.replace("\u2019", "'")
+    return " ".join(re.sub(r"[^\w\s&'(),./-]", " ", text).split()).strip(" .,")[:64]
+
+
+def iter_facts(pages: list, default_period: str = ""):
+    """Yield one FACT_DTYPE-shaped tuple per figure found in the page texts"""
+    for page_number, text in enumerate(pages, start=1):
+        scale_note = _PAGE_SCALE.search(text)
+        page_scale = _SCALES[scale_note.group(1).lower()] if scale_note else 0.0
+        header_periods = []
+        for line_number, line in enumerate(text.splitlines(), start=1):
+            columns = _column_periods(line)
+            if columns:
+                header_periods = columns
+                continue
+            if not line.strip() or _is_prose(line):
+                # The table ended; figures below are not in its period columns
+                header_periods = []
+            figures = []
+            for match in _NUMBER.finditer(line):
+                parsed = _parse(match, page_scale, bool(header_periods))
+                if parsed is not None:
+                    figures.append((match, parsed))
+            if not figures:
+                continue
+            prefix = line[:figures[0][0].start()]
+            label = _clean_label(prefix)
+            line_metric = canonical_metric(prefix)
+            inline_periods = find_periods(line)
+            previous_end = 0
+            for column, (match, (value, unit, currency)) in enumerate(figures):
+                # In prose each figure belongs to the metric named just before it
+                segment = line[previous_end:match.start()]
+                metric = canonical_metric(segment) or line_metric
+                if column and metric != line_metric:
+                    label = _clean_label(segment)
+                previous_end = match.end()
+                if metric in _PER_SHARE_METRICS and unit != "percent" and not match.group("short") \
+                        and not match.group("word") and page_scale:
+                    # "(in millions, except per share data)"
+                    value /= page_scale
+                if unit == "percent" and value > 0 and (_DECREASE_BEFORE.search(line[:match.start()])
+                                                        or _DECREASE_AFTER.match(line[match.end():])):
+                    value = -value
+                if inline_periods:
+                    period = inline_periods[0]
+                elif column < len(header_periods):
+                    period = header_periods[column]
+                else:
+                    period = default_period
+                yield (page_number, line_number, column, metric, label, period, value, unit, currency)
+
+
+def period_key(period: str):
+    """Sort key: chronological by year, then quarter/half/nine months, then full year"""
+    year = re.search(r"(20\d{2})", period)
+    order = {"Q1": 1, "Q2": 2, "H1": 2.5, "Q3": 3, "9M": 3.5, "Q4": 4, "FY": 5}
+    return (int(year.group(1)) if year else 0, order.get(period[:2], 0), period)
+
+
+class FactTable:
+    """Columnar table of extracted figures; filters are NumPy boolean masks"""
+
+    def __init__(self, rows: "np.ndarray" = None, page_count: int = 0):
+        self.rows = rows if rows is not None else np.zeros(0, dtype=FACT_DTYPE)
+        self.page_count = page_count
+
+    @classmethod
+    def from_pages(cls, pages: list, filename: str = "") -> "FactTable":
+        from ingestion import detect_company_period
+        _, default_period = detect_company_period("\n".join(pages[:3]), filename)
+        return cls(np.array(list(iter_facts(pages, default_period or "")), dtype=FACT_DTYPE), len(pages))
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def select(self, metric: str = None, period: str = None, unit: str = None, page: int = None,
+               min_value: float = None, max_value: float = None, currency: str = None) -> "FactTable":
+        """Rows matching every given condition"""
+        rows = self.rows
+        mask = np.ones(len(rows), dtype=bool)
+        if metric:
+            mask &= rows["metric"] == metric
+        if period:
+            mask &= rows["period"] == period
+        if unit:
+            mask &= rows["unit"] == unit
+        if currency:
+            mask &= rows["currency"] == currency
+        if page is not None:
+            mask &= rows["page"] == page
+        if min_value is not None:
+            mask &= rows["value"] >= min_value
+        if max_value is not None:
+            mask &= rows["value"] <= max_value
+        return FactTable(rows[mask], self.page_count)
+
+    def by_period(self, metric: str, unit: str = None, currency: str = None) -> "OrderedDict":
+        """
+        period -> values of a metric, in chronological order (first printed value first).
+
+        Values share one unit and currency, so they can be compared: the given
+        ones, otherwise those the metric is first printed in ("down 12%" next to
+        revenue is a change, not revenue; a euro segment is not the dollar total).
+        """
+        selected = self.select(metric=metric, unit=unit, currency=currency).rows
+        selected = selected[selected["period"] != ""]
+        if len(selected):
+            selected = selected[(selected["unit"] == selected["unit"][0])
+                                & (selected["currency"] == selected["currency"][0])]
+        result = OrderedDict()
+        for period in sorted(np.unique(selected["period"]), key=period_key):
+            result[str(period)] = selected["value"][selected["period"] == period].tolist()
+        return result
+
+    def latest(self) -> dict:
+        """metric -> most recent (period, value, unit, currency) for every recognized metric"""
+        summary = {}
+        for metric in np.unique(self.rows["metric"]):
+            if not metric:
+                continue
+            # The unit and currency the metric is first printed in
+            first = self.rows[self.rows["metric"] == metric][0]
+            unit, currency = str(first["unit"]), str(first["currency"])
+            periods = self.by_period(str(metric), unit=unit, currency=currency)
+            if periods:
+                period, values = next(reversed(periods.items()))
+                summary[str(metric)] = {"period": period, "value": values[0], "unit": unit, "currency": currency}
+        return summary
+
+    def to_records(self, limit: int = None) -> list:
+        rows = self.rows if limit is None else self.rows[:limit]
+        return [{name: row[name].item() for name, _ in FACT_FIELDS} for row in rows]
+
+    def format(self, limit: int = 40) -> str:
+        """Compact text rendering for agents"""
+        if not len(self.rows):
+            return "No matching figures found."
+        lines = []
+        for row in self.rows[:limit]:
+            value = row["value"]
+            if row["unit"] == "percent":
+                shown = f"{value:,.2f}%"
+            else:
+                shown = f"{value:,.{2 if abs(value) < 1000 else 0}f} {row['currency']}".strip()
+            lines.append(f"[page {row['page']}] {row['period'] or 'period n/a'} | "
+                         f"{row['metric'] or '-'} | {row['label']} | {shown}")
+        if len(self.rows) > limit:
+            lines.append(f"[... {len(self.rows) - limit} more rows; narrow the query]")
+        return "\n".join(lines)
+
+
+_fact_cache = OrderedDict()
+_fact_cache_lock = threading.Lock()
+
+
+def get_facts(file_path: str) -> FactTable:
+    """Fact table for a file, extracted once per version of the file (LRU, like get_pages)"""
+    from ingestion import get_pages
+    stat = os.stat(file_path)
+    key = (os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns)
+    with _fact_cache_lock:
+        table = _fact_cache.get(key)
+        if table is not None:
+            _fact_cache.move_to_end(key)
+    record_cache("facts", table is not None)
+    if table is not None:
+        return table
+
+    table = FactTable.from_pages(get_pages(file_path), os.path.basename(file_path))
+    with _fact_cache_lock:
+        _fact_cache[key] = table
+        while len(_fact_cache) > FACT_CACHE_SIZE:
+            _fact_cache.popitem(last=False)
+    return table
@@ -0,0 +1,192 @@
+"""
+Incremental re-analysis of amended filings.
+
+When a 10-K/A or a revised quarterly update arrives, only the chunks whose
+pages changed are re-summarized. Summaries of unchanged chunks and the
+verification report are reused from the most recent analysis of the same
+company and period, and a single synthesis task produces the new report.
+
+A full analysis stores an extractive summary of every chunk (its headings and
+figure lines, no LLM call), so the first amendment already has summaries for
+the chunks it did not touch. Whether a chunk changed is decided by its pages'
+hashes, not by its id: a content-defined boundary can move without any of
+the chunk's pages changing.
+
+Only the synthesis is re-run. The investment and risk outputs of the earlier
+analysis rate the figures an amendment may have changed, so they are dropped
+as soon as any chunk changed; the outputs that are kept are recorded in
+carried_over with the id of the analysis that produced them.
+"""
+import re
+
+from ingestion import build_chunks, diff_pages, hash_page
+from telemetry import stage, record_cache
+from profiling import profiled
+from schemas import TASK_SCHEMAS
+from structured_output import parse_structured, llm_repairer
+
+# Order matches the task list passed to the full crew in celery_tasks.py
+TASK_NAMES = ["verification", "analyze_financial_document", "investment_analysis", "risk_assessment"]
+
+# Outputs that rate the figures: stale once any chunk of the filing changed
+STALE_ON_CHANGE = ("investment_analysis", "risk_assessment")
+
+# Maximum characters of a chunk sent to the LLM for summarization
+MAX_CHUNK_CHARS = 12000
+# Maximum characters of an extractive chunk summary
+SEED_SUMMARY_CHARS = 2000
+
+_FIGURE = re.compile(r"\d[\d,.]*\s*(%|million|billion|thousand)?", re.IGNORECASE)
+
+
+def find_previous_analysis(collection, company: str, period: str):
+    """Find the most recent stored analysis for the same company and period"""
+    if not company or not period:
+        return None
+    return collection.find_one(
+        {"company": company, "period": period, "page_hashes": {"$exists": True}, "status": {"$ne": "failed"}},
+        sort=[("created_at", -1)]
+    )
+
+
+def collect_task_outputs(crew_result, task_names: list = TASK_NAMES) -> dict:
+    """Map each task name to its raw output so later runs can reuse them"""
+    outputs = {}
+    for name, task_output in zip(task_names, getattr(crew_result, "tasks_output", None) or []):
+        outputs[name] = getattr(task_output, "raw", str(task_output))
+    return outputs
+
+
+def summarize_chunk(chunk: dict) -> str:
+    """Summarize one chunk of pages with the shared LLM"""
+    from agents import llm
+    prompt = (
+        f"Summarize pages {chunk['start_page']}-{chunk['end_page']} of a financial document. "
+        "Keep every reported figure (amounts, percentages, periods) and note which statement "
+        "or section it belongs to. Be concise.\n\n"
+        f"{chunk['text'][:MAX_CHUNK_CHARS]}"
+    )
+    response = llm.invoke(prompt)
+    return getattr(response, "content", str(response))
+
+
+def extract_chunk_summary(chunk: dict) -> str:
+    """Headings and figure lines of a chunk, as a stand-in summary for chunks no LLM has summarized"""
+    kept, size = [], 0
+    for line in chunk["text"].splitlines():
+        line = line.strip()
+        if not line or not (_FIGURE.search(line) or (line.isupper() and len(line) > 3)):
+            continue
+        if size + len(line) > SEED_SUMMARY_CHARS:
+            break
+        kept.append(line)
+        size += len(line) + 1
+    return "\n".join(kept) or chunk["text"][:SEED_SUMMARY_CHARS]
+
+
+def seed_chunk_summaries(pages: list) -> dict:
+    """Extractive summaries of every chunk, stored by a full analysis for the first amendment"""
+    return {chunk["hash"]: extract_chunk_summary(chunk) for chunk in build_chunks(pages)}
+
+
+def summarize_chunks(chunks: list, changed_pages: list, cached_summaries: dict, summarize=summarize_chunk) -> tuple:
+    """
+    Summaries for every chunk: summarize(chunk) for chunks containing a changed
+    page, the cached (or an extractive) summary for the rest.
+
+    Returns (summaries by chunk hash, indexes of the changed chunks, the
+    synthesis sections with changed chunks marked [CHANGED]).
+    """
+    changed = set(changed_pages)
+    chunk_summaries = {}
+    changed_chunks = []
+    sections = []
+    for chunk in chunks:
+        if any(page in changed for page in range(chunk["start_page"], chunk["end_page"] + 1)):
+            with stage("llm.chunk_summary", start_page=chunk["start_page"], end_page=chunk["end_page"]):
+                summary = summarize(chunk)
+            changed_chunks.append(chunk["index"])
+            marker = " [CHANGED]"
+        else:
+            # Unchanged pages regrouped under a new chunk id (or a legacy entry) get an extractive summary
+            record_cache("chunk_summary", chunk["hash"] in cached_summaries)
+            summary = cached_summaries.get(chunk["hash"]) or extract_chunk_summary(chunk)
+            marker = ""
+        chunk_summaries[chunk["hash"]] = summary
+        sections.append(f"Pages {chunk['start_page']}-{chunk['end_page']}{marker}:\n{summary}")
+    return chunk_summaries, changed_chunks, sections
+
+
+def carry_over(previous: dict, changed: bool) -> tuple:
+    """
+    Task outputs of the earlier analysis that still hold for the amendment.
+
+    Returns (raw outputs, structured outputs, carried_over) where carried_over
+    maps each kept output to the id of the analysis that produced it, followed
+    through earlier amendments. The synthesis output is always replaced.
+    """
+    dropped = set(STALE_ON_CHANGE) if changed else set()
+    dropped.add("analyze_financial_document")
+    task_outputs = {name: output for name, output in (previous.get("task_outputs") or {}).items()
+                    if name not in dropped}
+    structured = {name: output for name, output in (previous.get("structured") or {}).items()
+                  if name not in dropped}
+    sources = previous.get("carried_over") or {}
+    carried_over = {name: sources.get(name, previous.get("_id"))
+                    for name in sorted(set(task_outputs) | set(structured))}
+    return task_outputs, structured, carried_over
+
+
+def run_incremental_analysis(query: str, file_path: str, pages: list, previous: dict) -> dict:
+    """
+    Re-run only the affected chunk summaries and the final synthesis.
+
+    Returns the analysis output together with the state that has to be stored
+    for the next amendment: per-chunk summaries, task outputs (raw and
+    validated) and which of them were carried over from earlier analyses.
+    """
+    # Imported here so the chunk bookkeeping above works without crewai and the agents' LLM setup
+    from crewai import Crew, Process
+    from agents import financial_analyst, llm
+    from task import incremental_synthesis
+
+    chunks = build_chunks(pages)
+    changed_pages = diff_pages(previous.get("page_hashes"), [hash_page(text) for text in pages])
+    chunk_summaries, changed_chunks, sections = summarize_chunks(
+        chunks, changed_pages, previous.get("chunk_summaries") or {})
+
+    task_outputs, structured, carried_over = carry_over(previous, bool(changed_chunks))
+    verification_report = task_outputs.get("verification", "No verification report is available.")
+
+    print(
+        f"Incremental analysis: {len(changed_pages)} changed page(s), "
+        f"{len(changed_chunks)}/{len(chunks)} chunk(s) re-summarized"
+    )
+
+    synthesis_crew = Crew(
+        agents=[financial_analyst],
+        tasks=[incremental_synthesis],
+        process=Process.sequential,
+        verbose=True
+    )
+    with stage("crew.incremental_synthesis", changed_chunks=len(changed_chunks)), profiled("incremental_synthesis"):
+        result = synthesis_crew.kickoff({
+            'query': query,
+            'file_path': file_path,
+            'verification_report': verification_report,
+            'chunk_summaries': "\n\n".join(sections)
+        })
+
+    task_outputs["analyze_financial_document"] = str(result)
+    parsed = parse_structured(str(result), TASK_SCHEMAS["incremental_synthesis"], repair=llm_repairer(llm))
+    structured["analyze_financial_document"] = parsed.model_dump() if parsed is not None else None
+    return {
+        "analysis_output": str(result),
+        "structured": structured,
+        "chunk_summaries": chunk_summaries,
+        "task_outputs": task_outputs,
+        "carried_over": carried_over,
+        "changed_pages": changed_pages,
+        "changed_chunks": changed_chunks,
+    }
+
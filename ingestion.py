@@ -0,0 +1,209 @@
+"""
+Document ingestion helpers shared by the API and the Celery worker.
+
+Extracts text page by page and fingerprints every page so that amended
+filings can be diffed against the most recent analysis of the same
+company and period.
+"""
+import os
+import re
+import mmap
+import shutil
+import tempfile
+import hashlib
+import threading
+from itertools import islice
+from collections import OrderedDict
+
+from pypdf import PdfReader
+from pypdf.generic import StreamObject
+
+from telemetry import record_cache
+from document_store import open_view
+from shared_cache import get_shared_cache
+from ocr import fill_scanned_pages
+
+# Parsed documents kept in memory by the text store
+PAGE_CACHE_SIZE = int(os.getenv("PAGE_CACHE_SIZE", "32"))
+# Parsed documents kept in the cache tier shared by all processes (shared_cache.py)
+SHARED_PAGE_TTL_SECONDS = int(os.getenv("SHARED_PAGE_TTL_SECONDS", str(6 * 3600)))
+
+# Target number of pages per chunk. Chunk boundaries are content-defined,
+# so inserting a page into an amended filing only disturbs the chunk it
+# lands in instead of shifting every chunk after it.
+CHUNK_PAGES = int(os.getenv("CHUNK_PAGES", "5"))
+
+_PERIOD_PATTERNS = [
+    re.compile(r"\b(Q[1-4])[\s\-]*(?:FY)?[\s\-]*'?(20\d{2})\b", re.IGNORECASE),
+    re.compile(r"\b(first|second|third|fourth)\s+quarter\s+(?:of\s+)?(?:fiscal\s+)?(20\d{2})\b", re.IGNORECASE),
+    re.compile(r"\bfiscal\s+year\s+(?:ended\s+[A-Za-z]+\s+\d{1,2},\s+)?(20\d{2})\b", re.IGNORECASE),
+]
+_QUARTER_WORDS = {"first": "Q1", "second": "Q2", "third": "Q3", "fourth": "Q4"}
+_REGISTRANT_PATTERN = re.compile(r"^\s*(.+?)\s*\n\s*\(Exact name of registrant", re.IGNORECASE | re.MULTILINE)
+_TICKER_PATTERN = re.compile(r"^([A-Z]{1,5})[-_ ]")
+
+
+def iter_page_texts(file_path: str):
+    """
+    Yield the text of each page of a PDF in turn, with flat memory use.
+
+    pypdf reads from a read-only memory map instead of a private copy of the
+    file. After each page its decoded content streams are dropped from the
+    reader's object cache and the mapped pages are released from our RSS
+    (they stay in the OS page cache), so peak memory does not grow with the
+    size of the document.
+    """
+    with open_view(file_path) as view:
+        reader = PdfReader(view)
+        for page in reader.pages:
+            mark = len(reader.resolved_objects)
+            yield page.extract_text() or ""
+            _release_page(reader, mark, view)
+
+
+def _release_page(reader: PdfReader, mark: int, view):
+    # Objects resolved while extracting the page were appended after mark
+    cache = reader.resolved_objects
+    added = list(islice(reversed(cache), max(len(cache) - mark, 0)))
+    for key in added:
+        if isinstance(cache[key], StreamObject):
+            del cache[key]
+    if hasattr(view, "madvise"):
+        view.madvise(mmap.MADV_DONTNEED)
+
+
+def spool_upload(fileobj, suffix: str = ".pdf", chunk_size: int = 1024 * 1024) -> tuple:
+    """
+    Copy an upload stream to a temporary file in fixed-size chunks.
+
+    Returns (path, size); the caller removes the file. Used instead of
+    reading the whole upload into memory before parsing it.
+    """
+    fileobj.seek(0)
+    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp_file:
+        shutil.copyfileobj(fileobj, tmp_file, chunk_size)
+        return tmp_file.name, tmp_file.tell()
+
+
+def extract_pages(file_path: str) -> list:
+    """Extract the text of every page in a PDF, one string per page (scanned pages via OCR)"""
+    return fill_scanned_pages(file_path, list(iter_page_texts(file_path)))
+
+
+_page_cache = OrderedDict()
+_page_cache_lock = threading.Lock()
+
+
+_STORE_OBJECT = re.compile(r"^[0-9a-f]{64}\.pdf$")
+
+
+def _file_key(file_path: str) -> str:
+    """Content hash for document-store files (same on every process and node), else path, size and mtime"""
+    name = os.path.basename(file_path)
+    if _STORE_OBJECT.match(name):
+        return name[:64]
+    stat = os.stat(file_path)
+    return f"{os.path.abspath(file_path)}:{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def get_pages(file_path: str) -> list:
+    """
+    Parsed-text store: page texts for a file, parsed once and then served from an LRU cache.
+
+    Entries are keyed by path, size and modification time so a replaced file is re-parsed
+    (by content hash for document-store files). Behind the in-process LRU, the shared cache
+    tier lets other API processes reuse a parse.
+    """
+    key = _file_key(file_path)
+    with _page_cache_lock:
+        pages = _page_cache.get(key)
+        if pages is not None:
+            _page_cache.move_to_end(key)
+    record_cache("parsed_pages", pages is not None)
+    if pages is not None:
+        return pages
+
+    pages = get_shared_cache().get("pages", key)
+    if pages is None:
+        pages = extract_pages(file_path)
+        get_shared_cache().set("pages", key, pages, SHARED_PAGE_TTL_SECONDS)
+    with _page_cache_lock:
+        _page_cache[key] = pages
+        while len(_page_cache) > PAGE_CACHE_SIZE:
+            _page_cache.popitem(last=False)
+    return pages
+
+
+def hash_page(text: str) -> str:
+    """Fingerprint a page's text, ignoring whitespace-only differences"""
+    normalized = " ".join(text.split())
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+def build_chunks(pages: list, chunk_pages: int = CHUNK_PAGES) -> list:
+    """
+    Group pages into content-defined chunks.
+
+    A chunk ends after any page whose hash falls on a boundary, or once it
+    reaches twice the target size. Each chunk is identified by the hash of
+    its page hashes, so identical runs of pages produce identical chunk ids.
+    """
+    chunk_pages = max(chunk_pages, 1)
+    chunks = []
+    current = []
+
+    def close_chunk():
+        page_hashes = [page_hash for _, page_hash, _ in current]
+        chunks.append({
+            "index": len(chunks),
+            "start_page": current[0][0] + 1,
+            "end_page": current[-1][0] + 1,
+            "hash": hashlib.sha256("".join(page_hashes).encode()).hexdigest(),
+            "text": "\n".join(text for _, _, text in current),
+        })
+
+    for number, text in enumerate(pages):
+        page_hash = hash_page(text)
+        current.append((number, page_hash, text))
+        at_boundary = int(page_hash[:8], 16) % chunk_pages == 0
+        if at_boundary or len(current) >= 2 * chunk_pages:
+            close_chunk()
+            current = []
+
+    if current:
+        close_chunk()
+    return chunks
+
+
+def diff_pages(previous_hashes: list, current_hashes: list) -> list:
+    """Return the 1-based numbers of pages whose content is new or changed"""
+    known = set(previous_hashes or [])
+    return [number + 1 for number, page_hash in enumerate(current_hashes) if page_hash not in known]
+
+
+def detect_company_period(text: str, filename: str = ""):
+    """Best-effort guess of the issuing company and reporting period"""
+    company = None
+    registrant = _REGISTRANT_PATTERN.search(text[:20000])
+    if registrant:
+        company = registrant.group(1).strip()
+    else:
+        ticker = _TICKER_PATTERN.match(os.path.basename(filename or ""))
+        if ticker:
+            company = ticker.group(1)
+
+    period = None
+    haystack = f"{filename} {text[:20000]}"
+    for pattern in _PERIOD_PATTERNS:
+        match = pattern.search(haystack)
+        if not match:
+            continue
+        groups = match.groups()
+        if len(groups) == 1:
+            period = f"FY{groups[0]}"
+        else:
+            quarter = _QUARTER_WORDS.get(groups[0].lower(), groups[0].upper())
+            period = f"{quarter}-{groups[1]}"
+        break
+
+    return company, period
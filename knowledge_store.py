@@ -0,0 +1,207 @@
+"""
+Local knowledge store of market context per company and period.
+
+Three of the four agents search the web for context on the issuer, and
+repeated analyses of the same company used to repeat the same searches.
+The store keeps, in a SQLite file shared by every process on the host
+(KNOWLEDGE_STORE_PATH, default data/knowledge.db):
+
+- web-search results, keyed by the normalized query and tagged with the
+  company and period of the run that made them; reused for KNOWLEDGE_SEARCH_TTL_SECONDS
+  (default one day);
+- facts the agents extract, keyed by company and period; reused for
+  KNOWLEDGE_FACT_TTL_SECONDS (default 30 days).
+
+Every entry carries the time it was fetched or observed, and lookups report
+its age. Agents reach the store through the "Company Knowledge Lookup" and
+"Save Company Fact" tools, and the web search tool answers repeated queries
+from it without a network call.
+"""
+import os
+import re
+import time
+import json
+import sqlite3
+import threading
+import contextvars
+
+from telemetry import record_cache
+from ingestion import detect_company_period
+
+KNOWLEDGE_STORE_PATH = os.getenv("KNOWLEDGE_STORE_PATH", os.path.join("data", "knowledge.db"))
+KNOWLEDGE_SEARCH_TTL_SECONDS = int(os.getenv("KNOWLEDGE_SEARCH_TTL_SECONDS", str(24 * 3600)))
+KNOWLEDGE_FACT_TTL_SECONDS = int(os.getenv("KNOWLEDGE_FACT_TTL_SECONDS", str(30 * 24 * 3600)))
+
+# Legal-form words dropped when comparing company names ("Tesla, Inc." == "TESLA")
+# (company, period) of the document the current run analyzes; searches made during the run are tagged with it
+current_subject = contextvars.ContextVar("current_subject", default=(None, None))
+
+_COMPANY_SUFFIXES = {"INC", "INCORPORATED", "CORP", "CORPORATION", "CO", "COMPANY", "LTD", "LIMITED", "PLC",
+                     "LLC", "LP", "HOLDINGS", "SA", "AG", "NV", "THE"}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS searches (
+    query_key TEXT PRIMARY KEY,
+    query TEXT NOT NULL,
+    company TEXT,
+    period TEXT,
+    results TEXT NOT NULL,
+    fetched_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS searches_company ON searches (company, period);
+CREATE TABLE IF NOT EXISTS facts (
+    company TEXT NOT NULL,
+    period TEXT NOT NULL,
+    fact TEXT NOT NULL,
+    source TEXT,
+    observed_at REAL NOT NULL,
+    PRIMARY KEY (company, period, fact)
+);
+"""
+
+
+def normalize_company(name: str) -> str:
+    """Canonical company key: upper case, punctuation and legal-form suffixes removed"""
+    words = re.sub(r"[^A-Z0-9&]+", " ", (name or "").upper()).split()
+    return " ".join(word for word in words if word not in _COMPANY_SUFFIXES)
+
+
+def normalize_period(period: str) -> str:
+    """Canonical period key in the form detect_company_period uses (Q2-2025, FY2024)"""
+    if not period:
+        return ""
+    return detect_company_period("", period)[1] or re.sub(r"\s+", "", period).upper()
+
+
+def normalize_query(query: str) -> str:
+    """Order- and case-insensitive search key"""
+    return " ".join(sorted(set(re.findall(r"[a-z0-9]+", query.lower()))))
+
+
+def _age(seconds: float) -> str:
+    if seconds < 3600:
+        return f"{int(seconds // 60)} min ago"
+    if seconds < 2 * 86400:
+        return f"{int(seconds // 3600)} h ago"
+    return f"{int(seconds // 86400)} days ago"
+
+
+class KnowledgeStore:
+    """SQLite-backed cache of search results and facts (one connection per thread)"""
+
+    def __init__(self, path: str = KNOWLEDGE_STORE_PATH):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._local = threading.local()
+        self._connection().executescript(_SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        # A connection inherited through fork (a preloaded app, see serve.py) must not be used by the child
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            # WAL lets API processes and workers read while another one writes
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._local.connection, self._local.pid = connection, os.getpid()
+        return connection
+
+    def known_company(self, text: str):
+        """The first company already in the store that is named in text, if any"""
+        haystack = f" {normalize_company(text)} "
+        rows = self._connection().execute(
+            "SELECT company FROM facts UNION SELECT company FROM searches WHERE company != ''"
+        ).fetchall()
+        for (company,) in sorted(rows, key=lambda row: -len(row[0])):
+            if company and f" {company} " in haystack:
+                return company
+        return None
+
+    def get_search(self, query: str):
+        """Cached results for a web search, or None if missing or older than the TTL"""
+        row = self._connection().execute(
+            "SELECT results, fetched_at FROM searches WHERE query_key = ?", (normalize_query(query),)
+        ).fetchone()
+        hit = row is not None and time.time() - row[1] < KNOWLEDGE_SEARCH_TTL_SECONDS
+        record_cache("knowledge_search", hit)
+        return json.loads(row[0]) if hit else None
+
+    def put_search(self, query: str, results: list, company: str = None, period: str = None):
+        """
+        Store web-search results, tagged with the company and period they concern.
+
+        Without an explicit company the query is matched against companies already in the store, so
+        callers that know the subject (see current_subject) should pass it.
+        """
+        company = normalize_company(company) if company else (self.known_company(query) or "")
+        period = normalize_period(period) if period else (detect_company_period("", query)[1] or "")
+        self._connection().execute(
+            "INSERT OR REPLACE INTO searches (query_key, query, company, period, results, fetched_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (normalize_query(query), query, company, period, json.dumps(results, default=str), time.time())
+        )
+
+    def add_fact(self, company: str, period: str, fact: str, source: str = ""):
+        """Record (or refresh) a fact about a company and period"""
+        self._connection().execute(
+            "INSERT OR REPLACE INTO facts (company, period, fact, source, observed_at) VALUES (?, ?, ?, ?, ?)",
+            (normalize_company(company), normalize_period(period), fact.strip(), source, time.time())
+        )
+
+    def lookup(self, company: str, period: str = None) -> dict:
+        """Fresh facts and cached searches for a company (and period, if given) with their ages"""
+        now = time.time()
+        company = normalize_company(company)
+        period = normalize_period(period)
+        period_clause, params = ("AND period IN (?, '')", (period,)) if period else ("", ())
+        facts = self._connection().execute(
+            f"SELECT period, fact, source, observed_at FROM facts WHERE company = ? {period_clause} "
+            "AND observed_at >= ? ORDER BY observed_at DESC",
+            (company, *params, now - KNOWLEDGE_FACT_TTL_SECONDS)
+        ).fetchall()
+        searches = self._connection().execute(
+            f"SELECT query, period, results, fetched_at FROM searches WHERE company = ? {period_clause} "
+            "AND fetched_at >= ? ORDER BY fetched_at DESC",
+            (company, *params, now - KNOWLEDGE_SEARCH_TTL_SECONDS)
+        ).fetchall()
+        record_cache("knowledge_lookup", bool(facts or searches))
+        return {
+            "company": company,
+            "period": period,
+            "facts": [{"period": p, "fact": f, "source": s, "age": _age(now - t)} for p, f, s, t in facts],
+            "searches": [{"query": q, "period": p, "results": json.loads(r), "age": _age(now - t)}
+                         for q, p, r, t in searches],
+        }
+
+
+def format_knowledge(knowledge: dict, max_results: int = 3) -> str:
+    """Render a lookup() result for an agent"""
+    if not knowledge["facts"] and not knowledge["searches"]:
+        return (f"No stored knowledge for {knowledge['company'] or 'this company'}"
+                f"{' ' + knowledge['period'] if knowledge['period'] else ''}. Use the Web Search Tool.")
+    lines = [f"Stored knowledge for {knowledge['company']}{' ' + knowledge['period'] if knowledge['period'] else ''}:"]
+    if knowledge["facts"]:
+        lines.append("Facts:")
+        for fact in knowledge["facts"]:
+            source = f", source: {fact['source']}" if fact["source"] else ""
+            lines.append(f"- [{fact['period'] or 'any period'}] {fact['fact']} ({fact['age']}{source})")
+    if knowledge["searches"]:
+        lines.append("Earlier web searches:")
+        for search in knowledge["searches"]:
+            lines.append(f"- \"{search['query']}\" ({search['age']}):")
+            lines.extend(f"    {result}" for result in search["results"][:max_results])
+    return "\n".join(lines)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_knowledge_store() -> KnowledgeStore:
+    """The process-wide store"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = KnowledgeStore()
+        return _store
@@ -1,31 +1,116 @@
-from fastapi import FastAPI, File, UploadFile, Form, HTTPException
+from fastapi import FastAPI, File, UploadFile, Form, Header, HTTPException, Request
+from fastapi.responses import StreamingResponse, Response, FileResponse, JSONResponse
+from starlette.background import BackgroundTask
 import os
 import uuid
 import asyncio
 
 from crewai import Crew, Process
-from agents import financial_analyst, verifier, investment_advisor, risk_assessor
-from task import analyze_financial_document, investment_analysis, risk_assessment, verification
+from agents import financial_analyst, verifier, investment_advisor, risk_assessor, llm
+from task import analyze_financial_document, investment_analysis, risk_assessment, verification, quick_analysis
+from streaming import stream_events, TaskBoundaryTracker
+from telemetry import setup_telemetry, stage, CrewTaskTimer, registry, PROMETHEUS_CONTENT_TYPE
+from token_budget import TokenBudget, current_budget, chain_task_callbacks
+from model_routing import ModelUsage, current_usage
+from profiling import profile_run, profiled, list_artifacts, artifact_path, requested as profiling_requested
+from triage import triage_document, triage_stored_document
+from admission import AdmissionController, AdmissionRejected
+from run_control import CrewRunner, RunCancelled
+from document_store import get_store
+from uploads import get_upload_sessions, UploadError
+from structured_output import StructuredOutputCollector, llm_repairer
+from shared_cache import get_shared_cache, cache_key
+from ingestion import get_pages, detect_company_period
+from knowledge_store import current_subject
 
 app = FastAPI(title="Financial Document Analyzer", version="1.0.0")
+setup_telemetry(app)
 
-def run_financial_crew(query: str, file_path: str = "data/sample.pdf"):
-    """Run the financial analysis crew with all agents and tasks"""
+# Bounds concurrent crew runs; excess requests wait briefly or are shed with 429/503
+admission = AdmissionController("analyze")
+# Crews run here, off the event loop, so /health and other requests stay responsive
+crew_runner = CrewRunner()
+# Uploads live in the content-addressed store; identical uploads share one file
+document_store = get_store()
+document_store.start_janitor()
+# Resumable chunked uploads for large filings, assembled into the same store
+upload_sessions = get_upload_sessions()
+
+@app.exception_handler(AdmissionRejected)
+async def admission_rejected_handler(request, exc: AdmissionRejected):
+    return JSONResponse(status_code=exc.status_code, content={"detail": exc.detail},
+                        headers={"Retry-After": str(exc.retry_after)})
+
+@app.exception_handler(UploadError)
+async def upload_error_handler(request, exc: UploadError):
+    return JSONResponse(status_code=exc.status, content={"detail": str(exc)})
+
+CREW_TASK_NAMES = ["verification", "analyze_financial_document", "investment_analysis", "risk_assessment"]
+
+# Crews selected by triage: (agents, tasks, task names)
+PIPELINES = {
+    "full": (
+        [verifier, financial_analyst, investment_advisor, risk_assessor],
+        [verification, analyze_financial_document, investment_analysis, risk_assessment],
+        CREW_TASK_NAMES
+    ),
+    "light": ([financial_analyst], [quick_analysis], ["quick_analysis"]),
+}
+
+# Recent results by (content hash, query) so re-uploads of the same file are answered instantly,
+# kept in the shared cache tier so every API process (serve.py --workers N) sees them
+DUPLICATE_TTL_SECONDS = int(os.getenv("DUPLICATE_TTL_SECONDS", "3600"))
+
+def lookup_recent_result(content_hash: str, query: str):
+    """Return a cached analysis of the same content and query, if still fresh"""
+    return get_shared_cache().get("results", cache_key(content_hash, query))
+
+def store_recent_result(content_hash: str, query: str, result: dict):
+    get_shared_cache().set("results", cache_key(content_hash, query), result, DUPLICATE_TTL_SECONDS)
+
+def run_financial_crew(query: str, file_path: str = "data/sample.pdf", task_callback=None, pipeline: str = "full",
+                       usage: ModelUsage = None, structured: StructuredOutputCollector = None):
+    """
+    Run the financial analysis crew with all agents and tasks (or the light single-task crew)
+
+    structured, if given, collects each task's validated JSON output.
+    """
+    agents, tasks, task_names = PIPELINES[pipeline]
+    timer = CrewTaskTimer(task_names)
+    budget = TokenBudget(task_names)
+    usage = usage or ModelUsage()
+
+    budget_token = current_budget.set(budget)
+    usage_token = current_usage.set(usage)
+    subject_token = current_subject.set(detect_company_period("\n".join(get_pages(file_path)[:3]), file_path))
     try:
         financial_crew = Crew(
-            agents=[verifier, financial_analyst, investment_advisor, risk_assessor],
-            tasks=[verification, analyze_financial_document, investment_analysis, risk_assessment],
+            agents=agents,
+            tasks=tasks,
             process=Process.sequential,
-            verbose=True
+            verbose=True,
+            task_callback=chain_task_callbacks(budget, timer, task_callback, structured)
         )
         
-        result = financial_crew.kickoff({
-            'query': query,
-            'file_path': file_path
-        })
+        with stage("crew.kickoff", tasks=len(task_names), pipeline=pipeline):
+            result = financial_crew.kickoff({
+                'query': query,
+                'file_path': file_path
+            })
         return result
     except Exception as e:
         raise Exception(f"Error running financial analysis crew: {str(e)}")
+    finally:
+        current_budget.reset(budget_token)
+        current_usage.reset(usage_token)
+        current_subject.reset(subject_token)
+        budget.log_summary()
+        usage.log_summary()
+
+def run_profiled_crew(**kwargs):
+    """run_financial_crew under the request's profiler (cProfile only sees the calling thread)"""
+    with profiled("run_financial_crew"):
+        return run_financial_crew(**kwargs)
 
 @app.get("/")
 async def root():
@@ -42,72 +127,264 @@ async def health_check():
     return {
         "status": "healthy",
         "service": "Financial Document Analyzer",
-        "version": "1.0.0"
+        "version": "1.0.0",
+        "active_analyses": admission.active,
+        "queued_analyses": admission.queued
     }
 
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics endpoint"""
+    return Response(content=registry.render(), media_type=PROMETHEUS_CONTENT_TYPE)
+
+@app.get("/profiles/{profile_id}")
+async def get_profile_artifacts(profile_id: str):
+    """List the profiling artifacts captured for a request"""
+    artifacts = list_artifacts(profile_id)
+    if not artifacts:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return {"profile_id": profile_id, "artifacts": artifacts}
+
+@app.get("/profiles/{profile_id}/{artifact}")
+async def download_profile_artifact(profile_id: str, artifact: str):
+    """Download one profiling artifact (.prof or .tracemalloc.txt)"""
+    path = artifact_path(profile_id, artifact)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Profile artifact not found")
+    return FileResponse(path, filename=artifact)
+
+@app.post("/uploads", status_code=201)
+async def create_upload(filename: str = Form(...), size: int = Form(...), sha256: str = Form(default=None)):
+    """Start a resumable upload; send chunks with PUT /uploads/{upload_id}?offset=N"""
+    return upload_sessions.create(filename, size, sha256)
+
+@app.get("/uploads/{upload_id}")
+async def get_upload(upload_id: str):
+    """Received ranges and the next missing offset, for resuming"""
+    return upload_sessions.status(upload_id)
+
+@app.put("/uploads/{upload_id}")
+async def put_upload_chunk(request: Request, upload_id: str, offset: int, x_chunk_sha256: str = Header(default=None)):
+    """Write one chunk (the raw request body) at offset"""
+    with stage("upload.chunk"):
+        return await upload_sessions.receive_chunk(upload_id, offset, request.stream(), x_chunk_sha256)
+
+@app.post("/uploads/{upload_id}/complete")
+async def complete_upload(upload_id: str, query: str = Form(default=None)):
+    """Assemble and hash the upload; with a query, also report a recent identical analysis"""
+    with stage("upload.complete"):
+        result = await asyncio.to_thread(upload_sessions.complete, upload_id)
+    if query and query.strip():
+        cached = lookup_recent_result(result["content_hash"], query.strip())
+        if cached is not None:
+            result["cached_result"] = dict(cached, duplicate=True)
+    return result
+
+@app.delete("/uploads/{upload_id}")
+async def delete_upload(upload_id: str):
+    upload_sessions.delete(upload_id)
+    return {"upload_id": upload_id, "deleted": True}
+
 @app.post("/analyze")
 async def analyze_document(
-    file: UploadFile = File(...),
-    query: str = Form(default="Provide a comprehensive financial analysis of this document")
+    request: Request,
+    file: UploadFile = File(default=None),
+    upload_id: str = Form(default=None),
+    query: str = Form(default="Provide a comprehensive financial analysis of this document"),
+    profile: bool = Form(default=False),
+    x_profile: str = Header(default=None)
 ):
     """
     Analyze financial document and provide comprehensive investment recommendations
     
     Args:
         file: PDF file containing financial document
+        upload_id: a completed resumable upload (see /uploads), instead of file
         query: Specific analysis query or question
+        profile / X-Profile header: capture cProfile and tracemalloc output for this request
     
     Returns:
         Comprehensive financial analysis with investment recommendations and risk assessment
     """
     
+    if upload_id:
+        doc_id, filename = upload_sessions.document(upload_id)
+    elif file is None:
+        raise HTTPException(status_code=400, detail="Send a file or the upload_id of a completed upload")
+    else:
+        doc_id, filename = None, file.filename
+    
     # Validate file type
-    if not file.filename.lower().endswith('.pdf'):
+    if not filename.lower().endswith('.pdf'):
         raise HTTPException(status_code=400, detail="Only PDF files are supported")
     
     file_id = str(uuid.uuid4())
-    file_path = f"data/financial_document_{file_id}.pdf"
+    document = None
     
-    try:
-        # Ensure data directory exists
-        os.makedirs("data", exist_ok=True)
+    profile_enabled = profiling_requested(x_profile, profile)
+    with profile_run(file_id, enabled=profile_enabled):
+        try:
+            # Validate and clean query
+            if not query or query.strip() == "":
+                query = "Provide a comprehensive financial analysis of this document"
+            query = query.strip()
+            
+            # Triage parses (and may OCR) the PDF: off the event loop, like the crew
+            if doc_id is not None:
+                # Already stored and hashed by the upload; triage reads it from a memory map
+                with stage("triage"):
+                    triage = await asyncio.to_thread(
+                        triage_stored_document, document_store, doc_id, filename,
+                        lookup_duplicate=lambda h: lookup_recent_result(h, query))
+                file_size = os.path.getsize(document_store.path(doc_id))
+            else:
+                # Read uploaded file
+                with stage("upload"), profiled("upload_read"):
+                    content = await file.read()
+                    if len(content) == 0:
+                        raise HTTPException(status_code=400, detail="Uploaded file is empty")
+                
+                # Cheap local triage before any LLM call
+                with stage("triage"):
+                    triage = await asyncio.to_thread(triage_document, content, filename,
+                                                     lookup_duplicate=lambda h: lookup_recent_result(h, query))
+                file_size = len(content)
+            if triage["decision"] == "reject":
+                raise HTTPException(status_code=422, detail=f"Document rejected: {triage['reason']}")
+            if triage["decision"] == "duplicate":
+                return dict(triage["cached_result"], duplicate=True)
+            
+            if doc_id is not None:
+                document = (doc_id, document_store.acquire(doc_id))
+            else:
+                with stage("document_store.put"):
+                    document = document_store.put(content)
+            file_path = document_store.path(document[0])
+            
+            # Process the financial document with all analysts (or the light crew)
+            usage = ModelUsage()
+            structured = StructuredOutputCollector(PIPELINES[triage["decision"]][2], repair=llm_repairer(llm))
+            admitted_at = await admission.acquire()
+            # The slot is held until the crew thread finishes, also when the request stops waiting for it
+            response = await crew_runner.run(run_profiled_crew, request=request, query=query, file_path=file_path,
+                                             pipeline=triage["decision"], usage=usage, structured=structured,
+                                             on_done=lambda: admission.release(admitted_at))
+            
+            result = {
+                "status": "success",
+                "query": query,
+                "analysis": str(response),
+                "structured": structured.structured,
+                "file_processed": filename,
+                "file_size_bytes": file_size,
+                "document_type": triage["document_type"],
+                "pipeline": triage["decision"],
+                "model_usage": usage.summary()
+            }
+            store_recent_result(triage["content_hash"], query, result)
+            if profile_enabled:
+                result["profile_id"] = file_id
+                result["profile_artifacts"] = list_artifacts(file_id)
+            return result
+            
+        except (HTTPException, AdmissionRejected):
+            raise
+        except RunCancelled as e:
+            # 499: the client closed the request (nginx convention); nobody reads this response
+            raise HTTPException(status_code=504 if e.reason == "deadline" else 499, detail=str(e))
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Error processing financial document: {str(e)}")
         
-        # Save uploaded file
-        with open(file_path, "wb") as f:
-            content = await file.read()
-            if len(content) == 0:
-                raise HTTPException(status_code=400, detail="Uploaded file is empty")
-            f.write(content)
-        
-        # Validate and clean query
-        if not query or query.strip() == "":
-            query = "Provide a comprehensive financial analysis of this document"
-        query = query.strip()
-        
-        # Process the financial document with all analysts
-        response = run_financial_crew(query=query, file_path=file_path)
-        
-        return {
-            "status": "success",
-            "query": query,
-            "analysis": str(response),
-            "file_processed": file.filename,
-            "file_size_bytes": len(content)
-        }
-        
-    except HTTPException:
+        finally:
+            # Drop our reference; the store's janitor removes the file once it is unused
+            if document is not None:
+                document_store.release(*document)
+
+def run_streaming_crew(query: str, file_path: str, pipeline: str = "full"):
+    """Run the crew while emitting task boundaries to the current stream"""
+    tracker = TaskBoundaryTracker(PIPELINES[pipeline][2])
+    tracker.start()
+    return run_financial_crew(query=query, file_path=file_path, task_callback=tracker, pipeline=pipeline)
+
+@app.post("/analyze/stream")
+async def analyze_document_stream(
+    file: UploadFile = File(...),
+    query: str = Form(default="Provide a comprehensive financial analysis of this document")
+):
+    """
+    Analyze a financial document and stream progress as server-sent events
+    
+    Events:
+        task_start / task_end: crew task boundaries (task_end carries the task output)
+        token: LLM tokens as they are generated
+        result: the final analysis
+        error: the run failed
+    """
+    
+    if not file.filename.lower().endswith('.pdf'):
+        raise HTTPException(status_code=400, detail="Only PDF files are supported")
+    
+    with stage("upload"):
+        content = await file.read()
+    if len(content) == 0:
+        raise HTTPException(status_code=400, detail="Uploaded file is empty")
+    
+    with stage("triage"):
+        triage = await asyncio.to_thread(triage_document, content, file.filename)
+    if triage["decision"] == "reject":
+        raise HTTPException(status_code=422, detail=f"Document rejected: {triage['reason']}")
+    
+    if not query or query.strip() == "":
+        query = "Provide a comprehensive financial analysis of this document"
+    query = query.strip()
+    
+    document = document_store.put(content)
+    file_path = document_store.path(document[0])
+    
+    # Take the slot before the response starts so overload is reported as a status code
+    try:
+        admitted_at = await admission.acquire()
+    except AdmissionRejected:
+        document_store.release(*document)
         raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error processing financial document: {str(e)}")
     
-    finally:
-        # Clean up uploaded file
-        if os.path.exists(file_path):
-            try:
-                os.remove(file_path)
-            except Exception:
-                pass  # Ignore cleanup errors
+    run_started = False
+    
+    def release_run():
+        # Frees the slot and the document once the crew thread is done with them
+        nonlocal admitted_at, document
+        if admitted_at is not None:
+            admission.release(admitted_at)
+            admitted_at = None
+        if document is not None:
+            document_store.release(*document)
+            document = None
+    
+    def release_unstarted():
+        # Background task: a stream that never started has no crew thread to wait for
+        if not run_started:
+            release_run()
+    
+    async def event_stream():
+        nonlocal run_started
+        run_started = True
+        async for event in stream_events(run_streaming_crew, runner=crew_runner, on_done=release_run, query=query,
+                                         file_path=file_path, pipeline=triage["decision"]):
+            yield event
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        background=BackgroundTask(release_unstarted)
+    )
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000, reload=True)
+    # WEB_CONCURRENCY > 1 runs several worker processes (see serve.py)
+    workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+    if workers > 1:
+        from serve import serve
+        serve("main:app", port=8000, workers=workers)
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=8000)
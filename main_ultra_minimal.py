@@ -1,17 +1,19 @@
 import os
-import tempfile
 from typing import Dict, Any
 from fastapi import FastAPI, File, UploadFile, HTTPException
 from fastapi.responses import JSONResponse
 import google.generativeai as genai
-from pypdf import PdfReader
+from fastapi.concurrency import run_in_threadpool
 from dotenv import load_dotenv
+from mock_llm import is_mock_backend, MockGenerativeModel
+from ingestion import extract_pages, spool_upload
 
 # Load environment variables
 load_dotenv()
 
-# Configure Google AI
+# Configure Google AI (LLM_BACKEND=mock swaps in the offline stand-in)
 genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
+GenerativeModel = MockGenerativeModel if is_mock_backend() else genai.GenerativeModel
 
 app = FastAPI(
     title="Financial Document Analyzer",
@@ -21,25 +23,13 @@ app = FastAPI(
 
 class FinancialAnalyzer:
     def __init__(self):
-        self.model = genai.GenerativeModel('gemini-pro')
+        self.model = GenerativeModel('gemini-pro')
     
-    def extract_text_from_pdf(self, file_content: bytes) -> str:
+    def extract_text_from_pdf(self, file_path: str) -> str:
         """Extract text from PDF file"""
         try:
-            # Create temporary file
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp_file:
-                tmp_file.write(file_content)
-                tmp_file_path = tmp_file.name
-            
-            # Extract text using pypdf
-            reader = PdfReader(tmp_file_path)
-            text = ""
-            for page in reader.pages:
-                text += page.extract_text() + "\n"
-            
-            # Clean up temporary file
-            os.unlink(tmp_file_path)
-            
+            # Pages are read one at a time from a memory map of the file; scanned pages are OCR'd
+            text = "".join(page_text + "\n" for page_text in extract_pages(file_path))
             return text.strip()
         except Exception as e:
             raise HTTPException(status_code=400, detail=f"Error extracting PDF text: {str(e)}")
@@ -112,14 +102,16 @@ async def analyze_document(file: UploadFile = File(...)):
         if not file.filename.lower().endswith('.pdf'):
             raise HTTPException(status_code=400, detail="Only PDF files are supported")
         
-        # Read file content
-        file_content = await file.read()
-        
-        if len(file_content) == 0:
-            raise HTTPException(status_code=400, detail="Empty file uploaded")
-        
-        # Extract text from PDF
-        text = analyzer.extract_text_from_pdf(file_content)
+        # Spool the upload to disk instead of reading it into memory
+        file_path, file_size = await run_in_threadpool(spool_upload, file.file)
+        try:
+            if file_size == 0:
+                raise HTTPException(status_code=400, detail="Empty file uploaded")
+            
+            # Extract text from PDF
+            text = analyzer.extract_text_from_pdf(file_path)
+        finally:
+            os.unlink(file_path)
         
         if not text.strip():
             raise HTTPException(status_code=400, detail="No text could be extracted from the PDF")
@@ -130,7 +122,7 @@ async def analyze_document(file: UploadFile = File(...)):
         return JSONResponse(content={
             "success": True,
             "filename": file.filename,
-            "file_size": len(file_content),
+            "file_size": file_size,
             "text_length": len(text),
             "analysis": analysis_result
         })
@@ -144,7 +136,7 @@ if __name__ == "__main__":
     import uvicorn
     
     # Check if API key is configured
-    if not os.getenv("GOOGLE_API_KEY"):
+    if not os.getenv("GOOGLE_API_KEY") and not is_mock_backend():
         print("⚠️  WARNING: GOOGLE_API_KEY not found in environment variables")
         print("Please add your Google API key to the .env file")
         exit(1)
@@ -153,4 +145,10 @@ if __name__ == "__main__":
     print("📖 API Documentation: http://localhost:8000/docs")
     print("🔍 Test endpoint: http://localhost:8000/analyze")
     
-    uvicorn.run(app, host="0.0.0.0", port=8000, reload=True)
+    # WEB_CONCURRENCY > 1 runs several worker processes (see serve.py)
+    workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+    if workers > 1:
+        from serve import serve
+        serve("main_ultra_minimal:app", port=8000, workers=workers)
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -3,26 +3,40 @@ Minimal Financial Document Analyzer
 Compatible with Python 3.13 and ARM64 macOS
 """
 import os
-import tempfile
+import uuid
 from typing import Optional
-from fastapi import FastAPI, File, UploadFile, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, File, UploadFile, Form, Header, HTTPException
+from fastapi.responses import JSONResponse, Response, FileResponse
 import google.generativeai as genai
 from dotenv import load_dotenv
-import pypdf
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
+from ingestion import extract_pages, spool_upload
+from fact_store import FactTable
+from offline_analysis import analyze_pages, render_text
+from schemas import GeminiAnalysis, format_instructions
+from structured_output import parse_structured
+from mock_llm import is_mock_backend, MockGenerativeModel
+from resilient_llm import ResilientGenerativeModel, CircuitOpenError
+from telemetry import setup_telemetry, stage, registry, PROMETHEUS_CONTENT_TYPE
+from profiling import profile_run, profiled, artifact_path, requested as profiling_requested
 
 # Load environment variables
 load_dotenv()
 
-# Configure Gemini
+# Configure Gemini (LLM_BACKEND=mock swaps in the offline stand-in)
 genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
+GenerativeModel = MockGenerativeModel if is_mock_backend() else genai.GenerativeModel
+
+# Answer with the offline engine instead of a 503 while the Gemini circuit is open
+OFFLINE_FALLBACK = os.getenv("OFFLINE_FALLBACK", "1").lower() not in ("0", "false", "no")
 
 app = FastAPI(
     title="Financial Document Analyzer",
     description="AI-powered financial document analysis using Google Gemini",
     version="1.0.0"
 )
+setup_telemetry(app)
 
 class AnalysisResponse(BaseModel):
     financial_summary: str
@@ -31,27 +45,17 @@ class AnalysisResponse(BaseModel):
     investment_recommendations: str
     document_verification: str
 
-def extract_text_from_pdf(file_content: bytes) -> str:
-    """Extract text from PDF file"""
+def extract_pages_from_pdf(file_path: str) -> list:
+    """Extract page texts from PDF file, page by page from a memory map (OCR for scanned pages)"""
     try:
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp_file:
-            tmp_file.write(file_content)
-            tmp_file.flush()
-            
-            reader = pypdf.PdfReader(tmp_file.name)
-            text = ""
-            for page in reader.pages:
-                text += page.extract_text() + "\n"
-            
-            os.unlink(tmp_file.name)
-            return text
+        return extract_pages(file_path)
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Error extracting PDF text: {str(e)}")
 
-def analyze_with_gemini(text: str) -> dict:
+def analyze_with_gemini(text: str, facts: FactTable) -> dict:
     """Analyze financial document using Gemini AI"""
     try:
-        model = genai.GenerativeModel('gemini-pro')
+        model = ResilientGenerativeModel(GenerativeModel('gemini-pro'))
         
         prompt = f"""
         You are a financial expert analyzing a document. Provide a comprehensive analysis with:
@@ -65,35 +69,37 @@ def analyze_with_gemini(text: str) -> dict:
         Document content:
         {text[:4000]}  # Limit to avoid token limits
         
-        Format your response as JSON with these exact keys:
-        - financial_summary
-        - key_metrics (as a dictionary)
-        - risk_assessment
-        - investment_recommendations
-        - document_verification
+        {format_instructions(GeminiAnalysis)}
         """
         
-        response = model.generate_content(prompt)
+        with stage("llm.gemini", prompt_chars=len(prompt)):
+            response = model.generate_content(prompt)
         
-        # Parse response (simplified - in production, use proper JSON parsing)
-        result = {
-            "financial_summary": "Document analyzed successfully with key financial insights extracted.",
-            "key_metrics": {
-                "analysis_confidence": "High",
-                "document_pages": text.count('\n') // 50,
-                "key_figures_found": len([x for x in text.split() if '$' in x or '%' in x])
-            },
-            "risk_assessment": "Risk factors identified and evaluated based on document content.",
-            "investment_recommendations": "Strategic recommendations provided based on financial analysis.",
-            "document_verification": "Document structure and content verified for completeness."
+        # Figures come from the fact table; the model's own key_metrics are added under their names
+        key_metrics = {
+            "analysis_confidence": "High",
+            "document_pages": facts.page_count,
+            "key_figures_found": len(facts),
+            "latest_figures": facts.latest()
         }
+        with stage("llm.parse_structured"):
+            # A malformed answer is repaired by a short follow-up call, not by re-running the analysis
+            parsed = parse_structured(response.text or "", GeminiAnalysis,
+                                      repair=lambda repair_prompt: model.generate_content(repair_prompt).text)
+        if parsed is None:
+            key_metrics["analysis_confidence"] = "Low"
+            return {
+                "financial_summary": (response.text or "")[:500] or "The model returned no analysis.",
+                "key_metrics": key_metrics,
+                "risk_assessment": "Unavailable: the model's answer could not be parsed.",
+                "investment_recommendations": "Unavailable: the model's answer could not be parsed.",
+                "document_verification": "Unavailable: the model's answer could not be parsed."
+            }
+        return dict(parsed.model_dump(), key_metrics={**parsed.key_metrics, **key_metrics})
         
-        # Try to extract actual content from Gemini response
-        if response.text:
-            result["financial_summary"] = response.text[:500] + "..."
-            
-        return result
-        
+    except CircuitOpenError as e:
+        raise HTTPException(status_code=503, detail=f"AI analysis temporarily unavailable: {str(e)}",
+                            headers={"Retry-After": str(int(model.client.config.reset_timeout))})
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"AI analysis error: {str(e)}")
 
@@ -103,28 +109,75 @@ async def root():
 
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy", "api_key_configured": bool(os.getenv("GOOGLE_API_KEY"))}
+    return {"status": "healthy", "api_key_configured": bool(os.getenv("GOOGLE_API_KEY")) or is_mock_backend()}
+
+@app.get("/metrics")
+async def metrics():
+    return Response(content=registry.render(), media_type=PROMETHEUS_CONTENT_TYPE)
+
+@app.get("/profiles/{profile_id}/{artifact}")
+async def download_profile_artifact(profile_id: str, artifact: str):
+    path = artifact_path(profile_id, artifact)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Profile artifact not found")
+    return FileResponse(path, filename=artifact)
 
 @app.post("/analyze", response_model=AnalysisResponse)
-async def analyze_document(file: UploadFile = File(...)):
+async def analyze_document(
+    response: Response,
+    file: UploadFile = File(...),
+    mode: str = Form(default="llm"),
+    profile: bool = Form(default=False),
+    x_profile: str = Header(default=None)
+):
     """
     Analyze a financial document (PDF)
+
+    mode=offline skips Gemini and answers from the deterministic offline engine.
+
+    Send `X-Profile: 1` (or profile=true) to capture profiling output; its id is
+    returned in the `X-Profile-Id` response header.
     """
     if not file.filename.endswith('.pdf'):
         raise HTTPException(status_code=400, detail="Only PDF files are supported")
     
+    profile_id = str(uuid.uuid4())
+    profile_enabled = profiling_requested(x_profile, profile)
+    if profile_enabled:
+        response.headers["X-Profile-Id"] = profile_id
+    
     try:
-        # Read file content
-        content = await file.read()
-        
-        # Extract text from PDF
-        text = extract_text_from_pdf(content)
-        
-        if not text.strip():
-            raise HTTPException(status_code=400, detail="No text found in PDF")
-        
-        # Analyze with Gemini
-        analysis = analyze_with_gemini(text)
+        with profile_run(profile_id, enabled=profile_enabled):
+            # Spool the upload to disk instead of holding it in memory
+            with stage("upload"), profiled("upload_read"):
+                pdf_path, size = await run_in_threadpool(spool_upload, file.file)
+            
+            # Extract text from PDF
+            try:
+                with stage("pdf.parse", size_bytes=size), profiled("extract_pages_from_pdf"):
+                    pages = extract_pages_from_pdf(pdf_path)
+            finally:
+                os.unlink(pdf_path)
+            text = "".join(page + "\n" for page in pages)
+            with stage("facts.extract", pages=len(pages)):
+                facts = FactTable.from_pages(pages, file.filename)
+            
+            if not text.strip():
+                raise HTTPException(status_code=400, detail="No text found in PDF")
+            
+            # Analyze with Gemini, or offline when asked to or while Gemini is unavailable
+            analysis = None
+            if mode != "offline":
+                try:
+                    with profiled("analyze_with_gemini"):
+                        analysis = analyze_with_gemini(text, facts)
+                except HTTPException as e:
+                    if e.status_code != 503 or not OFFLINE_FALLBACK:
+                        raise
+            if analysis is None:
+                with stage("offline.analyze", pages=len(pages)), profiled("offline_analysis"):
+                    analysis = render_text(analyze_pages(pages, file.filename))
+                response.headers["X-Analysis-Mode"] = "offline"
         
         return AnalysisResponse(**analysis)
         
@@ -135,4 +188,10 @@ async def analyze_document(file: UploadFile = File(...)):
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # WEB_CONCURRENCY > 1 runs several worker processes (see serve.py)
+    workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+    if workers > 1:
+        from serve import serve
+        serve("main_working:app", port=8000, workers=workers)
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,219 @@
+"""
+Offline, deterministic stand-in for the Gemini backends.
+
+Set LLM_BACKEND=mock to swap both `ChatLiteLLM` (used by the crew) and
+`genai.GenerativeModel` (used by main_working.py, main_ultra_minimal.py and
+simple_server.py) for local fakes. Responses are derived from a hash of the
+prompt, so the same input always yields the same output; prompts carrying a
+schema's format instructions (schemas.py) get a matching JSON answer. Latency,
+token throughput and failures follow configurable distributions:
+
+    MOCK_LLM_LATENCY_MS         mean time to first token (default 200)
+    MOCK_LLM_LATENCY_JITTER     log-normal sigma applied to the latency (default 0.25)
+    MOCK_LLM_TOKENS_PER_SEC     generation speed after the first token (default 400)
+    MOCK_LLM_ERROR_RATE         probability that a call fails (default 0)
+    MOCK_LLM_SEED               seed for latency/error sampling (default 42)
+"""
+import os
+import json
+import time
+import random
+import hashlib
+import threading
+
+try:
+    from langchain_core.language_models.chat_models import BaseChatModel
+    from langchain_core.messages import AIMessage, AIMessageChunk
+    from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+except ImportError:
+    BaseChatModel = None
+
+
+def is_mock_backend() -> bool:
+    """True when the process is configured to use the mock LLM"""
+    return os.getenv("LLM_BACKEND", "").lower() == "mock"
+
+
+class MockLLMError(Exception):
+    """Simulated provider failure (rate limit or outage)"""
+
+    def __init__(self, message: str, status_code: int = 503):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class MockLLMConfig:
+    """Latency, throughput and error-rate settings for the mock backend"""
+
+    def __init__(self, latency_ms=None, latency_jitter=None, tokens_per_sec=None, error_rate=None, seed=None):
+        self.latency_ms = float(latency_ms if latency_ms is not None else os.getenv("MOCK_LLM_LATENCY_MS", "200"))
+        self.latency_jitter = float(latency_jitter if latency_jitter is not None else os.getenv("MOCK_LLM_LATENCY_JITTER", "0.25"))
+        self.tokens_per_sec = float(tokens_per_sec if tokens_per_sec is not None else os.getenv("MOCK_LLM_TOKENS_PER_SEC", "400"))
+        self.error_rate = float(error_rate if error_rate is not None else os.getenv("MOCK_LLM_ERROR_RATE", "0"))
+        self.seed = int(seed if seed is not None else os.getenv("MOCK_LLM_SEED", "42"))
+
+
+def _metrics(revenue, margin):
+    return [{"name": "revenue", "value": revenue * 1e6, "unit": "USD", "period": ""},
+            {"name": "operating_margin", "value": margin, "unit": "percent", "period": ""}]
+
+
+def _gemini_answer(revenue, margin, rating):
+    return {
+        "financial_summary": f"Revenue of ${revenue}M with an operating margin of {margin}%.",
+        "key_metrics": {"revenue_musd": revenue, "operating_margin_pct": margin},
+        "risk_assessment": "Moderate market and liquidity risk.",
+        "investment_recommendations": f"{rating} with a 12 month horizon.",
+        "document_verification": "Document is readable and contains the primary statements."
+    }
+
+
+# Structured answers by a field only the matching schema's format instructions name (see schemas.py)
+_STRUCTURED_ANSWERS = [
+    ("statements_present (", lambda revenue, margin, rating: {
+        "document_type": "Quarterly update", "statements_present": ["income statement", "balance sheet"],
+        "data_quality": "High", "issues": [], "confidence": "High"}),
+    ("executive_summary (", lambda revenue, margin, rating: {
+        "executive_summary": f"Revenue was ${revenue}M and the operating margin was {margin}%.",
+        "key_metrics": _metrics(revenue, margin), "trends": ["Stable margins"],
+        "strengths": ["Positive operating income"], "weaknesses": ["Market volatility"]}),
+    ("thesis (", lambda revenue, margin, rating: {
+        "rating": rating, "thesis": f"Operating margin of {margin}% supports a {rating} view.",
+        "rationale": ["Margin trend", "Liquidity"], "risks": ["Market volatility"], "time_horizon": "12 months"}),
+    ("overall_risk (", lambda revenue, margin, rating: {
+        "overall_risk": "Medium", "risks": [
+            {"name": "Market volatility", "category": "market", "impact": "Medium", "mitigation": "Diversify"},
+            {"name": "Liquidity", "category": "financial", "impact": "Low", "mitigation": "Maintain cash buffer"}]}),
+    ("financial_summary (", _gemini_answer),
+    ("summary (string), key_metrics", lambda revenue, margin, rating: {
+        "document_type": "Short financial update", "summary": f"Revenue of ${revenue}M.",
+        "key_metrics": _metrics(revenue, margin), "rating": rating, "risks": ["Market volatility"]}),
+]
+
+
+def _structured_answer(prompt: str, revenue, margin, rating):
+    for marker, build in _STRUCTURED_ANSWERS:
+        if marker in prompt:
+            return build(revenue, margin, rating)
+    return None
+
+
+class MockLLMBackend:
+    """Shared engine behind both mock client classes"""
+
+    def __init__(self, config: MockLLMConfig = None):
+        self.config = config or MockLLMConfig()
+        self._random = random.Random(self.config.seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+
+    def _sample(self):
+        with self._lock:
+            self.calls += 1
+            fails = self._random.random() < self.config.error_rate
+            status = self._random.choice([429, 503])
+            jitter = self._random.lognormvariate(0, self.config.latency_jitter) if self.config.latency_jitter > 0 else 1.0
+        return fails, status, self.config.latency_ms / 1000.0 * jitter
+
+    def respond(self, prompt: str) -> str:
+        """Deterministic response text for a prompt"""
+        digest = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        seed = int(digest[:8], 16)
+        revenue = 1000 + seed % 9000
+        margin = 5 + seed % 30
+        rating = ["BUY", "HOLD", "SELL"][seed % 3]
+        structured = _structured_answer(prompt, revenue, margin, rating)
+        if structured is not None:
+            answer = json.dumps(structured)
+            # Crew prompts expect the ReAct format around the answer
+            return f"Thought: I now know the final answer\nFinal Answer: {answer}" if "Final Answer" in prompt else answer
+        if "json" in prompt.lower():
+            return json.dumps(_gemini_answer(revenue, margin, rating))
+        return (
+            f"Thought: I now know the final answer\n"
+            f"Final Answer: Mock analysis {digest[:12]}. Revenue was ${revenue}M and the "
+            f"operating margin was {margin}%. Recommendation: {rating}. Key risks are "
+            f"market volatility, liquidity and execution. Confidence level: high."
+        )
+
+    def stream(self, prompt: str):
+        """Yield response tokens, sleeping to mimic latency and token throughput"""
+        fails, status, first_token_delay = self._sample()
+        time.sleep(first_token_delay)
+        if fails:
+            raise MockLLMError(f"Mock LLM simulated failure ({status})", status_code=status)
+
+        per_token = 1.0 / self.config.tokens_per_sec if self.config.tokens_per_sec > 0 else 0.0
+        for index, token in enumerate(self.respond(prompt).split(" ")):
+            time.sleep(per_token)
+            yield token if index == 0 else " " + token
+
+    def generate(self, prompt: str, on_token=None) -> str:
+        """Produce a complete response, reporting each token to on_token if given"""
+        text = ""
+        for token in self.stream(prompt):
+            if on_token is not None:
+                on_token(token)
+            text += token
+        return text
+
+
+# One backend per process so error/latency sampling is reproducible
+_backend = None
+
+
+def get_backend() -> MockLLMBackend:
+    global _backend
+    if _backend is None:
+        _backend = MockLLMBackend()
+    return _backend
+
+
+class MockResponse:
+    """Mimics the parts of a google.generativeai response the app reads"""
+
+    def __init__(self, text: str):
+        self.text = text
+
+
+class MockGenerativeModel:
+    """Drop-in replacement for genai.GenerativeModel"""
+
+    def __init__(self, model_name: str = "mock", **kwargs):
+        self.model_name = model_name
+
+    def generate_content(self, prompt, stream: bool = False, **kwargs):
+        prompt = str(prompt)
+        if not stream:
+            return MockResponse(get_backend().generate(prompt))
+        return (MockResponse(token) for token in get_backend().stream(prompt))
+
+
+if BaseChatModel is not None:
+
+    class MockChatModel(BaseChatModel):
+        """Drop-in replacement for ChatLiteLLM backed by the mock engine"""
+
+        model: str = "mock/financial-analyst"
+        temperature: float = 0.0
+        streaming: bool = False
+
+        @property
+        def _llm_type(self) -> str:
+            return "mock"
+
+        def _prompt(self, messages) -> str:
+            return "\n".join(str(message.content) for message in messages)
+
+        def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+            on_token = None
+            if self.streaming and run_manager is not None:
+                on_token = run_manager.on_llm_new_token
+            text = get_backend().generate(self._prompt(messages), on_token=on_token)
+            return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
+
+        def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+            for token in get_backend().stream(self._prompt(messages)):
+                if run_manager is not None:
+                    run_manager.on_llm_new_token(token)
+                yield ChatGenerationChunk(message=AIMessageChunk(content=token))
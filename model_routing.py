@@ -0,0 +1,305 @@
+"""
+Tiered model routing for the crew.
+
+Each agent is assigned a tier instead of sharing one model:
+
+    local    answer from document heuristics without an LLM when possible
+             (currently the verifier), otherwise fall through to "fast"
+    fast     cheap model (MODEL_FAST, default gemini/gemini-1.5-flash)
+    strong   capable model (MODEL_STRONG, default gemini/gemini-1.5-pro)
+
+Routes can be overridden with MODEL_ROUTES, a JSON object mapping agent name
+to a tier or a full model name. When a fast-tier final answer looks low
+confidence (explicit "confidence: low", "insufficient data", or a very short
+answer), the call is re-run on the strong tier; set MODEL_ESCALATION=0 to
+disable. Every call is recorded per model with latency, tokens and cost
+(prices per million tokens, overridable with MODEL_PRICES) for the current run.
+Non-streamed calls repeating an earlier prompt are answered from the shared
+cache tier (shared_cache.py) for LLM_CACHE_TTL_SECONDS, in every process. The
+whole message is cached, tool calls and metadata included, and a hit is
+recorded as a zero-cost call (cached_calls) with the lookup's latency.
+"""
+import os
+import re
+import json
+import time
+import contextvars
+from typing import Any, Callable, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, message_to_dict, messages_from_dict
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+from mock_llm import is_mock_backend
+from streaming import token_stream_handler, is_streaming
+from resilient_llm import get_client
+from telemetry import telemetry_callback_handler, registry
+from token_budget import token_budget_callback_handler, count_tokens
+from shared_cache import get_shared_cache, cache_key
+from schemas import VerificationReport
+
+MODEL_TIERS = {
+    "fast": os.getenv("MODEL_FAST", "gemini/gemini-1.5-flash"),
+    "strong": os.getenv("MODEL_STRONG", "gemini/gemini-1.5-pro"),
+}
+
+DEFAULT_ROUTES = {
+    "verifier": "local",
+    "financial_analyst": "fast",
+    "investment_advisor": "strong",
+    "risk_assessor": "fast",
+    "shared": "fast",
+}
+
+# USD per million (prompt, completion) tokens
+DEFAULT_PRICES = {
+    "gemini/gemini-1.5-flash": (0.075, 0.30),
+    "gemini/gemini-1.5-pro": (1.25, 5.00),
+}
+
+ESCALATION_ENABLED = os.getenv("MODEL_ESCALATION", "1").lower() not in ("0", "false", "no")
+# Final answers shorter than this are treated as low confidence
+MIN_ANSWER_CHARS = int(os.getenv("MODEL_MIN_ANSWER_CHARS", "200"))
+# Identical prompts to the same model are answered from the shared cache tier for this long (0 disables)
+LLM_CACHE_TTL_SECONDS = int(os.getenv("LLM_CACHE_TTL_SECONDS", "3600"))
+
+registry.describe("analyzer_llm_cost_usd_total", "counter", "Estimated LLM spend by model")
+registry.describe("analyzer_llm_latency_seconds", "histogram", "LLM call latency by model")
+registry.describe("analyzer_model_escalations_total", "counter", "Fast-tier answers re-run on the strong tier")
+registry.describe("analyzer_local_answers_total", "counter", "Steps answered by local heuristics instead of an LLM")
+
+_LOW_CONFIDENCE = re.compile(
+    r"confidence(\s+level)?\s*(is|:|-)?\s*\**\s*(very\s+)?low\b|insufficient\s+(data|information)|"
+    r"unable\s+to\s+(determine|assess|verify)|cannot\s+be\s+(determined|assessed)|not\s+enough\s+information",
+    re.IGNORECASE
+)
+_FILE_PATH = re.compile(r"path:\s*'([^']+\.pdf)'", re.IGNORECASE)
+
+current_usage = contextvars.ContextVar("current_usage", default=None)
+
+
+def load_routes() -> dict:
+    routes = dict(DEFAULT_ROUTES)
+    override = os.getenv("MODEL_ROUTES")
+    if override:
+        routes.update(json.loads(override))
+    return routes
+
+
+def load_prices() -> dict:
+    prices = dict(DEFAULT_PRICES)
+    override = os.getenv("MODEL_PRICES")
+    if override:
+        prices.update({model: tuple(pair) for model, pair in json.loads(override).items()})
+    return prices
+
+
+class ModelUsage:
+    """Per-run calls, tokens, latency and cost broken down by model"""
+
+    def __init__(self):
+        self.prices = load_prices()
+        self.models = {}
+        self.escalations = []
+        self.local_answers = []
+
+    def record(self, model: str, prompt_tokens: int, completion_tokens: int, seconds: float, cached: bool = False):
+        entry = self.models.setdefault(model, {"calls": 0, "cached_calls": 0, "prompt_tokens": 0,
+                                               "completion_tokens": 0, "latency_s": 0.0, "cost_usd": 0.0})
+        prompt_price, completion_price = self.prices.get(model, (0.0, 0.0))
+        cost = (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1_000_000
+        entry["calls"] += 1
+        entry["cached_calls"] += int(cached)
+        entry["prompt_tokens"] += prompt_tokens
+        entry["completion_tokens"] += completion_tokens
+        entry["latency_s"] += seconds
+        entry["cost_usd"] += cost
+        return cost
+
+    def summary(self) -> dict:
+        models = {model: dict(entry, latency_s=round(entry["latency_s"], 3), cost_usd=round(entry["cost_usd"], 6))
+                  for model, entry in self.models.items()}
+        return {
+            "models": models,
+            "total_cost_usd": round(sum(entry["cost_usd"] for entry in self.models.values()), 6),
+            "total_latency_s": round(sum(entry["latency_s"] for entry in self.models.values()), 3),
+            "escalations": list(self.escalations),
+            "local_answers": list(self.local_answers),
+        }
+
+    def log_summary(self):
+        parts = [f"{model}: {entry['calls']} calls, {entry['latency_s']:.2f}s, ${entry['cost_usd']:.4f}"
+                 for model, entry in self.models.items()]
+        print(f"Model usage: {'; '.join(parts) or 'no LLM calls'}; "
+              f"escalations={len(self.escalations)}, local answers={len(self.local_answers)}")
+
+
+def _record_cached_call(model: str, seconds: float):
+    """A call answered from the shared cache: no tokens billed, only the lookup's latency"""
+    usage = current_usage.get()
+    if usage is not None:
+        usage.record(model, 0, 0, seconds, cached=True)
+
+
+def _record_call(agent: str, model: str, messages, message, seconds: float):
+    metadata = getattr(message, "usage_metadata", None) or {}
+    prompt_tokens = metadata.get("input_tokens") or count_tokens("\n".join(str(m.content) for m in messages))
+    completion_tokens = metadata.get("output_tokens") or count_tokens(str(message.content))
+    registry.observe("analyzer_llm_latency_seconds", seconds, {"model": model})
+    usage = current_usage.get()
+    if usage is not None:
+        cost = usage.record(model, prompt_tokens, completion_tokens, seconds)
+    else:
+        prompt_price, completion_price = load_prices().get(model, (0.0, 0.0))
+        cost = (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1_000_000
+    if cost:
+        registry.inc("analyzer_llm_cost_usd_total", cost, {"model": model, "agent": agent})
+
+
+def is_low_confidence(text: str) -> bool:
+    """Heuristic check on a final answer; tool-use steps are never escalated"""
+    if "Action:" in text and "Final Answer:" not in text:
+        return False
+    answer = text.split("Final Answer:", 1)[-1].strip()
+    return len(answer) < MIN_ANSWER_CHARS or bool(_LOW_CONFIDENCE.search(answer))
+
+
+def local_verification_answer(prompt: str) -> Optional[str]:
+    """
+    VerificationReport JSON built from the parsed document, or None if the prompt
+    does not reference a readable PDF. Covers the verifier checklist: readability,
+    document type, presence of the key statements and data quality.
+    """
+    # Imported lazily: the document modules are not needed unless the local tier is used
+    from ingestion import get_pages
+    from document_reader import find_section_page
+    from triage import classify_document, financial_score
+
+    match = _FILE_PATH.search(prompt)
+    if not match or not os.path.exists(match.group(1)):
+        return None
+    try:
+        pages = get_pages(match.group(1))
+    except Exception:
+        return None
+    text = "\n".join(pages)
+    if not text.strip():
+        return None
+
+    statements = {name: find_section_page(pages, name) for name in ("income statement", "balance sheet", "cash flow")}
+    found = [f"{name.title()} (page {page})" for name, page in statements.items() if page]
+    missing = [name.title() for name, page in statements.items() if not page]
+    chars_per_page = len(text) // max(len(pages), 1)
+    score = financial_score(text)
+    confidence = "High" if len(found) >= 2 and score >= 8 else "Medium" if found or score >= 5 else "Low"
+    if confidence == "Low":
+        # Not trivially verifiable: let a model look at it
+        return None
+
+    # Same shape the verification task asks the model for, so the structured collector parses it unchanged
+    report = VerificationReport(
+        document_type=classify_document(text, match.group(1)),
+        statements_present=found,
+        data_quality="High" if not missing and score >= 8 else "Medium" if found else "Low",
+        issues=[f"{name} not located" for name in missing]
+        + ([f"Little extractable text (about {chars_per_page} characters per page)"] if chars_per_page < 200 else []),
+        confidence=confidence,
+    )
+    return ("Thought: The document structure answers the verification checklist directly.\n"
+            f"Final Answer: {report.model_dump_json()}")
+
+
+LOCAL_HANDLERS = {"verifier": local_verification_answer}
+
+
+class RoutedChatModel(BaseChatModel):
+    """Chat model that tries a local answer, then the primary model, escalating low-confidence answers"""
+
+    agent: str
+    primary: Any
+    primary_model: str
+    escalation: Any = None
+    escalation_model: Optional[str] = None
+    local: Optional[Callable] = None
+
+    @property
+    def _llm_type(self) -> str:
+        return "routed"
+
+    def _invoke(self, model, model_name: str, messages, stop):
+        # Streamed runs forward tokens as they are generated, so they always call the model
+        key = None
+        started = time.perf_counter()
+        if LLM_CACHE_TTL_SECONDS > 0 and not is_streaming():
+            key = cache_key(model_name, stop, [(m.type, str(m.content)) for m in messages])
+            cached = get_shared_cache().get("llm", key)
+            # Entries cached as bare content by earlier versions lack tool calls and metadata: treated as misses
+            if isinstance(cached, dict):
+                _record_cached_call(model_name, time.perf_counter() - started)
+                return messages_from_dict([cached])[0]
+            started = time.perf_counter()
+        # Hedged duplicates would interleave tokens on a live stream, so streamed runs are never hedged
+        # The time left is LiteLLM's request timeout, so a call abandoned at its deadline also ends there
+        message = get_client(model_name).call(model.invoke, messages, stop=stop, hedge=False if is_streaming() else None,
+                                              timeout_kwargs=lambda seconds: {"timeout": seconds})
+        _record_call(self.agent, model_name, messages, message, time.perf_counter() - started)
+        if key is not None:
+            get_shared_cache().set("llm", key, message_to_dict(message), LLM_CACHE_TTL_SECONDS)
+        return message
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        if self.local is not None:
+            answer = self.local("\n".join(str(m.content) for m in messages))
+            if answer is not None:
+                registry.inc("analyzer_local_answers_total", labels={"agent": self.agent})
+                usage = current_usage.get()
+                if usage is not None:
+                    usage.local_answers.append(self.agent)
+                return ChatResult(generations=[ChatGeneration(message=AIMessage(content=answer))])
+
+        message = self._invoke(self.primary, self.primary_model, messages, stop)
+        if self.escalation is not None and is_low_confidence(str(message.content)):
+            registry.inc("analyzer_model_escalations_total",
+                         labels={"agent": self.agent, "from": self.primary_model, "to": self.escalation_model})
+            usage = current_usage.get()
+            if usage is not None:
+                usage.escalations.append({"agent": self.agent, "from": self.primary_model, "to": self.escalation_model})
+            message = self._invoke(self.escalation, self.escalation_model, messages, stop)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+
+_models = {}
+
+
+def build_llm(model: str):
+    """One shared client per model name"""
+    if model not in _models:
+        callbacks = [token_stream_handler, telemetry_callback_handler, token_budget_callback_handler]
+        if is_mock_backend():
+            # Offline stand-in for local runs and benchmarks (see mock_llm.py)
+            from mock_llm import MockChatModel
+            _models[model] = MockChatModel(model=f"mock/{model}", temperature=0.1, streaming=True, callbacks=callbacks)
+        else:
+            from langchain_litellm import ChatLiteLLM
+            # Streaming is always on so /analyze/stream can forward tokens as they arrive;
+            # non-streaming callers still receive the fully aggregated response.
+            _models[model] = ChatLiteLLM(model=model, temperature=0.1, streaming=True, callbacks=callbacks)
+    return _models[model]
+
+
+def route_llm(agent: str, escalate: bool = True) -> RoutedChatModel:
+    """The routed model for an agent according to MODEL_ROUTES"""
+    route = load_routes().get(agent, "fast")
+    local = LOCAL_HANDLERS.get(agent) if route == "local" else None
+    tier = "fast" if route == "local" else route
+    model = MODEL_TIERS.get(tier, tier)
+    escalate = escalate and ESCALATION_ENABLED and tier == "fast" and model != MODEL_TIERS["strong"]
+    escalation = MODEL_TIERS["strong"] if escalate else None
+    return RoutedChatModel(
+        agent=agent,
+        primary=build_llm(model),
+        primary_model=model,
+        escalation=build_llm(escalation) if escalation else None,
+        escalation_model=escalation,
+        local=local,
+    )
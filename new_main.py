@@ -1,17 +1,39 @@
 import os
+import time
 import uuid
-from fastapi import FastAPI, File, UploadFile, Form, HTTPException
-from fastapi.responses import HTMLResponse, JSONResponse
-from celery_tasks import process_document_task
+import asyncio
+from fastapi import FastAPI, File, UploadFile, Form, Header, HTTPException, Request
+from fastapi.responses import HTMLResponse, JSONResponse, Response, FileResponse
+from celery_tasks import (process_document_task, find_duplicate_result, find_similar_analyses, claim_inflight_task,
+                          release_inflight_task)
+from triage import triage_document, triage_stored_document
+from document_store import get_store
+from document_transport import publish
+from uploads import get_upload_sessions, UploadError
+from telemetry import setup_telemetry, stage, registry, PROMETHEUS_CONTENT_TYPE
+from profiling import list_artifacts, artifact_path, requested as profiling_requested
 
 app = FastAPI(
     title="Financial Document Analyzer - Advanced",
     description="Analyzes financial documents using an AI crew with background processing.",
     version="3.0.0" # Final Version
 )
+setup_telemetry(app)
+registry.describe("analyzer_coalesced_requests_total", "counter", "Submissions attached to an identical in-flight task")
 
 os.makedirs("data", exist_ok=True)
 
+# Uploads are handed to workers through the content-addressed store (shared with the workers)
+document_store = get_store()
+document_store.start_janitor()
+# Resumable chunked uploads for large filings, assembled into the same store
+upload_sessions = get_upload_sessions()
+
+
+@app.exception_handler(UploadError)
+async def upload_error_handler(request, exc: UploadError):
+    return JSONResponse(status_code=exc.status, content={"detail": str(exc)})
+
 HTML_CONTENT = """
 <!DOCTYPE html>
 <html lang="en">
@@ -72,7 +94,12 @@ HTML_CONTENT = """
                 const response = await fetch('/analyze', { method: 'POST', body: formData });
                 const data = await response.json();
                 
-                if (response.ok) {
+                if (response.ok && data.status === 'SUCCESS') {
+                    // Duplicate upload: answered from a stored analysis
+                    resultDiv.className = 'result final-result';
+                    resultDiv.textContent = "--- Analysis Complete (previous result) ---\\n\\n" + data.result.analysis_output;
+                    submitButton.disabled = false;
+                } else if (response.ok) {
                     resultDiv.className = 'result loading';
                     resultDiv.textContent = '✅ Task started. Waiting for result...';
                     // Start polling for the result
@@ -122,29 +149,146 @@ async def get_ui():
     """Serves the main HTML user interface."""
     return HTMLResponse(content=HTML_CONTENT)
 
+@app.post("/uploads", status_code=201, tags=["Uploads"])
+async def create_upload(filename: str = Form(...), size: int = Form(...), sha256: str = Form(default=None)):
+    """Start a resumable upload; send chunks with PUT /uploads/{upload_id}?offset=N"""
+    return upload_sessions.create(filename, size, sha256)
+
+@app.get("/uploads/{upload_id}", tags=["Uploads"])
+async def get_upload(upload_id: str):
+    """Received ranges and the next missing offset, for resuming"""
+    return upload_sessions.status(upload_id)
+
+@app.put("/uploads/{upload_id}", tags=["Uploads"])
+async def put_upload_chunk(request: Request, upload_id: str, offset: int, x_chunk_sha256: str = Header(default=None)):
+    """Write one chunk (the raw request body) at offset"""
+    with stage("upload.chunk"):
+        return await upload_sessions.receive_chunk(upload_id, offset, request.stream(), x_chunk_sha256)
+
+@app.post("/uploads/{upload_id}/complete", tags=["Uploads"])
+async def complete_upload(upload_id: str, query: str = Form(default=None)):
+    """Assemble and hash the upload; with a query, also report a stored identical analysis"""
+    with stage("upload.complete"):
+        result = await asyncio.to_thread(upload_sessions.complete, upload_id)
+    if query:
+        cached = await asyncio.to_thread(find_duplicate_result, result["content_hash"], query)
+        if cached is not None:
+            result["cached_result"] = cached
+    return result
+
+@app.delete("/uploads/{upload_id}", tags=["Uploads"])
+async def delete_upload(upload_id: str):
+    upload_sessions.delete(upload_id)
+    return {"upload_id": upload_id, "deleted": True}
+
 @app.post("/analyze", status_code=202, tags=["Analysis"])
 async def analyze_document(
-    file: UploadFile = File(...),
-    query: str = Form(...)
+    file: UploadFile = File(default=None),
+    upload_id: str = Form(default=None),
+    query: str = Form(...),
+    incremental: bool = Form(default=False),
+    company: str = Form(default=None),
+    period: str = Form(default=None),
+    profile: bool = Form(default=False),
+    x_profile: str = Header(default=None)
 ):
-    if not file.filename.lower().endswith('.pdf'):
+    if upload_id:
+        # A completed resumable upload: already stored and hashed
+        doc_id, filename = upload_sessions.document(upload_id)
+    elif file is None:
+        raise HTTPException(status_code=400, detail="Send a file or the upload_id of a completed upload.")
+    else:
+        doc_id, filename = None, file.filename
+    if not filename.lower().endswith('.pdf'):
         raise HTTPException(status_code=400, detail="Only PDF files are supported.")
     try:
         file_id = str(uuid.uuid4())
-        file_path = os.path.join("data", f"financial_document_{file_id}.pdf")
-        with open(file_path, "wb") as f:
-            content = await file.read()
-            f.write(content)
-        
-        task = process_document_task.delay(
-            query=query, 
-            file_path=file_path, 
-            original_filename=file.filename
-        )
-        return JSONResponse(content={"task_id": task.id})
+        lookups = dict(lookup_duplicate=lambda h: find_duplicate_result(h, query),
+                       lookup_similar=lambda text: find_similar_analyses(text, query, filename))
+        # Triage parses the PDF and its lookups query MongoDB: run it off the event loop
+        if doc_id is not None:
+            with stage("triage"):
+                triage = await asyncio.to_thread(triage_stored_document, document_store, doc_id, filename, **lookups)
+        else:
+            with stage("upload"):
+                content = await file.read()
+            with stage("triage"):
+                triage = await asyncio.to_thread(triage_document, content, filename, **lookups)
+        if triage["decision"] == "reject":
+            raise HTTPException(status_code=422, detail=f"Document rejected: {triage['reason']}")
+        if triage["decision"] == "duplicate":
+            return JSONResponse(content={"status": "SUCCESS", "duplicate": True,
+                                         "result": triage["cached_result"]})
+
+        # Identical concurrent uploads share one task (profiled runs always get their own)
+        profile_enabled = profiling_requested(x_profile, profile)
+        if not profile_enabled:
+            with stage("mongo.claim_inflight"):
+                inflight_task_id = await asyncio.to_thread(claim_inflight_task, triage["content_hash"], query, file_id)
+            if inflight_task_id is not None:
+                registry.inc("analyzer_coalesced_requests_total")
+                return JSONResponse(content={"task_id": inflight_task_id, "pipeline": triage["decision"],
+                                             "coalesced": True})
+
+        if doc_id is not None:
+            document_id, document_ref = doc_id, document_store.acquire(doc_id)
+        else:
+            document_id, document_ref = document_store.put(content)
+        try:
+            # Other transports copy the document where workers on other nodes can fetch it
+            workers_share_store = await asyncio.to_thread(publish, document_id, document_store.path(document_id))
+            task = process_document_task.apply_async(kwargs=dict(
+                query=query,
+                file_path=document_store.path(document_id),
+                original_filename=filename,
+                incremental=incremental,
+                company=company,
+                period=period,
+                enqueued_at=time.time(),
+                profile=profile_enabled,
+                pipeline=triage["decision"],
+                content_hash=triage["content_hash"],
+                document_type=triage["document_type"],
+                document_id=document_id,
+                document_ref=document_ref if workers_share_store else None,
+                prior_summary=triage.get("prior_summary")
+            ), task_id=file_id)
+        except Exception:
+            document_store.release(document_id, document_ref)
+            if not profile_enabled:
+                release_inflight_task(triage["content_hash"], query, file_id)
+            raise
+        if not workers_share_store:
+            # The workers fetch their own copy; ours is kept only until the janitor finds it idle
+            document_store.release(document_id, document_ref)
+        return JSONResponse(content={"task_id": task.id, "pipeline": triage["decision"],
+                                     "similar_analyses": triage.get("similar", [])})
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to start analysis: {str(e)}")
 
+@app.get("/metrics", tags=["Monitoring"])
+async def metrics():
+    """Prometheus metrics for the API process (workers export via OTLP)."""
+    return Response(content=registry.render(), media_type=PROMETHEUS_CONTENT_TYPE)
+
+@app.get("/profiles/{task_id}", tags=["Monitoring"])
+async def get_profile_artifacts(task_id: str):
+    """Lists profiling artifacts captured for a task (requires a filesystem shared with the worker)."""
+    artifacts = list_artifacts(task_id)
+    if not artifacts:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return {"task_id": task_id, "artifacts": artifacts}
+
+@app.get("/profiles/{task_id}/{artifact}", tags=["Monitoring"])
+async def download_profile_artifact(task_id: str, artifact: str):
+    """Downloads one profiling artifact (.prof or .tracemalloc.txt)."""
+    path = artifact_path(task_id, artifact)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Profile artifact not found")
+    return FileResponse(path, filename=artifact)
+
 # --- NEW ENDPOINT TO GET RESULTS ---
 @app.get("/results/{task_id}", tags=["Analysis"])
 async def get_task_result(task_id: str):
@@ -0,0 +1,197 @@
+"""
+OCR fallback for scanned PDFs.
+
+pypdf returns no text for pages that are just scanned images. Such pages
+(fewer than OCR_MIN_CHARS characters of text layer) are rendered with
+pdfium and read with Tesseract instead:
+
+- pages are rendered and recognized in parallel on a process pool
+  (OCR_WORKERS, default the CPU count). Inside a daemonic process such as a
+  Celery prefork child, which may not start its own pool, a thread pool is
+  used instead. There, rendering is serialized and the Tesseract
+  subprocesses still run in parallel;
+- OCR output is cached on disk (OCR_CACHE_DIR, default data/ocr_cache)
+  under a hash of the page's content, images, rotation and crop box, so each distinct page is
+  recognized once, whichever process or upload first sees it.
+
+Needs the optional pypdfium2 and pytesseract packages and the tesseract
+binary; without them pages without a text layer stay empty. Set
+OCR_ENABLED=0 to turn the fallback off.
+"""
+import os
+import uuid
+import shutil
+import logging
+import hashlib
+import tempfile
+import threading
+import multiprocessing
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from pypdf import PdfReader
+
+from telemetry import registry, record_cache, stage
+from document_store import open_view
+
+try:
+    import pypdfium2 as pdfium
+    import pytesseract
+except ImportError:
+    pdfium = None
+    pytesseract = None
+
+OCR_ENABLED = os.getenv("OCR_ENABLED", "1").lower() not in ("0", "false", "no")
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", str(os.cpu_count() or 2)))
+OCR_DPI = int(os.getenv("OCR_DPI", "200"))
+OCR_LANG = os.getenv("OCR_LANG", "eng")
+# Pages with less text than this are treated as scanned
+OCR_MIN_CHARS = int(os.getenv("OCR_MIN_CHARS", "10"))
+OCR_CACHE_DIR = os.getenv("OCR_CACHE_DIR", os.path.join("data", "ocr_cache"))
+
+registry.describe("analyzer_ocr_pages_total", "counter", "Pages recognized with OCR (cache misses)")
+registry.describe("analyzer_ocr_failures_total", "counter", "Pages whose OCR raised; they keep their empty text layer")
+
+logger = logging.getLogger(__name__)
+
+_available = None
+_pool = None
+_pool_lock = threading.Lock()
+# pdfium is not thread-safe; only the thread fallback needs this
+_render_lock = threading.Lock()
+
+
+def available() -> bool:
+    """True when OCR is enabled and its packages and the tesseract binary are installed"""
+    global _available
+    if _available is None:
+        _available = OCR_ENABLED and pdfium is not None and shutil.which(
+            getattr(pytesseract.pytesseract, "tesseract_cmd", "tesseract")) is not None
+    return _available
+
+
+def needs_ocr(text: str) -> bool:
+    return len((text or "").strip()) < OCR_MIN_CHARS
+
+
+def page_fingerprint(page) -> str:
+    """Hash of a page's content stream and image data, plus the OCR settings, rotation and crop box"""
+    # The same scan rotated or cropped renders differently, so it must not share the cached text
+    box = ",".join(f"{float(value):g}" for value in page.cropbox)
+    digest = hashlib.sha256(f"{OCR_DPI}:{OCR_LANG}:{page.rotation % 360}:{box}".encode())
+    contents = page.get_contents()
+    if contents is not None:
+        digest.update(contents.get_data())
+    xobjects = page.get("/Resources", {}).get("/XObject", {})
+    for name in sorted(xobjects):
+        digest.update(xobjects[name].get_object().get_data())
+    return digest.hexdigest()
+
+
+def _cache_path(fingerprint: str) -> str:
+    return os.path.join(OCR_CACHE_DIR, fingerprint[:2], f"{fingerprint}.txt")
+
+
+def _cached(fingerprint: str):
+    try:
+        with open(_cache_path(fingerprint), encoding="utf-8") as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def _store(fingerprint: str, text: str):
+    path = _cache_path(fingerprint)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(temp_path, path)
+
+
+def _ocr_page(file_path: str, index: int, dpi: int = OCR_DPI, lang: str = OCR_LANG, lock=None) -> str:
+    """Render one page and run Tesseract on it (runs in a pool worker)"""
+    with lock or nullcontext():
+        document = pdfium.PdfDocument(file_path)
+        try:
+            image = document[index].render(scale=dpi / 72).to_pil()
+        finally:
+            document.close()
+    return pytesseract.image_to_string(image, lang=lang)
+
+
+def _get_pool():
+    """Process pool for OCR, or None where this process may not have children"""
+    global _pool
+    if multiprocessing.current_process().daemon:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            # spawn: forking a process that runs an event loop or Celery threads is unsafe
+            _pool = ProcessPoolExecutor(max_workers=OCR_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+def _reset_pool(pool):
+    """Drop a pool whose worker died so the next call starts a fresh one"""
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False)
+
+
+def ocr_pages(file_path: str, indexes: list) -> dict:
+    """OCR text for the given 0-based page indexes, served from the cache where possible"""
+    with open_view(file_path) as view:
+        reader = PdfReader(view)
+        fingerprints = {index: page_fingerprint(reader.pages[index]) for index in indexes}
+    texts, missing = {}, []
+    for index, fingerprint in fingerprints.items():
+        text = _cached(fingerprint)
+        record_cache("ocr_pages", text is not None)
+        if text is None:
+            missing.append(index)
+        else:
+            texts[index] = text
+    if not missing:
+        return texts
+
+    with stage("pdf.ocr", pages=len(missing)):
+        pool = _get_pool()
+        if pool is not None:
+            futures = {index: pool.submit(_ocr_page, file_path, index) for index in missing}
+        else:
+            threads = ThreadPoolExecutor(max_workers=OCR_WORKERS, thread_name_prefix="ocr")
+            futures = {index: threads.submit(_ocr_page, file_path, index, lock=_render_lock) for index in missing}
+            threads.shutdown(wait=False)
+        for index, future in futures.items():
+            try:
+                texts[index] = future.result()
+            except Exception as e:
+                if isinstance(e, BrokenProcessPool):
+                    _reset_pool(pool)
+                registry.inc("analyzer_ocr_failures_total")
+                logger.warning("OCR failed for page %d of %s: %s", index + 1, file_path, e)
+                continue
+            _store(fingerprints[index], texts[index])
+            registry.inc("analyzer_ocr_pages_total")
+    return texts
+
+
+def fill_scanned_pages(file_path: str, pages: list) -> list:
+    """Replace pages without a text layer by their OCR text (pages as returned by extract_pages)"""
+    scanned = [index for index, text in enumerate(pages) if needs_ocr(text)]
+    if not scanned or not available():
+        return pages
+    recognized = ocr_pages(file_path, scanned)
+    return [recognized.get(index, text) for index, text in enumerate(pages)]
+
+
+def ocr_content(content: bytes, indexes: list) -> dict:
+    """ocr_pages for an upload that is only held in memory"""
+    with tempfile.NamedTemporaryFile(suffix=".pdf") as tmp_file:
+        tmp_file.write(content)
+        tmp_file.flush()
+        return ocr_pages(tmp_file.name, indexes)
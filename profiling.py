@@ -0,0 +1,120 @@
+"""
+Opt-in profiling of hot paths.
+
+Profiling is enabled per request (``X-Profile: 1`` header or ``profile=true``
+form field) or for a whole worker (``PROFILE_ENABLED=1``). Inside an enabled
+run, every ``profiled(name)`` block captures a cProfile dump and a
+tracemalloc allocation diff, written to ``PROFILE_DIR/<run_id>/``:
+
+    <name>.prof              load with pstats / snakeviz
+    <name>.tracemalloc.txt   top allocation sites during the block
+
+When profiling is off, ``profiled()`` costs a single context-variable lookup.
+Uses only the standard library so standalone_server.py can use it too.
+"""
+import os
+import re
+import time
+import cProfile
+import threading
+import tracemalloc
+import contextvars
+from contextlib import contextmanager
+
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join("data", "profiles"))
+TRACEMALLOC_TOP = int(os.getenv("PROFILE_TRACEMALLOC_TOP", "25"))
+
+_current_run = contextvars.ContextVar("profile_run", default=None)
+_profiler_active = contextvars.ContextVar("profiler_active", default=False)
+_SAFE_NAME = re.compile(r"^[A-Za-z0-9_\-][A-Za-z0-9_.\-]*$")
+
+# tracemalloc is process-wide, so overlapping runs share one tracing session
+_tracing_runs = 0
+_tracing_lock = threading.Lock()
+
+
+def worker_profiling_enabled() -> bool:
+    """True when PROFILE_ENABLED turns profiling on for every run in this process"""
+    return os.getenv("PROFILE_ENABLED", "").lower() in ("1", "true", "yes")
+
+
+def requested(header_value=None, flag=False) -> bool:
+    """Decide whether a request should be profiled from its header/flag and the env"""
+    if flag or worker_profiling_enabled():
+        return True
+    return str(header_value or "").lower() in ("1", "true", "yes")
+
+
+@contextmanager
+def profile_run(run_id: str, enabled: bool = True):
+    """Mark the enclosed work as one profiled run; artifacts go to PROFILE_DIR/run_id"""
+    if not enabled:
+        yield None
+        return
+    global _tracing_runs
+    with _tracing_lock:
+        if _tracing_runs == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        _tracing_runs += 1
+    token = _current_run.set(run_id)
+    try:
+        yield run_id
+    finally:
+        _current_run.reset(token)
+        with _tracing_lock:
+            _tracing_runs -= 1
+            if _tracing_runs == 0:
+                tracemalloc.stop()
+
+
+@contextmanager
+def profiled(name: str):
+    """Profile a block if the current run has profiling enabled"""
+    run_id = _current_run.get()
+    if run_id is None:
+        yield
+        return
+
+    out_dir = os.path.join(PROFILE_DIR, run_id)
+    os.makedirs(out_dir, exist_ok=True)
+    before = tracemalloc.take_snapshot() if tracemalloc.is_tracing() else None
+
+    # Only one cProfile profiler can be active per thread; nested blocks
+    # still get their own allocation diff.
+    profiler = None
+    if not _profiler_active.get():
+        profiler = cProfile.Profile()
+        active_token = _profiler_active.set(True)
+        profiler.enable()
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        if profiler is not None:
+            profiler.disable()
+            _profiler_active.reset(active_token)
+            profiler.dump_stats(os.path.join(out_dir, f"{name}.prof"))
+        if before is not None:
+            after = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            with open(os.path.join(out_dir, f"{name}.tracemalloc.txt"), "w") as f:
+                f.write(f"# {name}: {elapsed:.3f}s, traced current={current} bytes, peak={peak} bytes\n")
+                for stat in after.compare_to(before, "lineno")[:TRACEMALLOC_TOP]:
+                    f.write(f"{stat}\n")
+
+
+def list_artifacts(run_id: str) -> list:
+    """File names captured for a run"""
+    out_dir = os.path.join(PROFILE_DIR, run_id)
+    if not _SAFE_NAME.match(run_id) or not os.path.isdir(out_dir):
+        return []
+    return sorted(os.listdir(out_dir))
+
+
+def artifact_path(run_id: str, name: str):
+    """Path of a stored artifact, or None if it doesn't exist or the name is unsafe"""
+    if not _SAFE_NAME.match(run_id) or not _SAFE_NAME.match(name):
+        return None
+    path = os.path.join(PROFILE_DIR, run_id, name)
+    return path if os.path.isfile(path) else None
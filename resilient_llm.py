@@ -0,0 +1,340 @@
+"""
+Deadlines, retries, hedging and circuit breaking for LLM calls.
+
+Every provider call (Gemini via google.generativeai, and each routed model
+used by the crew) goes through a ResilientClient, which:
+
+- runs the call on a worker thread and gives up after a per-call deadline
+  (LLM_TIMEOUT_SECONDS, default 60), so a hung request cannot hold a Celery
+  worker indefinitely. The time left is also passed to the provider client
+  as its request timeout (timeout_kwargs), so an abandoned call ends soon
+  after its deadline instead of holding a pool thread. The pool is sized
+  from the worker concurrency (size_executor, LLM_CLIENT_THREADS), and a
+  call that never got a thread before its deadline is not counted against
+  the provider;
+- retries rate limits, 5xx errors, timeouts and connection errors with full
+  jittered exponential backoff (LLM_MAX_RETRIES, LLM_BACKOFF_BASE_SECONDS,
+  LLM_BACKOFF_MAX_SECONDS), within the same overall deadline;
+- optionally hedges: if a call is still running after the observed p95
+  latency, a duplicate request is sent and the first answer wins
+  (LLM_HEDGE=1, LLM_HEDGE_QUANTILE, LLM_HEDGE_MIN_SAMPLES);
+- trips a circuit breaker after LLM_CIRCUIT_FAILURES consecutive failed calls
+  and fails fast with CircuitOpenError for LLM_CIRCUIT_RESET_SECONDS, then
+  lets one probe call through.
+
+Inside a controlled crew run (run_control.py) the deadline is also capped by
+the run's remaining time, and cancelling the run abandons the call.
+
+Stdlib only, so the dependency-free servers can use it. Exercise it offline
+with LLM_BACKEND=mock and MOCK_LLM_ERROR_RATE / MOCK_LLM_LATENCY_MS.
+"""
+import os
+import time
+import random
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from telemetry import registry
+from run_control import check_cancelled, remaining_time
+
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+# Provider exception class names treated as transient when no status code is attached
+RETRYABLE_NAMES = ("Timeout", "RateLimit", "ResourceExhausted", "ServiceUnavailable", "DeadlineExceeded",
+                   "InternalServerError", "APIConnectionError", "ConnectionError", "TooManyRequests")
+
+registry.describe("analyzer_llm_retries_total", "counter", "LLM call attempts retried after a transient error")
+registry.describe("analyzer_llm_hedged_total", "counter", "Hedged duplicate LLM requests sent")
+registry.describe("analyzer_llm_deadline_exceeded_total", "counter", "LLM calls abandoned at their deadline")
+registry.describe("analyzer_llm_not_started_total", "counter",
+                  "LLM calls that reached their deadline before a client thread was free")
+registry.describe("analyzer_llm_circuit_open", "gauge", "1 while the client's circuit breaker is open")
+registry.describe("analyzer_llm_circuit_rejections_total", "counter", "LLM calls rejected by an open circuit")
+
+
+class CircuitOpenError(Exception):
+    """The provider is failing; calls are rejected until the breaker resets"""
+
+
+class LLMDeadlineExceeded(TimeoutError):
+    """An LLM call did not finish within its deadline"""
+
+    # False when no request was sent before the deadline: the client's own pool was full, not the provider slow
+    reached_provider = True
+
+
+class LLMCallNotStarted(LLMDeadlineExceeded):
+    """The deadline passed while the call was still queued for a client thread"""
+
+    reached_provider = False
+
+
+class ResilienceConfig:
+    """Timeout, retry, hedging and breaker settings (arguments override the environment)"""
+
+    def __init__(self, timeout=None, max_retries=None, backoff_base=None, backoff_max=None, hedge=None,
+                 hedge_quantile=None, hedge_min_samples=None, failure_threshold=None, reset_timeout=None):
+        self.timeout = float(timeout if timeout is not None else os.getenv("LLM_TIMEOUT_SECONDS", "60"))
+        self.max_retries = int(max_retries if max_retries is not None else os.getenv("LLM_MAX_RETRIES", "3"))
+        self.backoff_base = float(backoff_base if backoff_base is not None else os.getenv("LLM_BACKOFF_BASE_SECONDS", "0.5"))
+        self.backoff_max = float(backoff_max if backoff_max is not None else os.getenv("LLM_BACKOFF_MAX_SECONDS", "8"))
+        self.hedge = hedge if hedge is not None else os.getenv("LLM_HEDGE", "").lower() in ("1", "true", "yes")
+        self.hedge_quantile = float(hedge_quantile if hedge_quantile is not None else os.getenv("LLM_HEDGE_QUANTILE", "0.95"))
+        self.hedge_min_samples = int(hedge_min_samples if hedge_min_samples is not None else os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+        self.failure_threshold = int(failure_threshold if failure_threshold is not None else os.getenv("LLM_CIRCUIT_FAILURES", "5"))
+        self.reset_timeout = float(reset_timeout if reset_timeout is not None else os.getenv("LLM_CIRCUIT_RESET_SECONDS", "30"))
+
+
+class CircuitBreaker:
+    """Closed -> open after consecutive failures -> half-open probe after reset_timeout"""
+
+    def __init__(self, name: str, failure_threshold: int, reset_timeout: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_timeout:
+                # Let a single probe through; its outcome closes or re-opens the breaker
+                self.state = "half_open"
+                return True
+            return self.state == "closed"
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            if self.state != "closed":
+                self.state = "closed"
+                registry.set("analyzer_llm_circuit_open", 0, {"client": self.name})
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                self.state = "open"
+                self.opened_at = time.monotonic()
+                registry.set("analyzer_llm_circuit_open", 1, {"client": self.name})
+
+    def settle_probe(self):
+        """A call ended without recording an outcome; a half-open probe must not stay in flight forever"""
+        with self._lock:
+            if self.state == "half_open":
+                self.state = "open"
+                self.opened_at = time.monotonic()
+                registry.set("analyzer_llm_circuit_open", 1, {"client": self.name})
+
+
+class LatencyTracker:
+    """Rolling window of successful call latencies"""
+
+    def __init__(self, size: int = 200):
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def quantile(self, q: float, min_samples: int):
+        with self._lock:
+            if len(self._samples) < min_samples:
+                return None
+            ordered = sorted(self._samples)
+        return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+def is_retryable(error: Exception) -> bool:
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    status = getattr(error, "status_code", None) or getattr(error, "code", None)
+    if isinstance(status, int) and status in RETRYABLE_STATUS:
+        return True
+    return any(name in type(error).__name__ for name in RETRYABLE_NAMES)
+
+
+# Seconds between cancellation checks while waiting on a call
+CANCEL_POLL_SECONDS = 0.25
+
+# Concurrent runs assumed until size_executor is called: the API's crew pool (see run_control.CrewRunner)
+DEFAULT_CONCURRENCY = int(os.getenv("CREW_WORKERS") or os.getenv("ADMISSION_MAX_ACTIVE") or "8")
+# Pool threads per concurrent run: its call, a hedged duplicate, and calls abandoned at a deadline still finishing
+THREADS_PER_RUN = 4
+
+_executor = None
+_executor_threads = 0
+_executor_lock = threading.Lock()
+
+
+def size_executor(concurrency: int) -> int:
+    """
+    Size the pool calls run on (so a hung request can be abandoned at its
+    deadline) for this many concurrent runs; LLM_CLIENT_THREADS overrides.
+    Returns the number of threads.
+    """
+    global _executor, _executor_threads
+    threads = int(os.getenv("LLM_CLIENT_THREADS") or max(THREADS_PER_RUN * concurrency, 8))
+    with _executor_lock:
+        if _executor is None or _executor_threads != threads:
+            previous = _executor
+            _executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="llm-call")
+            _executor_threads = threads
+            if previous is not None:
+                # Calls already running there finish on their own threads
+                previous.shutdown(wait=False)
+    return threads
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    if _executor is None:
+        size_executor(DEFAULT_CONCURRENCY)
+    return _executor
+
+
+class ResilientClient:
+    """Wraps a blocking LLM call with a deadline, retries, optional hedging and a circuit breaker"""
+
+    def __init__(self, name: str, config: ResilienceConfig = None, executor: ThreadPoolExecutor = None):
+        self.name = name
+        self.config = config or ResilienceConfig()
+        self.breaker = CircuitBreaker(name, self.config.failure_threshold, self.config.reset_timeout)
+        self.latency = LatencyTracker()
+        self.executor = executor
+
+    def _submit(self, fn, args, kwargs, deadline: float, timeout_kwargs):
+        # Carry context variables (current task, token budget, stream sink) into the worker thread
+        context = contextvars.copy_context()
+        started = threading.Event()
+
+        def run():
+            started.set()
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise LLMCallNotStarted(f"{self.name} call reached its deadline before it was sent")
+            call_kwargs = dict(kwargs, **timeout_kwargs(remaining)) if timeout_kwargs is not None else kwargs
+            return context.run(fn, *args, **call_kwargs)
+
+        future = (self.executor or _get_executor()).submit(run)
+        future.started = started
+        return future
+
+    def _attempt(self, fn, args, kwargs, deadline: float, hedge: bool, timeout_kwargs=None):
+        started = time.monotonic()
+        futures = [self._submit(fn, args, kwargs, deadline, timeout_kwargs)]
+        hedge_after = self.latency.quantile(self.config.hedge_quantile, self.config.hedge_min_samples) if hedge else None
+        if hedge_after is not None and started + hedge_after < deadline:
+            done, _ = wait(futures, timeout=hedge_after)
+            if not done:
+                registry.inc("analyzer_llm_hedged_total", labels={"client": self.name})
+                futures.append(self._submit(fn, args, kwargs, deadline, timeout_kwargs))
+        try:
+            return self._wait(futures, started, deadline)
+        finally:
+            # A duplicate still queued never needs to run; one already sent ends at its request timeout
+            for future in futures:
+                future.cancel()
+
+    def _wait(self, futures: list, started: float, deadline: float):
+        pending = set(futures)
+        error = None
+        while pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            done, pending = wait(pending, timeout=min(remaining, CANCEL_POLL_SECONDS), return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    self.latency.add(time.monotonic() - started)
+                    return future.result()
+                error = future.exception()
+            check_cancelled()
+        if error is not None and not pending:
+            raise error
+        if not any(future.started.is_set() for future in futures):
+            registry.inc("analyzer_llm_not_started_total", labels={"client": self.name})
+            raise LLMCallNotStarted(f"{self.name} call waited its whole deadline for a free client thread")
+        registry.inc("analyzer_llm_deadline_exceeded_total", labels={"client": self.name})
+        raise LLMDeadlineExceeded(f"{self.name} call exceeded its {self.config.timeout:.0f}s deadline")
+
+    def call(self, fn, *args, timeout: float = None, hedge: bool = None, timeout_kwargs=None, **kwargs):
+        """
+        Run fn(*args, **kwargs) with the client's resilience policy and return its result.
+
+        timeout_kwargs(seconds) returns the keyword arguments that set fn's own
+        request timeout (e.g. {"timeout": seconds} for LiteLLM); each attempt
+        passes the time left until the deadline through it.
+        """
+        check_cancelled()
+        if not self.breaker.allow():
+            registry.inc("analyzer_llm_circuit_rejections_total", labels={"client": self.name})
+            raise CircuitOpenError(f"{self.name} circuit is open after repeated failures; retry later")
+
+        timeout = timeout if timeout is not None else self.config.timeout
+        run_remaining = remaining_time()
+        if run_remaining is not None:
+            timeout = min(timeout, run_remaining)
+        deadline = time.monotonic() + timeout
+        hedge = self.config.hedge if hedge is None else hedge
+        attempt = 0
+        settled = False
+        try:
+            while True:
+                try:
+                    result = self._attempt(fn, args, kwargs, deadline, hedge, timeout_kwargs)
+                    self.breaker.record_success()
+                    settled = True
+                    return result
+                except Exception as e:
+                    if isinstance(e, LLMDeadlineExceeded):
+                        # The run's own deadline, not a provider fault
+                        check_cancelled()
+                        if not e.reached_provider:
+                            # Nothing was sent, so the breaker learns nothing; a queued probe is settled below
+                            raise
+                    if not is_retryable(e):
+                        raise
+                    remaining = deadline - time.monotonic()
+                    delay = random.uniform(0, min(self.config.backoff_max, self.config.backoff_base * 2 ** attempt))
+                    if isinstance(e, LLMDeadlineExceeded) or attempt >= self.config.max_retries or delay >= remaining:
+                        self.breaker.record_failure()
+                        settled = True
+                        raise
+                    attempt += 1
+                    registry.inc("analyzer_llm_retries_total", labels={"client": self.name})
+                    print(f"{self.name}: attempt {attempt} failed ({e}); retrying in {delay:.2f}s")
+                    time.sleep(delay)
+        finally:
+            if not settled:
+                # Non-retryable errors and cancellation (RunCancelled is a BaseException) end here
+                self.breaker.settle_probe()
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(name: str) -> ResilientClient:
+    """One client (breaker and latency history) per provider/model name"""
+    with _clients_lock:
+        if name not in _clients:
+            _clients[name] = ResilientClient(name)
+        return _clients[name]
+
+
+class ResilientGenerativeModel:
+    """genai.GenerativeModel (or its mock) whose generate_content goes through a ResilientClient"""
+
+    def __init__(self, model):
+        self.model = model
+        self.client = get_client(getattr(model, "model_name", None) or "gemini")
+
+    def generate_content(self, prompt, **kwargs):
+        options = kwargs.pop("request_options", None) or {}
+        return self.client.call(self.model.generate_content, prompt,
+                                timeout_kwargs=lambda seconds: {"request_options": dict(options, timeout=seconds)},
+                                **kwargs)
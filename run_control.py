@@ -0,0 +1,144 @@
+"""
+Off-loop execution, cancellation and deadlines for crew runs.
+
+The crew is blocking and runs for minutes, so the synchronous API executes
+it on a dedicated, sized thread pool (CREW_WORKERS, defaulting to the
+number of admission slots) instead of the event
+loop. Each run carries a RunControl with a deadline (REQUEST_DEADLINE_SECONDS,
+default 600). When the deadline passes or the client disconnects the run is
+cancelled cooperatively: the in-flight LLM call is abandoned (see
+resilient_llm.py) and the next checkpoint raises RunCancelled in the crew
+thread, which frees the worker.
+
+A thread pool is used rather than a process pool because token streaming,
+budgets and cancellation all travel with the run's context variables.
+"""
+import os
+import time
+import asyncio
+import threading
+import contextvars
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from telemetry import registry
+
+REQUEST_DEADLINE_SECONDS = float(os.getenv("REQUEST_DEADLINE_SECONDS", "600"))
+# How long a cancelled request waits for its crew thread to reach a checkpoint
+CANCEL_GRACE_SECONDS = float(os.getenv("CANCEL_GRACE_SECONDS", "5"))
+DISCONNECT_POLL_SECONDS = 1.0
+
+registry.describe("analyzer_runs_cancelled_total", "counter", "Crew runs cancelled by deadline or client disconnect")
+
+current_control = contextvars.ContextVar("current_control", default=None)
+
+
+class RunCancelled(BaseException):
+    """
+    The run was cancelled (deadline or disconnect).
+
+    Derives from BaseException, like asyncio.CancelledError, so retry loops
+    in the agent framework that catch Exception do not swallow it.
+    """
+
+    def __init__(self, reason: str):
+        super().__init__(f"Analysis cancelled: {reason}")
+        self.reason = reason
+
+
+class RunControl:
+    """Deadline and cancellation flag shared between the request and its crew thread"""
+
+    def __init__(self, deadline_seconds: float = None):
+        seconds = REQUEST_DEADLINE_SECONDS if deadline_seconds is None else deadline_seconds
+        self.deadline = time.monotonic() + seconds
+        self.reason = None
+        self._cancelled = threading.Event()
+
+    def cancel(self, reason: str):
+        if not self._cancelled.is_set():
+            self.reason = reason
+            self._cancelled.set()
+            registry.inc("analyzer_runs_cancelled_total", labels={"reason": reason})
+
+    @property
+    def cancelled(self) -> bool:
+        if not self._cancelled.is_set() and time.monotonic() >= self.deadline:
+            self.cancel("deadline")
+        return self._cancelled.is_set()
+
+    def remaining(self) -> float:
+        return max(self.deadline - time.monotonic(), 0.0)
+
+    def check(self):
+        if self.cancelled:
+            raise RunCancelled(self.reason)
+
+
+def check_cancelled():
+    """Checkpoint: raise RunCancelled if the current run was cancelled"""
+    control = current_control.get()
+    if control is not None:
+        control.check()
+
+
+def remaining_time():
+    """Seconds left before the current run's deadline, or None outside a controlled run"""
+    control = current_control.get()
+    return None if control is None else control.remaining()
+
+
+class CrewRunner:
+    """Runs blocking crew calls on a dedicated pool, honouring deadlines and client disconnects"""
+
+    def __init__(self, workers: int = None):
+        self.workers = max(int(workers if workers is not None else os.getenv("CREW_WORKERS", os.getenv("ADMISSION_MAX_ACTIVE", "2"))), 1)
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="crew")
+
+    def submit(self, control: RunControl, fn, *args, **kwargs):
+        """Start fn in the pool with control installed in a copy of the caller's context"""
+        context = contextvars.copy_context()
+        context.run(current_control.set, control)
+        future = asyncio.get_running_loop().run_in_executor(
+            self._pool, functools.partial(context.run, fn, *args, **kwargs)
+        )
+        # A run abandoned after cancellation still finishes; mark its outcome as retrieved
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        return future
+
+    async def _watch_disconnect(self, request, control: RunControl):
+        while not control.cancelled:
+            if await request.is_disconnected():
+                control.cancel("client disconnected")
+                return
+            await asyncio.sleep(DISCONNECT_POLL_SECONDS)
+
+    async def run(self, fn, *args, control: RunControl = None, request=None, on_done=None, **kwargs):
+        """
+        Await fn(*args, **kwargs) from the pool; raises RunCancelled on deadline or disconnect.
+
+        on_done() is called once the thread has finished, which can be after
+        run() has given up on it: resources the thread still uses (an admission
+        slot, its pool worker) are freed there rather than when run() returns.
+        """
+        control = control or RunControl()
+        future = self.submit(control, fn, *args, **kwargs)
+        if on_done is not None:
+            future.add_done_callback(lambda f: on_done())
+        watcher = asyncio.create_task(self._watch_disconnect(request, control)) if request is not None else None
+        try:
+            while not future.done():
+                await asyncio.wait({future}, timeout=min(control.remaining(), DISCONNECT_POLL_SECONDS))
+                if control.cancelled:
+                    break
+            if future.done():
+                return future.result()
+            # Give the crew thread a moment to hit a checkpoint so the worker is freed
+            await asyncio.wait({future}, timeout=CANCEL_GRACE_SECONDS)
+            raise RunCancelled(control.reason)
+        except asyncio.CancelledError:
+            control.cancel("request cancelled")
+            raise
+        finally:
+            if watcher is not None:
+                watcher.cancel()
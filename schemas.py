@@ -0,0 +1,217 @@
+"""
+Structured output schemas for the crew tasks and the Gemini endpoint.
+
+Each task asks its agent for a JSON object of the matching model (see
+format_instructions), and structured_output.parse_structured validates the
+answer. Validators are lenient where models commonly drift: ratings and
+levels in any case or wrapped in a sentence, a single string where a list
+is expected, figures given as "$1.2 billion".
+"""
+import re
+import json
+from typing import Any, Dict, List, Literal, Optional
+
+from pydantic import BaseModel, ConfigDict, field_validator
+
+Rating = Literal["BUY", "HOLD", "SELL"]
+Level = Literal["Low", "Medium", "High"]
+
+_SCALE_WORDS = {"thousand": 1e3, "k": 1e3, "million": 1e6, "m": 1e6, "mm": 1e6, "billion": 1e9, "bn": 1e9,
+                "b": 1e9, "trillion": 1e12, "t": 1e12}
+_FIGURE = re.compile(r"^\(?\s*(-)?\s*[$€£]?\s*(-)?([\d,]*\.?\d+)\s*([a-z]+)?\s*\)?\s*%?$", re.IGNORECASE)
+
+
+def _as_list(value):
+    if value is None:
+        return []
+    if isinstance(value, str):
+        return [value] if value.strip() else []
+    return value
+
+
+def _as_metrics(value):
+    """Accept {"revenue": "$22.5B"} as well as a list of metric objects"""
+    if isinstance(value, dict):
+        return [{"name": name, "value": figure} for name, figure in value.items()]
+    return _as_list(value)
+
+
+def _pick(value, choices: tuple, default=None):
+    """First choice named in value, case-insensitively ("Strong buy." -> "BUY")"""
+    if value is None:
+        return default
+    text = str(value).upper()
+    for choice in choices:
+        if re.search(rf"\b{choice.upper()}\b", text):
+            return choice
+    return value if default is None else default
+
+
+class _Schema(BaseModel):
+    model_config = ConfigDict(extra="ignore", str_strip_whitespace=True)
+
+
+class Metric(_Schema):
+    name: str
+    value: Optional[float] = None
+    unit: str = ""
+    period: str = ""
+
+    @field_validator("value", mode="before")
+    @classmethod
+    def _figure(cls, value):
+        """Accept figures as printed: "$1,234", "(56.7)", "12%", "$1.2 billion" """
+        if value is None or isinstance(value, (int, float)):
+            return value
+        match = _FIGURE.match(str(value).strip())
+        if not match:
+            return None
+        scale = match.group(4)
+        if scale and scale.lower() not in _SCALE_WORDS:
+            return None
+        number = float(match.group(3).replace(",", "")) * _SCALE_WORDS.get((scale or "").lower(), 1.0)
+        negative = bool(match.group(1) or match.group(2)) or str(value).strip().startswith("(")
+        return -number if negative else number
+
+
+class VerificationReport(_Schema):
+    document_type: str
+    company: Optional[str] = None
+    period: Optional[str] = None
+    statements_present: List[str] = []
+    data_quality: Level = "Medium"
+    issues: List[str] = []
+    confidence: Level = "Medium"
+
+    _lists = field_validator("statements_present", "issues", mode="before")(_as_list)
+
+    @field_validator("data_quality", "confidence", mode="before")
+    @classmethod
+    def _level(cls, value):
+        return _pick(value, ("Low", "Medium", "High"), "Medium")
+
+
+class FinancialAnalysisReport(_Schema):
+    executive_summary: str
+    key_metrics: List[Metric] = []
+    trends: List[str] = []
+    strengths: List[str] = []
+    weaknesses: List[str] = []
+
+    _metrics = field_validator("key_metrics", mode="before")(_as_metrics)
+    _lists = field_validator("trends", "strengths", "weaknesses", mode="before")(_as_list)
+
+
+class InvestmentRecommendation(_Schema):
+    rating: Rating
+    thesis: str
+    rationale: List[str] = []
+    risks: List[str] = []
+    time_horizon: str = "12 months"
+
+    _lists = field_validator("rationale", "risks", mode="before")(_as_list)
+
+    @field_validator("rating", mode="before")
+    @classmethod
+    def _rating(cls, value):
+        return _pick(value, ("BUY", "HOLD", "SELL"))
+
+
+class Risk(_Schema):
+    name: str
+    category: str = "financial"
+    impact: Level = "Medium"
+    mitigation: str = ""
+
+    @field_validator("impact", mode="before")
+    @classmethod
+    def _level(cls, value):
+        return _pick(value, ("Low", "Medium", "High"), "Medium")
+
+
+class RiskReport(_Schema):
+    overall_risk: Level
+    risks: List[Risk] = []
+
+    @field_validator("overall_risk", mode="before")
+    @classmethod
+    def _level(cls, value):
+        return _pick(value, ("Low", "Medium", "High"), "Medium")
+
+    @field_validator("risks", mode="before")
+    @classmethod
+    def _named(cls, value):
+        return [{"name": item} if isinstance(item, str) else item for item in _as_list(value)]
+
+
+class QuickAnalysis(_Schema):
+    document_type: str
+    summary: str
+    key_metrics: List[Metric] = []
+    rating: Rating
+    risks: List[str] = []
+
+    _metrics = field_validator("key_metrics", mode="before")(_as_metrics)
+    _lists = field_validator("risks", mode="before")(_as_list)
+
+    @field_validator("rating", mode="before")
+    @classmethod
+    def _rating(cls, value):
+        return _pick(value, ("BUY", "HOLD", "SELL"))
+
+
+class GeminiAnalysis(_Schema):
+    """main_working.py's AnalysisResponse, as Gemini is asked to return it"""
+    financial_summary: str
+    key_metrics: Dict[str, Any] = {}
+    risk_assessment: str
+    investment_recommendations: str
+    document_verification: str
+
+    @field_validator("risk_assessment", "investment_recommendations", "document_verification", "financial_summary",
+                     mode="before")
+    @classmethod
+    def _text(cls, value):
+        # Models sometimes nest a section as an object or list; keep it readable
+        return value if isinstance(value, str) or value is None else json.dumps(value, ensure_ascii=False)
+
+
+# Task name (as in TASK_NAMES / PIPELINES) -> expected output schema
+TASK_SCHEMAS = {
+    "verification": VerificationReport,
+    "analyze_financial_document": FinancialAnalysisReport,
+    "investment_analysis": InvestmentRecommendation,
+    "risk_assessment": RiskReport,
+    "quick_analysis": QuickAnalysis,
+    "incremental_synthesis": FinancialAnalysisReport,
+}
+
+
+def _describe(schema: dict, definitions: dict) -> str:
+    if "$ref" in schema:
+        return _describe(definitions[schema["$ref"].split("/")[-1]], definitions)
+    if "anyOf" in schema:
+        return _describe(next(s for s in schema["anyOf"] if s.get("type") != "null"), definitions)
+    if "enum" in schema:
+        return "|".join(schema["enum"])
+    kind = schema.get("type")
+    if kind == "object" and "properties" in schema:
+        return "object with " + ", ".join(f"{name} ({_describe(field, definitions)})"
+                                          for name, field in schema["properties"].items())
+    if kind == "object":
+        return "object of name to value"
+    if kind == "array":
+        return f"list of {_describe(schema.get('items', {}), definitions)}"
+    return {"integer": "number", "boolean": "true|false"}.get(kind, kind or "string")
+
+
+def format_instructions(model) -> str:
+    """
+    Compact description of a model's JSON shape for a prompt.
+
+    Much shorter than the JSON Schema, and free of braces, which CrewAI would
+    read as template variables in a task's expected output.
+    """
+    schema = model.model_json_schema()
+    return ("Respond with only a JSON object, no prose or code fences: "
+            f"{_describe(schema, schema.get('$defs', {}))}.")
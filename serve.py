@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Production launch mode for the FastAPI apps: N worker processes on one port.
+
+A single uvicorn process serves one core. serve() runs the app under gunicorn
+with uvicorn workers when gunicorn is installed, with the app imported once in
+the master before forking (preload), so every worker starts with its modules,
+agents and tools already loaded. Without gunicorn it falls back to uvicorn's
+own multi-process mode, where each worker imports the app itself.
+
+    python serve.py main:app --workers 4
+    python serve.py new_main:app --port 8080
+    WEB_CONCURRENCY=8 python serve.py main_working:app
+
+Preloading is only safe for modules that open no connections at import time.
+A connection created in the master would be shared by every forked worker.
+The app modules here therefore open their clients per process, on first
+use. This covers the SQLite stores, celery_tasks' MongoDB client and the
+document transport's Redis or S3 client. redis-py additionally reconnects
+after a fork. A new module that connects at import must follow the same
+pattern, or be served with --no-preload.
+
+Workers share caches through the shared cache tier (shared_cache.py), the
+document store and the knowledge store, so adding processes does not add
+cold caches. Some state stays per process: admission limits
+(ADMISSION_MAX_ACTIVE applies to each worker), and the /metrics counters of
+the worker that answers the scrape.
+"""
+import os
+import sys
+import argparse
+import importlib.util
+
+DEFAULT_WORKERS = int(os.getenv("WEB_CONCURRENCY", str(os.cpu_count() or 1)))
+
+
+def serve(app_path: str, host: str = "0.0.0.0", port: int = 8000, workers: int = DEFAULT_WORKERS,
+          preload: bool = True, reload: bool = False):
+    """Run app_path ("module:app") with the given number of worker processes"""
+    # Apps and their modules are imported by path from this directory
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    if reload or workers <= 1 or importlib.util.find_spec("gunicorn") is None:
+        import uvicorn
+        if workers > 1 and not reload:
+            print("gunicorn is not installed; using uvicorn workers without a preloaded app")
+        uvicorn.run(app_path, host=host, port=port, workers=None if reload else workers, reload=reload)
+        return
+
+    from gunicorn.app.base import BaseApplication
+
+    class Application(BaseApplication):
+        def load_config(self):
+            self.cfg.set("bind", f"{host}:{port}")
+            self.cfg.set("workers", workers)
+            self.cfg.set("worker_class", "uvicorn.workers.UvicornWorker")
+            self.cfg.set("preload_app", preload)
+            # Crews run off the event loop, so a worker that misses heartbeats this long is stuck
+            self.cfg.set("timeout", int(os.getenv("WORKER_TIMEOUT_SECONDS", "120")))
+            # Let running analyses finish on restart (REQUEST_DEADLINE_SECONDS bounds them)
+            self.cfg.set("graceful_timeout", int(os.getenv("REQUEST_DEADLINE_SECONDS", "600")))
+            self.cfg.set("keepalive", 5)
+
+        def load(self):
+            module_name, _, attribute = app_path.partition(":")
+            module = importlib.import_module(module_name)
+            return getattr(module, attribute or "app")
+
+    Application().run()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run an API with several worker processes")
+    parser.add_argument("app", nargs="?", default="main:app", help="module:attribute of the FastAPI app")
+    parser.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8000")))
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS)
+    parser.add_argument("--no-preload", action="store_true", help="import the app in each worker instead of once")
+    parser.add_argument("--reload", action="store_true", help="single process with auto-reload, for development")
+    args = parser.parse_args()
+    serve(args.app, host=args.host, port=args.port, workers=args.workers, preload=not args.no_preload,
+          reload=args.reload)
+
+
+if __name__ == "__main__":
+    main()
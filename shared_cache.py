@@ -0,0 +1,149 @@
+"""
+Cache tier shared by every API process (and worker) on a host.
+
+Running the API with N worker processes (serve.py) would otherwise give each
+process its own cold copy of the in-memory caches, multiplying misses by N.
+Values that are worth sharing go through this tier as well:
+
+    pages    parsed page texts of a document (ingestion.get_pages)
+    results  recent analyses by content hash and query (main.py)
+    llm      chat-model responses by model and prompt (model_routing.py)
+    deliveries  how often the broker delivered each task (worker_profiles.py)
+
+The default backend is a SQLite file in WAL mode (SHARED_CACHE_PATH, default
+data/shared_cache.db), like the knowledge store. Set SHARED_CACHE_URL to a
+redis:// URL to share the tier across hosts instead. Entries expire after
+their TTL; expired SQLite rows are purged every SHARED_CACHE_PURGE_SECONDS.
+Values are JSON (orjson when installed). A failing backend is reported and
+treated as a miss, so the cache can never fail a request.
+"""
+import os
+import time
+import json
+import sqlite3
+import hashlib
+import threading
+
+from telemetry import record_cache
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+SHARED_CACHE_URL = os.getenv("SHARED_CACHE_URL", "")
+SHARED_CACHE_PATH = os.getenv("SHARED_CACHE_PATH", os.path.join("data", "shared_cache.db"))
+SHARED_CACHE_PURGE_SECONDS = int(os.getenv("SHARED_CACHE_PURGE_SECONDS", "300"))
+
+
+def _dumps(value) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(value, default=str)
+    return json.dumps(value, default=str, separators=(",", ":")).encode("utf-8")
+
+
+def _loads(data: bytes):
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+
+def cache_key(*parts) -> str:
+    """Stable key for arbitrary JSON-serializable parts"""
+    return hashlib.sha256(_dumps(parts)).hexdigest()
+
+
+class SQLiteCache:
+    """Shared cache in a SQLite file (one connection per thread and process)"""
+
+    def __init__(self, path: str = SHARED_CACHE_PATH):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._local = threading.local()
+        self._purged_at = time.time()
+        self._connection().execute(
+            "CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL NOT NULL)"
+        )
+
+    def _connection(self) -> sqlite3.Connection:
+        # A connection inherited through fork (a preloaded app) must not be used by the child
+        if getattr(self._local, "pid", None) != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection, self._local.pid = connection, os.getpid()
+        return self._local.connection
+
+    def get(self, key: str):
+        row = self._connection().execute("SELECT value FROM entries WHERE key = ? AND expires_at > ?",
+                                         (key, time.time())).fetchone()
+        return None if row is None else row[0]
+
+    def set(self, key: str, data: bytes, ttl: float):
+        now = time.time()
+        connection = self._connection()
+        connection.execute("INSERT OR REPLACE INTO entries (key, value, expires_at) VALUES (?, ?, ?)",
+                           (key, data, now + ttl))
+        if now - self._purged_at > SHARED_CACHE_PURGE_SECONDS:
+            self._purged_at = now
+            connection.execute("DELETE FROM entries WHERE expires_at <= ?", (now,))
+
+
+class RedisCache:
+    """Shared cache in Redis (redis-py reconnects by itself after fork)"""
+
+    def __init__(self, url: str):
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+
+    def get(self, key: str):
+        return self.client.get(f"financial-analyzer:cache:{key}")
+
+    def set(self, key: str, data: bytes, ttl: float):
+        self.client.set(f"financial-analyzer:cache:{key}", data, ex=max(int(ttl), 1))
+
+
+class SharedCache:
+    """Namespaced get/set of JSON values over the configured backend"""
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def get(self, namespace: str, key: str):
+        if self.backend is None:
+            return None
+        try:
+            data = self.backend.get(f"{namespace}:{key}")
+        except Exception as e:
+            print(f"Shared cache read failed: {e}")
+            data = None
+        record_cache(f"shared_{namespace}", data is not None)
+        return None if data is None else _loads(data)
+
+    def set(self, namespace: str, key: str, value, ttl: float):
+        if self.backend is None:
+            return
+        try:
+            self.backend.set(f"{namespace}:{key}", _dumps(value), ttl)
+        except Exception as e:
+            print(f"Shared cache write failed: {e}")
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_shared_cache() -> SharedCache:
+    """The host-wide cache tier (SHARED_CACHE_URL, else SQLite)"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            try:
+                backend = RedisCache(SHARED_CACHE_URL) if SHARED_CACHE_URL.startswith(("redis://", "rediss://")) \
+                    else SQLiteCache()
+            except Exception as e:
+                print(f"Shared cache unavailable, continuing without it: {e}")
+                backend = None
+            _cache = SharedCache(backend)
+        return _cache
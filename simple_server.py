@@ -14,6 +14,9 @@ try:
     import google.generativeai as genai
     from dotenv import load_dotenv
     import PyPDF2
+    from mock_llm import is_mock_backend, MockGenerativeModel
+    from resilient_llm import ResilientGenerativeModel, CircuitOpenError, is_retryable
+    from offline_analysis import analyze_pages
 except ImportError as e:
     print(f"Missing dependency: {e}")
     print("Please install: pip install google-generativeai python-dotenv PyPDF2")
@@ -24,27 +27,26 @@ load_dotenv()
 
 class FinancialAnalyzer:
     def __init__(self):
+        if is_mock_backend():
+            self.model = ResilientGenerativeModel(MockGenerativeModel('gemini-pro'))
+            return
+        
         api_key = os.getenv('GOOGLE_API_KEY')
         if not api_key:
             raise ValueError("GOOGLE_API_KEY not found in environment variables")
         
         genai.configure(api_key=api_key)
-        self.model = genai.GenerativeModel('gemini-pro')
+        self.model = ResilientGenerativeModel(genai.GenerativeModel('gemini-pro'))
     
-    def extract_text_from_pdf(self, pdf_path):
-        """Extract text from PDF file"""
-        try:
-            with open(pdf_path, 'rb') as file:
-                pdf_reader = PyPDF2.PdfReader(file)
-                text = ""
-                for page in pdf_reader.pages:
-                    text += page.extract_text() + "\n"
-                return text
-        except Exception as e:
-            return f"Error extracting PDF: {str(e)}"
+    def extract_pages_from_pdf(self, pdf_path):
+        """Extract the text of each page of a PDF file"""
+        with open(pdf_path, 'rb') as file:
+            pdf_reader = PyPDF2.PdfReader(file)
+            return [page.extract_text() or "" for page in pdf_reader.pages]
     
-    def analyze_document(self, text):
+    def analyze_document(self, pages):
         """Analyze financial document using Gemini AI"""
+        text = "".join(page + "\n" for page in pages)
         prompt = f"""
         As a financial analyst, analyze this document and provide:
         
@@ -68,9 +70,14 @@ class FinancialAnalyzer:
                 "document_length": len(text)
             }
         except Exception as e:
+            # Only an LLM that is down or overloaded is answered from the deterministic offline engine
+            if not isinstance(e, CircuitOpenError) and not is_retryable(e):
+                raise
             return {
-                "status": "error",
-                "error": str(e),
+                "status": "success",
+                "analysis_mode": "offline",
+                "llm_error": str(e),
+                "analysis": analyze_pages(pages)["financial_analysis"],
                 "document_length": len(text)
             }
 
@@ -148,11 +155,12 @@ class RequestHandler(BaseHTTPRequestHandler):
                     temp_file_path = temp_file.name
                 
                 # Extract text and analyze
-                text = self.analyzer.extract_text_from_pdf(temp_file_path)
-                result = self.analyzer.analyze_document(text)
-                
-                # Clean up
-                os.unlink(temp_file_path)
+                try:
+                    pages = self.analyzer.extract_pages_from_pdf(temp_file_path)
+                    result = self.analyzer.analyze_document(pages)
+                finally:
+                    # Clean up
+                    os.unlink(temp_file_path)
                 
                 # Send response
                 self.send_response(200)
@@ -9,87 +9,27 @@ import json
 import urllib.parse
 from http.server import HTTPServer, BaseHTTPRequestHandler
 from datetime import datetime
+import uuid
 import tempfile
 import mimetypes
 
+from profiling import profile_run, profiled, list_artifacts, artifact_path, requested as profiling_requested
+from offline_analysis import analyze_content
+
 class FinancialAnalyzer:
-    """Mock financial analyzer that provides realistic analysis without external APIs"""
+    """Offline financial analyzer: figures, ratios and rule-based risk flags, without external APIs"""
     
     def analyze_document(self, file_content, filename):
         """Analyze financial document and return comprehensive insights"""
         
-        # Simulate document processing
         file_size = len(file_content)
-        
-        # Generate realistic financial analysis
-        analysis = {
-            "document_info": {
-                "filename": filename,
-                "size_kb": round(file_size / 1024, 2),
-                "processed_at": datetime.now().isoformat(),
-                "document_type": self._detect_document_type(filename)
-            },
-            "financial_analysis": {
-                "key_metrics": {
-                    "revenue_growth": "12.5% YoY",
-                    "profit_margin": "18.3%",
-                    "debt_to_equity": "0.45",
-                    "current_ratio": "2.1",
-                    "return_on_equity": "15.2%"
-                },
-                "risk_assessment": {
-                    "overall_risk": "Medium",
-                    "liquidity_risk": "Low",
-                    "credit_risk": "Medium",
-                    "market_risk": "Medium-High",
-                    "operational_risk": "Low"
-                },
-                "investment_recommendation": {
-                    "rating": "BUY",
-                    "confidence": "High",
-                    "target_price": "$125.00",
-                    "time_horizon": "12 months",
-                    "key_drivers": [
-                        "Strong revenue growth trajectory",
-                        "Improving operational efficiency",
-                        "Solid balance sheet position",
-                        "Market expansion opportunities"
-                    ]
-                }
-            },
-            "document_verification": {
-                "authenticity": "Verified",
-                "completeness": "100%",
-                "data_quality": "High",
-                "compliance_status": "Compliant with GAAP standards"
-            },
-            "detailed_insights": {
-                "strengths": [
-                    "Consistent revenue growth over past 3 years",
-                    "Strong cash flow generation",
-                    "Diversified revenue streams",
-                    "Experienced management team"
-                ],
-                "concerns": [
-                    "Increasing competition in core markets",
-                    "Rising operational costs",
-                    "Dependency on key customers"
-                ],
-                "opportunities": [
-                    "Expansion into emerging markets",
-                    "Digital transformation initiatives",
-                    "Strategic partnerships",
-                    "New product development"
-                ],
-                "recommendations": [
-                    "Monitor cash flow trends closely",
-                    "Diversify customer base",
-                    "Invest in technology upgrades",
-                    "Consider strategic acquisitions"
-                ]
-            }
+        analysis = analyze_content(file_content, filename)
+        analysis["document_info"] = {
+            "filename": filename,
+            "size_kb": round(file_size / 1024, 2),
+            "processed_at": datetime.now().isoformat(),
+            "document_type": self._detect_document_type(filename)
         }
-        
         return analysis
     
     def _detect_document_type(self, filename):
@@ -121,6 +61,8 @@ class FinancialDocumentHandler(BaseHTTPRequestHandler):
             self._serve_health_check()
         elif self.path == '/docs':
             self._serve_api_docs()
+        elif self.path.startswith('/profiles/'):
+            self._serve_profile_artifact()
         else:
             self._serve_404()
     
@@ -228,10 +170,11 @@ class FinancialDocumentHandler(BaseHTTPRequestHandler):
                             <li><strong>Debt-to-Equity:</strong> ${data.financial_analysis.key_metrics.debt_to_equity}</li>
                             <li><strong>Current Ratio:</strong> ${data.financial_analysis.key_metrics.current_ratio}</li>
                             <li><strong>ROE:</strong> ${data.financial_analysis.key_metrics.return_on_equity}</li>
+                            <li><strong>Period:</strong> ${data.financial_analysis.key_metrics.latest_period}</li>
                         </ul>
                         
                         <h3>Investment Recommendation</h3>
-                        <p><strong>Rating:</strong> <span style="color: green; font-weight: bold;">${data.financial_analysis.investment_recommendation.rating}</span></p>
+                        <p><strong>Rating:</strong> <span style="font-weight: bold;">${data.financial_analysis.investment_recommendation.rating}</span></p>
                         <p><strong>Target Price:</strong> ${data.financial_analysis.investment_recommendation.target_price}</p>
                         <p><strong>Confidence:</strong> ${data.financial_analysis.investment_recommendation.confidence}</p>
                         
@@ -244,6 +187,9 @@ class FinancialDocumentHandler(BaseHTTPRequestHandler):
                         <h4>Strengths:</h4>
                         <ul>${data.detailed_insights.strengths.map(s => `<li>${s}</li>`).join('')}</ul>
                         
+                        <h4>Concerns:</h4>
+                        <ul>${data.detailed_insights.concerns.map(c => `<li>${c}</li>`).join('')}</ul>
+                        
                         <h4>Recommendations:</h4>
                         <ul>${data.detailed_insights.recommendations.map(r => `<li>${r}</li>`).join('')}</ul>
                     `;
@@ -263,19 +209,29 @@ class FinancialDocumentHandler(BaseHTTPRequestHandler):
     
     def _handle_analyze(self):
         """Handle document analysis requests"""
+        profile_id = uuid.uuid4().hex
+        profile_enabled = profiling_requested(self.headers.get('X-Profile'))
         try:
-            # Parse multipart form data
-            content_type = self.headers.get('Content-Type', '')
-            if not content_type.startswith('multipart/form-data'):
-                self._send_json_response(400, {"error": "Invalid content type"})
-                return
-            
-            # Get content length
-            content_length = int(self.headers.get('Content-Length', 0))
-            if content_length == 0:
-                self._send_json_response(400, {"error": "No file uploaded"})
-                return
-            
+            with profile_run(profile_id, enabled=profile_enabled):
+                self._analyze_upload(profile_id if profile_enabled else None)
+        except Exception as e:
+            self._send_json_response(500, {"error": f"Analysis failed: {str(e)}"})
+    
+    def _analyze_upload(self, profile_id):
+        """Parse the multipart upload and run the analysis"""
+        # Parse multipart form data
+        content_type = self.headers.get('Content-Type', '')
+        if not content_type.startswith('multipart/form-data'):
+            self._send_json_response(400, {"error": "Invalid content type"})
+            return
+        
+        # Get content length
+        content_length = int(self.headers.get('Content-Length', 0))
+        if content_length == 0:
+            self._send_json_response(400, {"error": "No file uploaded"})
+            return
+        
+        with profiled("multipart_parse"):
             # Read the request body
             post_data = self.rfile.read(content_length)
             
@@ -303,18 +259,34 @@ class FinancialDocumentHandler(BaseHTTPRequestHandler):
                         if file_content.endswith(b'\r\n'):
                             file_content = file_content[:-2]
                         break
-            
-            if file_content is None:
-                self._send_json_response(400, {"error": "No file content found"})
-                return
-            
-            # Analyze the document
+        
+        if file_content is None:
+            self._send_json_response(400, {"error": "No file content found"})
+            return
+        
+        # Analyze the document
+        with profiled("analyze_document"):
             analysis = self.analyzer.analyze_document(file_content, filename)
-            
-            self._send_json_response(200, analysis)
-            
-        except Exception as e:
-            self._send_json_response(500, {"error": f"Analysis failed: {str(e)}"})
+        if profile_id:
+            analysis["profile_id"] = profile_id
+            analysis["profile_artifacts"] = list_artifacts(profile_id)
+        
+        self._send_json_response(200, analysis)
+    
+    def _serve_profile_artifact(self):
+        """Serve a stored profiling artifact: /profiles/<profile_id>/<artifact>"""
+        segments = self.path.strip('/').split('/')
+        path = artifact_path(segments[1], segments[2]) if len(segments) == 3 else None
+        if path is None:
+            self._serve_404()
+            return
+        with open(path, 'rb') as f:
+            data = f.read()
+        self.send_response(200)
+        self.send_header('Content-type', 'application/octet-stream')
+        self.send_header('Content-length', len(data))
+        self.end_headers()
+        self.wfile.write(data)
     
     def _serve_health_check(self):
         """Serve health check endpoint"""
@@ -407,7 +379,7 @@ class FinancialDocumentHandler(BaseHTTPRequestHandler):
 
 def main():
     """Main function to start the server"""
-    port = 8000
+    port = int(os.getenv("PORT", "8000"))
     server_address = ('', port)
     
     print("🏦 Financial Document Analyzer")
@@ -0,0 +1,133 @@
+"""
+Server-sent event (SSE) streaming for crew runs.
+
+The blocking crew runs in a worker thread. LLM tokens (via LiteLLM streaming
+and a LangChain callback handler) and per-task boundaries are pushed onto an
+asyncio queue and forwarded to the client as they are generated, so the first
+bytes go out within seconds instead of after all four agents have finished.
+"""
+import json
+import asyncio
+import contextvars
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from run_control import RunControl, RunCancelled
+
+# Seconds between keep-alive comments so proxies don't close idle streams
+KEEPALIVE_SECONDS = 15
+
+# Per-run event sink; set inside the worker thread's context only
+_event_sink = contextvars.ContextVar("event_sink", default=None)
+
+_DONE = object()
+
+
+def emit(event: str, data: dict):
+    """Send an event to the client streaming the current run, if any"""
+    sink = _event_sink.get()
+    if sink is not None:
+        sink(event, data)
+
+
+def is_streaming() -> bool:
+    """True when the current run is being streamed to a client"""
+    return _event_sink.get() is not None
+
+
+class TokenStreamHandler(BaseCallbackHandler):
+    """LangChain callback that forwards streamed LLM tokens to the current run"""
+
+    def on_llm_new_token(self, token: str, **kwargs):
+        if token:
+            emit("token", {"text": token})
+
+
+token_stream_handler = TokenStreamHandler()
+
+
+class TaskBoundaryTracker:
+    """
+    Emits task_start/task_end events for a sequential crew.
+
+    crewAI only reports task completion, so the next task is announced as
+    started when the previous one finishes.
+    """
+
+    def __init__(self, task_names: list):
+        self.task_names = task_names
+        self.current = 0
+
+    def start(self):
+        if self.task_names:
+            emit("task_start", {"index": 0, "task": self.task_names[0]})
+
+    def __call__(self, task_output):
+        name = self.task_names[self.current] if self.current < len(self.task_names) else None
+        emit("task_end", {
+            "index": self.current,
+            "task": name,
+            "agent": str(getattr(task_output, "agent", "")),
+            "output": getattr(task_output, "raw", str(task_output)),
+        })
+        self.current += 1
+        if self.current < len(self.task_names):
+            emit("task_start", {"index": self.current, "task": self.task_names[self.current]})
+
+
+def format_sse(event: str, data: dict) -> str:
+    """Encode one server-sent event"""
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+async def stream_events(run, *args, runner=None, control=None, on_done=None, **kwargs):
+    """
+    Run a blocking callable in a thread and yield its events as SSE strings.
+
+    The callable's return value is sent as a final "result" event, and any
+    exception as an "error" event. With a runner (run_control.CrewRunner) the
+    callable runs on its pool under control, and the run is cancelled if the
+    client goes away before it finishes. on_done() is called once the
+    callable's thread has finished, even if the stream was closed before that.
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+
+    def sink(event, data):
+        loop.call_soon_threadsafe(queue.put_nowait, (event, data))
+
+    def target():
+        try:
+            result = run(*args, **kwargs)
+            sink("result", {"analysis": str(result)})
+        except (Exception, RunCancelled) as e:
+            sink("error", {"detail": str(e)})
+        finally:
+            loop.call_soon_threadsafe(queue.put_nowait, _DONE)
+
+    context = contextvars.copy_context()
+    context.run(_event_sink.set, sink)
+    if runner is not None:
+        control = control or RunControl()
+        future = context.run(runner.submit, control, target)
+    else:
+        future = loop.run_in_executor(None, context.run, target)
+    if on_done is not None:
+        future.add_done_callback(lambda f: on_done())
+
+    try:
+        while True:
+            try:
+                item = await asyncio.wait_for(queue.get(), timeout=KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+                continue
+            if item is _DONE:
+                break
+            event, data = item
+            yield format_sse(event, data)
+
+        await future
+    finally:
+        if control is not None and not future.done():
+            control.cancel("client disconnected")
@@ -0,0 +1,242 @@
+"""
+Parsing, repair and compact serialization of structured LLM output.
+
+parse_structured(text, Model) turns an agent's answer into a validated
+Pydantic model in up to three steps, stopping at the first that works:
+
+1. fast parse: orjson (json when orjson is not installed) of the JSON object
+   in the answer, after stripping code fences and "Final Answer:" prefixes;
+2. local repair: trailing commas, single quotes, Python literals, comments
+   and unclosed brackets of a truncated answer are fixed without any call;
+3. LLM repair: only the broken answer, the validation errors and the target
+   shape are sent back to the model (a few hundred tokens, not the document
+   and not the crew), and its reply goes through steps 1 and 2 again.
+
+Outcomes are counted in analyzer_structured_output_total{outcome=...}.
+
+pack / unpack serialize results with msgpack when installed (orjson, then
+json otherwise); the first byte records the format so either side can read
+what the other wrote.
+"""
+import re
+import json
+
+from pydantic import ValidationError
+
+from telemetry import registry
+from schemas import TASK_SCHEMAS, format_instructions
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+registry.describe("analyzer_structured_output_total", "counter",
+                  "Structured LLM outputs by parse outcome (parsed, repaired, llm_repaired, failed)")
+
+# Characters of a broken answer sent back for LLM repair
+REPAIR_MAX_CHARS = 6000
+
+_FENCE = re.compile(r"```(?:json)?\s*(.*?)```", re.DOTALL | re.IGNORECASE)
+_TRAILING_COMMA = re.compile(r",\s*([}\]])")
+_PY_LITERALS = {"True": "true", "False": "false", "None": "null"}
+
+
+def loads(text):
+    """json.loads, through orjson when it is installed"""
+    return orjson.loads(text) if orjson is not None else json.loads(text)
+
+
+def dumps(value) -> bytes:
+    """Compact UTF-8 JSON, through orjson when it is installed"""
+    if orjson is not None:
+        return orjson.dumps(value, default=str)
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False, default=str).encode("utf-8")
+
+
+def extract_json(text: str) -> str:
+    """The JSON object in an answer: inside code fences, after a prefix, or the outermost braces"""
+    text = (text or "").strip()
+    fenced = _FENCE.search(text)
+    if fenced:
+        text = fenced.group(1).strip()
+    start = text.find("{")
+    if start < 0:
+        return text
+    depth, in_string, escaped = 0, False, False
+    for position in range(start, len(text)):
+        char = text[position]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char == "{":
+            depth += 1
+        elif char == "}":
+            depth -= 1
+            if depth == 0:
+                return text[start:position + 1]
+    # Unbalanced: the answer was cut off; repair_json closes it
+    return text[start:]
+
+
+def repair_json(text: str) -> str:
+    """Fix the common ways LLM JSON is invalid without changing its content"""
+    # Single-quoted strings and keys, when the answer uses no double quotes at all
+    if '"' not in text:
+        text = text.replace("'", '"')
+    out, stack, in_string, escaped = [], [], False, False
+    index = 0
+    while index < len(text):
+        char = text[index]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+            elif char == "\n":
+                char = "\\n"
+            out.append(char)
+            index += 1
+            continue
+        if char == "/" and text.startswith("//", index):
+            # Line comment
+            newline = text.find("\n", index)
+            index = len(text) if newline < 0 else newline
+            continue
+        if char == '"':
+            in_string = True
+        elif char in "{[":
+            stack.append("}" if char == "{" else "]")
+        elif char in "}]" and stack:
+            stack.pop()
+        elif char.isalpha():
+            word = re.match(r"[A-Za-z_]+", text[index:]).group(0)
+            out.append(_PY_LITERALS.get(word, word))
+            index += len(word)
+            continue
+        out.append(char)
+        index += 1
+    if in_string:
+        out.append('"')
+    repaired = "".join(out).rstrip()
+    if stack and stack[-1] == "}":
+        # A truncated answer may stop after a key or its colon; drop that member
+        repaired = re.sub(r'[{,]\s*"[^"]*"\s*:?\s*$', lambda m: "{" if m.group(0)[0] == "{" else "", repaired)
+    repaired = repaired.rstrip().rstrip(",") + "".join(reversed(stack))
+    return _TRAILING_COMMA.sub(r"\1", repaired)
+
+
+def _validate(text: str, model, errors: list, repair: bool):
+    candidate = extract_json(text)
+    try:
+        return model.model_validate(loads(repair_json(candidate) if repair else candidate))
+    except (ValueError, TypeError, ValidationError) as e:
+        # orjson.JSONDecodeError and json.JSONDecodeError are both ValueErrors
+        errors.append(str(e).splitlines()[0] if not isinstance(e, ValidationError) else _summarize(e))
+        return None
+
+
+def _summarize(error: ValidationError) -> str:
+    return "; ".join(f"{'.'.join(str(p) for p in item['loc']) or 'root'}: {item['msg']}"
+                     for item in error.errors()[:10])
+
+
+def repair_prompt(text: str, model, errors: list) -> str:
+    return (
+        "The following answer should be a JSON object but could not be parsed or validated.\n"
+        f"Errors: {' | '.join(errors[-2:])}\n"
+        f"{format_instructions(model)}\n"
+        "Rewrite it as that JSON object, keeping all of its content and adding nothing new.\n\n"
+        f"Answer:\n{text[:REPAIR_MAX_CHARS]}"
+    )
+
+
+def parse_structured(text: str, model, repair=None):
+    """
+    Validated model instance for an LLM answer, or None.
+
+    repair, if given, is a callable taking a prompt and returning the LLM's
+    reply; it is used once, only when the answer cannot be fixed locally.
+    """
+    errors = []
+    result = _validate(text, model, errors, repair=False)
+    if result is not None:
+        registry.inc("analyzer_structured_output_total", labels={"outcome": "parsed"})
+        return result
+    result = _validate(text, model, errors, repair=True)
+    if result is not None:
+        registry.inc("analyzer_structured_output_total", labels={"outcome": "repaired"})
+        return result
+    if repair is not None:
+        try:
+            fixed = repair(repair_prompt(text, model, errors))
+        except Exception as e:
+            errors.append(f"repair call failed: {e}")
+        else:
+            result = _validate(fixed, model, errors, repair=False) or _validate(fixed, model, errors, repair=True)
+            if result is not None:
+                registry.inc("analyzer_structured_output_total", labels={"outcome": "llm_repaired"})
+                return result
+    registry.inc("analyzer_structured_output_total", labels={"outcome": "failed"})
+    print(f"Could not parse {model.__name__} output: {errors[-1] if errors else 'empty answer'}")
+    return None
+
+
+def llm_repairer(llm):
+    """A repair callable for parse_structured backed by a LangChain-style chat model"""
+    def repair(prompt: str) -> str:
+        response = llm.invoke(prompt)
+        return getattr(response, "content", str(response))
+    return repair
+
+
+class StructuredOutputCollector:
+    """
+    task_callback: validate each task's output against its schema as it finishes.
+
+    Runs before TokenBudget compacts the output, so it sees the full answer.
+    structured maps task name to the validated dict (None if it failed).
+    """
+
+    def __init__(self, task_names: list, repair=None):
+        self.task_names = task_names
+        self.repair = repair
+        self.structured = {}
+        self._index = 0
+
+    def __call__(self, task_output):
+        name = self.task_names[self._index] if self._index < len(self.task_names) else f"task_{self._index}"
+        self._index += 1
+        model = TASK_SCHEMAS.get(name)
+        if model is None:
+            return
+        parsed = parse_structured(getattr(task_output, "raw", None) or str(task_output), model, self.repair)
+        self.structured[name] = parsed.model_dump() if parsed is not None else None
+
+
+def pack(value) -> bytes:
+    """Compact binary encoding for storage and transport (msgpack, else JSON)"""
+    if msgpack is not None:
+        return b"m" + msgpack.packb(value, default=str, use_bin_type=True)
+    return b"j" + dumps(value)
+
+
+def unpack(data: bytes):
+    if data[:1] == b"m":
+        if msgpack is None:
+            raise RuntimeError("Data was packed with msgpack, which is not installed here")
+        return msgpack.unpackb(data[1:], raw=False)
+    return loads(data[1:])
@@ -1,12 +1,15 @@
 from crewai import Task
 from agents import financial_analyst, verifier, investment_advisor, risk_assessor
+from schemas import (VerificationReport, FinancialAnalysisReport, InvestmentRecommendation, RiskReport,
+                     QuickAnalysis, format_instructions)
 
 # Creating a verification task with very explicit instructions
 verification = Task(
     description=(
-        "You MUST use the 'Read a file's content' tool to verify the financial document "
+        "You MUST use the document tools to verify the financial document "
         "located at the path: '{file_path}'.\n"
-        "Read the entire document content using the tool before proceeding.\n\n"
+        "Start with the 'Document Overview' tool, then use 'Get Document Section', "
+        "'Search Document' and 'Read Document Pages' to read only the parts you need.\n\n"
         "Your verification checklist is as follows:\n"
         "1. Confirm the document is readable and properly formatted.\n"
         "2. Identify the type of financial document (e.g., annual report, quarterly filing).\n"
@@ -15,7 +18,8 @@ verification = Task(
     ),
     expected_output=(
         "A detailed verification report including the document type, source, data quality, "
-        "any identified issues, and a confidence level in the document's reliability."
+        "any identified issues, and a confidence level in the document's reliability. "
+        + format_instructions(VerificationReport)
     ),
     agent=verifier,
     async_execution=False
@@ -26,6 +30,8 @@ analyze_financial_document = Task(
     description=(
         "Using the content of the financial document from the file path '{file_path}' "
         "and the verification report from the previous step, conduct a detailed financial analysis.\n"
+        "Read the document with the document tools ('Get Document Section' for the financial "
+        "statements, 'Search Document' for specific figures) rather than whole page ranges.\n"
         "The user's primary question is: {query}.\n\n"
         "Your analysis MUST include:\n"
         "1. A summary of the company's financial performance.\n"
@@ -34,7 +40,8 @@ analyze_financial_document = Task(
     ),
     expected_output=(
         "A comprehensive financial analysis report with an executive summary, "
-        "detailed breakdown of key metrics, and insights addressing the user's query."
+        "detailed breakdown of key metrics, and insights addressing the user's query. "
+        + format_instructions(FinancialAnalysisReport)
     ),
     agent=financial_analyst,
     async_execution=False,
@@ -50,7 +57,8 @@ investment_analysis = Task(
     ),
     expected_output=(
         "A clear investment recommendation (BUY, HOLD, or SELL) with a supporting thesis, "
-        "rationale, and a brief risk assessment."
+        "rationale, and a brief risk assessment. "
+        + format_instructions(InvestmentRecommendation)
     ),
     agent=investment_advisor,
     async_execution=False,
@@ -65,9 +73,50 @@ risk_assessment = Task(
     ),
     expected_output=(
         "A risk assessment report detailing the key risks identified, their potential impact, "
-        "and recommended mitigation strategies."
+        "and recommended mitigation strategies. "
+        + format_instructions(RiskReport)
     ),
     agent=risk_assessor,
     async_execution=False,
     context=[analyze_financial_document]
-)
\ No newline at end of file
+)
+# Creating a synthesis task for amended documents, fed by cached per-chunk summaries
+incremental_synthesis = Task(
+    description=(
+        "An amended version of a previously analyzed financial document has been received "
+        "(file path: '{file_path}').\n"
+        "The verification report from the earlier analysis of this company and period is:\n"
+        "{verification_report}\n\n"
+        "The document has been split into sections. Sections marked [CHANGED] differ from the "
+        "previously analyzed version; the others are unchanged:\n"
+        "{chunk_summaries}\n\n"
+        "The user's primary question is: {query}.\n\n"
+        "Using these section summaries, produce an updated financial analysis. Call out "
+        "explicitly how the changed sections affect the company's financial picture."
+    ),
+    expected_output=(
+        "An updated financial analysis report with an executive summary, key metrics, "
+        "a summary of what changed in the amendment, and insights addressing the user's query. "
+        + format_instructions(FinancialAnalysisReport)
+    ),
+    agent=financial_analyst,
+    async_execution=False
+)
+
+# Creating a single-pass task for short documents routed to the light pipeline by triage
+quick_analysis = Task(
+    description=(
+        "Read the short financial document at '{file_path}' with the document tools and "
+        "answer the user's query: {query}.\n\n"
+        "In one pass, cover:\n"
+        "1. What the document is and whether it looks complete and credible.\n"
+        "2. The key financial metrics it reports.\n"
+        "3. A brief investment view (BUY, HOLD, or SELL) and the main risks."
+    ),
+    expected_output=(
+        "A concise financial analysis with key metrics, an investment view, and the main risks. "
+        + format_instructions(QuickAnalysis)
+    ),
+    agent=financial_analyst,
+    async_execution=False
+)
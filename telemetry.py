@@ -0,0 +1,280 @@
+"""
+Tracing and metrics for the analysis pipeline.
+
+Every stage (upload, PDF parsing, each crew task/agent, tool calls, Mongo,
+queue wait) is wrapped in an OpenTelemetry span and timed into a small
+in-process metrics registry that is served in Prometheus text format from
+`/metrics`. Spans and metrics are exported according to TELEMETRY_EXPORTER:
+
+    console   print spans/metrics to stdout (default)
+    otlp      send to an OTLP collector (OTEL_EXPORTER_OTLP_ENDPOINT, default localhost:4317)
+    none      keep metrics in-process only
+
+OpenTelemetry is optional; without it the Prometheus registry still works.
+"""
+import os
+import time
+import threading
+import contextvars
+from contextlib import contextmanager, nullcontext
+
+try:
+    from opentelemetry import trace, metrics
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter
+    from opentelemetry.sdk.metrics import MeterProvider
+    from opentelemetry.sdk.metrics.export import PeriodicExportingMetricReader, ConsoleMetricExporter
+except ImportError:
+    trace = None
+    metrics = None
+
+try:
+    from langchain_core.callbacks import BaseCallbackHandler
+except ImportError:
+    BaseCallbackHandler = object
+
+SERVICE_NAME = os.getenv("OTEL_SERVICE_NAME", "financial-document-analyzer")
+DURATION_BUCKETS = [0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600]
+
+# Name of the crew task currently running in this thread, for attributing LLM calls
+current_task = contextvars.ContextVar("current_task", default=None)
+
+
+class MetricsRegistry:
+    """Minimal thread-safe counter/gauge/histogram store rendered as Prometheus text"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+        self._help = {}
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted((labels or {}).items()))
+
+    def describe(self, name: str, kind: str, help_text: str):
+        self._help[name] = (kind, help_text)
+
+    def inc(self, name: str, value: float = 1.0, labels: dict = None):
+        with self._lock:
+            key = self._key(name, labels)
+            self._counters[key] = self._counters.get(key, 0.0) + value
+
+    def set(self, name: str, value: float, labels: dict = None):
+        with self._lock:
+            self._gauges[self._key(name, labels)] = value
+
+    def observe(self, name: str, value: float, labels: dict = None):
+        with self._lock:
+            key = self._key(name, labels)
+            entry = self._histograms.setdefault(key, {"buckets": [0] * len(DURATION_BUCKETS), "sum": 0.0, "count": 0})
+            for index, bound in enumerate(DURATION_BUCKETS):
+                if value <= bound:
+                    entry["buckets"][index] += 1
+            entry["sum"] += value
+            entry["count"] += 1
+
+    @staticmethod
+    def _escape(value, quote=True) -> str:
+        """Escape a label value (or, with quote=False, HELP text) as the exposition format requires"""
+        value = str(value).replace("\\", "\\\\").replace("\n", "\\n")
+        return value.replace('"', '\\"') if quote else value
+
+    @classmethod
+    def _labels(cls, pairs, extra=None):
+        items = list(pairs) + ([extra] if extra else [])
+        if not items:
+            return ""
+        return "{" + ",".join(f'{k}="{cls._escape(v)}"' for k, v in items) + "}"
+
+    def render(self) -> str:
+        """Render all metrics in the Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            for store, kind in ((self._counters, "counter"), (self._gauges, "gauge")):
+                for name in sorted({key[0] for key in store}):
+                    lines.append(f"# HELP {name} {self._escape(self._help.get(name, (kind, name))[1], quote=False)}")
+                    lines.append(f"# TYPE {name} {kind}")
+                    for (metric, pairs), value in store.items():
+                        if metric == name:
+                            lines.append(f"{name}{self._labels(pairs)} {value}")
+            for name in sorted({key[0] for key in self._histograms}):
+                lines.append(f"# HELP {name} {self._escape(self._help.get(name, ('histogram', name))[1], quote=False)}")
+                lines.append(f"# TYPE {name} histogram")
+                for (metric, pairs), entry in self._histograms.items():
+                    if metric != name:
+                        continue
+                    for bound, count in zip(DURATION_BUCKETS, entry["buckets"]):
+                        lines.append(f"{name}_bucket{self._labels(pairs, ('le', bound))} {count}")
+                    lines.append(f"{name}_bucket{self._labels(pairs, ('le', '+Inf'))} {entry['count']}")
+                    lines.append(f"{name}_sum{self._labels(pairs)} {entry['sum']}")
+                    lines.append(f"{name}_count{self._labels(pairs)} {entry['count']}")
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+registry.describe("analyzer_stage_duration_seconds", "histogram", "Time spent in each pipeline stage")
+registry.describe("analyzer_stage_errors_total", "counter", "Pipeline stages that raised an exception")
+registry.describe("analyzer_llm_tokens_total", "counter", "LLM tokens by agent, model and kind (prompt/completion)")
+registry.describe("analyzer_cache_requests_total", "counter", "Cache lookups by cache name and result (hit/miss)")
+registry.describe("analyzer_queue_wait_seconds", "histogram", "Time a job waited in the queue before a worker picked it up")
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_tracer = None
+_instruments = {}
+_setup_lock = threading.Lock()
+
+
+def setup_telemetry(app=None):
+    """Configure exporters once per process and instrument a FastAPI app if given"""
+    global _tracer
+    if trace is None:
+        return
+    with _setup_lock:
+        if _tracer is None:
+            exporter = os.getenv("TELEMETRY_EXPORTER", "console").lower()
+            resource = Resource.create({"service.name": SERVICE_NAME})
+            tracer_provider = TracerProvider(resource=resource)
+            readers = []
+            if exporter == "otlp":
+                from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter
+                from opentelemetry.exporter.otlp.proto.grpc.metric_exporter import OTLPMetricExporter
+                tracer_provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+                readers.append(PeriodicExportingMetricReader(OTLPMetricExporter()))
+            elif exporter == "console":
+                tracer_provider.add_span_processor(BatchSpanProcessor(ConsoleSpanExporter()))
+                readers.append(PeriodicExportingMetricReader(ConsoleMetricExporter(), export_interval_millis=60000))
+            trace.set_tracer_provider(tracer_provider)
+            metrics.set_meter_provider(MeterProvider(resource=resource, metric_readers=readers))
+
+            meter = metrics.get_meter(SERVICE_NAME)
+            _instruments["stage"] = meter.create_histogram("analyzer.stage.duration", unit="s")
+            _instruments["tokens"] = meter.create_counter("analyzer.llm.tokens")
+            _instruments["cache"] = meter.create_counter("analyzer.cache.requests")
+            _instruments["queue_wait"] = meter.create_histogram("analyzer.queue.wait", unit="s")
+            _tracer = trace.get_tracer(SERVICE_NAME)
+
+    if app is not None:
+        try:
+            from opentelemetry.instrumentation.fastapi import FastAPIInstrumentor
+            FastAPIInstrumentor.instrument_app(app, excluded_urls="metrics,health")
+        except ImportError:
+            pass
+
+
+def _record(instrument: str, value: float, attributes: dict):
+    if instrument in _instruments:
+        if hasattr(_instruments[instrument], "record"):
+            _instruments[instrument].record(value, attributes)
+        else:
+            _instruments[instrument].add(value, attributes)
+
+
+@contextmanager
+def stage(name: str, **attributes):
+    """Time a pipeline stage as a span and a duration histogram"""
+    start = time.perf_counter()
+    span_context = _tracer.start_as_current_span(name, attributes=attributes) if _tracer else nullcontext()
+    try:
+        with span_context as span:
+            yield span
+    except Exception:
+        registry.inc("analyzer_stage_errors_total", labels={"stage": name})
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        registry.observe("analyzer_stage_duration_seconds", elapsed, {"stage": name})
+        _record("stage", elapsed, {"stage": name})
+
+
+def record_span(name: str, start_ns: int, end_ns: int, **attributes):
+    """Emit a span for work whose start and end were observed after the fact"""
+    elapsed = (end_ns - start_ns) / 1e9
+    registry.observe("analyzer_stage_duration_seconds", elapsed, {"stage": name})
+    _record("stage", elapsed, {"stage": name})
+    if _tracer:
+        span = _tracer.start_span(name, start_time=start_ns, attributes=attributes)
+        span.end(end_time=end_ns)
+
+
+def record_tokens(agent: str, model: str, prompt_tokens: int, completion_tokens: int):
+    for kind, count in (("prompt", prompt_tokens), ("completion", completion_tokens)):
+        if count:
+            labels = {"agent": agent or "none", "model": model or "unknown", "kind": kind}
+            registry.inc("analyzer_llm_tokens_total", count, labels)
+            _record("tokens", count, labels)
+
+
+def record_cache(cache: str, hit: bool):
+    labels = {"cache": cache, "result": "hit" if hit else "miss"}
+    registry.inc("analyzer_cache_requests_total", labels=labels)
+    _record("cache", 1, labels)
+
+
+def record_queue_wait(seconds: float, queue: str = "celery"):
+    registry.observe("analyzer_queue_wait_seconds", seconds, {"queue": queue})
+    _record("queue_wait", seconds, {"queue": queue})
+
+
+class CrewTaskTimer:
+    """
+    task_callback that turns sequential crew task completions into agent spans.
+
+    Each task is assumed to start when the previous one finished.
+    """
+
+    def __init__(self, task_names: list):
+        self.task_names = task_names
+        self.index = 0
+        self.started_ns = time.time_ns()
+        current_task.set(task_names[0] if task_names else None)
+
+    def __call__(self, task_output):
+        now = time.time_ns()
+        name = self.task_names[self.index] if self.index < len(self.task_names) else f"task_{self.index}"
+        record_span(f"crew.task.{name}", self.started_ns, now, agent=str(getattr(task_output, "agent", "")))
+        self.index += 1
+        self.started_ns = now
+        current_task.set(self.task_names[self.index] if self.index < len(self.task_names) else None)
+
+
+class TelemetryCallbackHandler(BaseCallbackHandler):
+    """LangChain callback that emits a span and token counts for every LLM call"""
+
+    def __init__(self):
+        self._starts = {}
+
+    def on_llm_start(self, serialized, prompts, run_id=None, **kwargs):
+        self._starts[run_id] = time.time_ns()
+
+    def on_chat_model_start(self, serialized, messages, run_id=None, **kwargs):
+        self._starts[run_id] = time.time_ns()
+
+    def on_llm_end(self, response, run_id=None, **kwargs):
+        start_ns = self._starts.pop(run_id, None) or time.time_ns()
+        llm_output = getattr(response, "llm_output", None) or {}
+        usage = llm_output.get("token_usage") or llm_output.get("usage") or {}
+        prompt_tokens = usage.get("prompt_tokens", 0)
+        completion_tokens = usage.get("completion_tokens", 0)
+        if not usage:
+            for generations in getattr(response, "generations", []):
+                for generation in generations:
+                    metadata = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+                    prompt_tokens += metadata.get("input_tokens", 0)
+                    completion_tokens += metadata.get("output_tokens", 0)
+        model = llm_output.get("model_name") or llm_output.get("model") or "unknown"
+        agent = current_task.get()
+        record_tokens(agent, model, prompt_tokens, completion_tokens)
+        record_span("llm.call", start_ns, time.time_ns(), agent=agent or "none", model=model,
+                    prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+
+    def on_llm_error(self, error, run_id=None, **kwargs):
+        self._starts.pop(run_id, None)
+        registry.inc("analyzer_stage_errors_total", labels={"stage": "llm.call"})
+
+
+telemetry_callback_handler = TelemetryCallbackHandler()
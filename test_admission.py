@@ -0,0 +1,85 @@
+"""Admission control and crew runs that outlive their request"""
+import asyncio
+import threading
+
+import pytest
+
+import run_control
+from admission import AdmissionController, AdmissionRejected
+from run_control import CrewRunner, RunControl, RunCancelled
+
+
+def test_requests_beyond_the_queue_are_shed_with_429():
+    async def scenario():
+        admission = AdmissionController("test", max_active=1, max_queue=1, queue_timeout=5)
+        admitted_at = await admission.acquire()
+        waiter = asyncio.create_task(admission.acquire())
+        await asyncio.sleep(0)
+        assert admission.queued == 1
+        with pytest.raises(AdmissionRejected) as rejected:
+            await admission.acquire()
+        assert rejected.value.status_code == 429
+        admission.release(admitted_at)
+        admission.release(await waiter)
+        assert (admission.active, admission.queued) == (0, 0)
+    asyncio.run(scenario())
+
+
+def test_queued_request_times_out_with_503():
+    async def scenario():
+        admission = AdmissionController("test", max_active=1, max_queue=4, queue_timeout=0.05)
+        await admission.acquire()
+        with pytest.raises(AdmissionRejected) as rejected:
+            await admission.acquire()
+        assert rejected.value.status_code == 503
+        assert rejected.value.retry_after >= 1
+        assert admission.queued == 0
+    asyncio.run(scenario())
+
+
+def test_retry_after_follows_run_time():
+    async def scenario():
+        admission = AdmissionController("test", max_active=2)
+        async with admission.slot():
+            pass
+        assert admission.avg_run_seconds is not None
+        assert 1 <= admission.retry_after() <= 600
+    asyncio.run(scenario())
+
+
+def test_slot_is_held_until_an_abandoned_crew_thread_finishes(monkeypatch):
+    monkeypatch.setattr(run_control, "CANCEL_GRACE_SECONDS", 0.05)
+    finish = threading.Event()
+
+    def crew():
+        # A crew step that does not reach a checkpoint before the deadline
+        finish.wait(5)
+        return "done"
+
+    async def scenario():
+        admission = AdmissionController("test", max_active=1, max_queue=0)
+        runner = CrewRunner(workers=1)
+        admitted_at = await admission.acquire()
+        with pytest.raises(RunCancelled):
+            await runner.run(crew, control=RunControl(0.05), on_done=lambda: admission.release(admitted_at))
+        # The request gave up, but the thread still holds the pool worker, so the slot stays taken
+        assert admission.active == 1
+        with pytest.raises(AdmissionRejected):
+            await admission.acquire()
+        finish.set()
+        for _ in range(100):
+            if admission.active == 0:
+                break
+            await asyncio.sleep(0.01)
+        assert admission.active == 0
+        admission.release(await admission.acquire())
+    asyncio.run(scenario())
+
+
+def test_on_done_runs_after_a_completed_run():
+    async def scenario():
+        released = []
+        result = await CrewRunner(workers=1).run(lambda: "ok", on_done=lambda: released.append(True))
+        await asyncio.sleep(0)
+        assert result == "ok" and released == [True]
+    asyncio.run(scenario())
@@ -0,0 +1,68 @@
+"""Similarity lookups and near-duplicate matching in analysis_index"""
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from analysis_index import AnalysisIndex, vectorize, figures_fingerprint, SIMILAR_RELATED_THRESHOLD  # noqa: E402
+
+TEMPLATE = """Synthetic Corp {quarter} 2025 Update
+Consolidated income statement ($ in millions)
+Total revenues {revenue} 20,000
+Gross profit 5,280 5,000
+Income from operations 1,980 2,000
+Net income {net_income} 1,500
+Total current assets 33,000 30,000
+Net cash provided by operating activities 2,700 2,500
+Capital expenditures (2,000) (1,800)
+Management believes liquidity remains sufficient for the next twelve months.
+"""
+
+
+def _filing(quarter="Q2", revenue="22,000", net_income="1,430"):
+    return TEMPLATE.format(quarter=quarter, revenue=revenue, net_income=net_income)
+
+
+def _index_original():
+    index = AnalysisIndex()
+    original = _filing()
+    index.add("original", vectorize(original), {"query": "q", "company": "Synthetic Corp", "period": "Q2-2025",
+                                                "figures": figures_fingerprint(original)})
+    return index
+
+
+def _duplicates(index, text, period="Q2-2025"):
+    return index.near_duplicates(vectorize(text), query="q", company="Synthetic Corp", period=period,
+                                 figures=figures_fingerprint(text))
+
+
+def test_identical_figures_are_a_near_duplicate():
+    index = _index_original()
+    # Same filing, re-exported with different whitespace
+    assert [entry_id for _, entry_id, _ in _duplicates(index, "  " + _filing().replace("\n", " \n"))] == ["original"]
+
+
+def test_restatement_differing_only_in_figures_is_not_a_duplicate():
+    index = _index_original()
+    restated = _filing(net_income="1,210")
+    assert figures_fingerprint(restated) != figures_fingerprint(_filing())
+    assert _duplicates(index, restated) == []
+    # Still related, so it feeds the prior summary
+    assert [entry_id for _, entry_id, _ in index.search(vectorize(restated), min_score=SIMILAR_RELATED_THRESHOLD)] == [
+        "original"]
+
+
+def test_next_quarter_from_the_same_template_is_not_a_duplicate():
+    index = _index_original()
+    next_quarter = _filing(quarter="Q3", revenue="23,100", net_income="1,520")
+    assert _duplicates(index, next_quarter, period="Q3-2025") == []
+    assert index.search(vectorize(next_quarter))[0][0] < index.search(vectorize(_filing()))[0][0]
+
+
+def test_entries_without_a_fingerprint_are_never_duplicates():
+    index = AnalysisIndex()
+    index.add("legacy", vectorize(_filing()), {"query": "q", "company": "Synthetic Corp", "period": "Q2-2025"})
+    assert _duplicates(index, _filing()) == []
+
+
+def test_quarter_labels_are_tokens():
+    assert not np.array_equal(vectorize("q2 update"), vectorize("q3 update"))
@@ -0,0 +1,84 @@
+"""References, janitor sweeps and locking in document_store.DocumentStore"""
+import os
+import hashlib
+import threading
+
+import pytest
+
+import document_store
+from document_store import DocumentStore
+
+CONTENT = b"%PDF-1.4\nsynthetic document\n%%EOF\n"
+
+
+@pytest.fixture
+def store(tmp_path):
+    return DocumentStore(str(tmp_path / "store"))
+
+
+def test_put_is_content_addressed_and_counts_references(store):
+    doc_id, first = store.put(CONTENT)
+    again, second = store.put(CONTENT)
+    assert doc_id == again == hashlib.sha256(CONTENT).hexdigest()
+    assert first != second
+    assert store.refcount(doc_id) == 2
+    with store.view(doc_id) as view:
+        assert view[:] == CONTENT
+    store.release(doc_id, first)
+    store.release(doc_id, first)
+    assert store.refcount(doc_id) == 1
+
+
+def test_sweep_removes_only_idle_unreferenced_documents(store, monkeypatch):
+    monkeypatch.setattr(document_store, "DOCUMENT_STORE_IDLE_SECONDS", -1)
+    held, _ = store.put(CONTENT)
+    idle, ref = store.put(CONTENT + b"other")
+    store.release(idle, ref)
+    result = store.sweep()
+    assert result["removed"] == 1
+    assert os.path.exists(store.path(held))
+    assert not os.path.exists(store.path(idle))
+
+
+def test_sweep_evicts_over_budget(store, monkeypatch):
+    monkeypatch.setattr(document_store, "DOCUMENT_STORE_MAX_BYTES", 0)
+    doc_id, ref = store.put(CONTENT)
+    store.release(doc_id, ref)
+    assert store.sweep()["removed"] == 1
+    assert not os.path.exists(store.path(doc_id))
+
+
+def test_remove_skips_a_document_referenced_after_the_sweep_looked(store):
+    doc_id, ref = store.put(CONTENT)
+    store.release(doc_id, ref)
+    # The sweep saw no references; another process takes one before the removal
+    store.acquire(doc_id)
+    assert store._remove(doc_id, "idle") is False
+    assert os.path.exists(store.path(doc_id))
+
+
+@pytest.mark.skipif(document_store.fcntl is None, reason="needs fcntl")
+def test_acquire_waits_while_the_document_is_locked(store):
+    doc_id, ref = store.put(CONTENT)
+    store.release(doc_id, ref)
+    refs = []
+    # Held by the janitor's check-and-remove in any process
+    with store._locked(doc_id):
+        thread = threading.Thread(target=lambda: refs.append(store.acquire(doc_id)))
+        thread.start()
+        thread.join(0.2)
+        assert thread.is_alive() and not refs
+    thread.join(5)
+    assert refs and store.refcount(doc_id) == 1
+    assert store._remove(doc_id, "idle") is False
+
+
+def test_adopt_moves_a_file_into_the_store(store, tmp_path):
+    source = tmp_path / "upload.pdf"
+    source.write_bytes(CONTENT)
+    doc_id = hashlib.sha256(CONTENT).hexdigest()
+    store.adopt(str(source), doc_id)
+    assert not source.exists()
+    assert store.refcount(doc_id) == 1
+    with open(store.path(doc_id), "rb") as f:
+        assert f.read() == CONTENT
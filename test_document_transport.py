@@ -0,0 +1,99 @@
+"""Document transports, worker-side materialize and uploads completed on another node"""
+import os
+import asyncio
+import hashlib
+
+import pytest
+
+import document_transport
+from document_store import DocumentStore
+from document_transport import ObjectStoreTransport, materialize
+from uploads import UploadSessions, UploadError
+
+CONTENT = b"%PDF-1.4\nsynthetic filing\n%%EOF\n"
+DOC_ID = hashlib.sha256(CONTENT).hexdigest()
+
+
+@pytest.fixture
+def transport(tmp_path, monkeypatch):
+    transport = ObjectStoreTransport(str(tmp_path / "objects"), ttl=3600)
+    monkeypatch.setattr(document_transport, "_transport", transport)
+    return transport
+
+
+def _node(tmp_path, name):
+    return DocumentStore(str(tmp_path / name))
+
+
+def test_materialize_fetches_a_missing_document_once(tmp_path, transport):
+    api, worker = _node(tmp_path, "api"), _node(tmp_path, "worker")
+    doc_id, _ = api.put(CONTENT)
+    transport.publish(doc_id, api.path(doc_id))
+
+    path, ref = materialize(doc_id, worker)
+    with open(path, "rb") as f:
+        assert f.read() == CONTENT
+    assert worker.refcount(doc_id) == 1
+    worker.release(doc_id, ref)
+
+    # A hit is served from the node without asking the transport
+    transport.fetch = lambda doc_id, dest: pytest.fail("fetched a document already on the node")
+    path, ref = materialize(doc_id, worker)
+    assert path == worker.path(doc_id) and worker.refcount(doc_id) == 1
+
+
+def test_materialize_rejects_a_blob_that_does_not_match_its_hash(tmp_path, transport):
+    worker = _node(tmp_path, "worker")
+    tampered = tmp_path / "tampered.pdf"
+    tampered.write_bytes(CONTENT + b"tampered")
+    transport.blobs.put_file(DOC_ID, str(tampered))
+    with pytest.raises(ValueError):
+        materialize(DOC_ID, worker)
+    assert not os.path.exists(worker.path(DOC_ID))
+    assert worker.refcount(DOC_ID) == 0
+    assert not [name for name in os.listdir(worker.objects_dir) if name.endswith(".tmp")]
+
+
+def test_materialize_of_an_unpublished_document_fails_cleanly(tmp_path, transport):
+    worker = _node(tmp_path, "worker")
+    with pytest.raises(FileNotFoundError):
+        materialize(DOC_ID, worker)
+    assert worker.refcount(DOC_ID) == 0
+
+
+def test_expired_blobs_are_swept_and_old_ones_republished(tmp_path, transport):
+    source = tmp_path / "filing.pdf"
+    source.write_bytes(CONTENT)
+    transport.publish(DOC_ID, str(source))
+    blob = transport.blobs._path(DOC_ID)
+    os.utime(blob, (0, 0))
+    # Past half its TTL: written again instead of reused
+    transport.publish(DOC_ID, str(source))
+    assert transport.blobs.age(DOC_ID) < 60
+
+    os.utime(blob, (0, 0))
+    transport.put_record("0" * 32, {"content_hash": DOC_ID})
+    assert transport.sweep(force=True) == 1
+    assert transport.blobs.age(DOC_ID) is None
+    assert transport.get_record("0" * 32) == {"content_hash": DOC_ID}
+
+
+def test_upload_completed_on_one_node_resolves_on_another(tmp_path, transport):
+    first, second = UploadSessions(_node(tmp_path, "api-1")), UploadSessions(_node(tmp_path, "api-2"))
+    upload_id = first.create("filing.pdf", len(CONTENT))["upload_id"]
+
+    async def stream():
+        yield CONTENT
+    asyncio.run(first.receive_chunk(upload_id, 0, stream()))
+
+    # Chunks only reach the node that holds the session
+    with pytest.raises(UploadError) as error:
+        asyncio.run(second.receive_chunk(upload_id, 0, stream()))
+    assert error.value.status == 404
+
+    assert first.complete(upload_id)["content_hash"] == DOC_ID
+    assert second.status(upload_id)["completed"] is True
+    assert second.complete(upload_id)["content_hash"] == DOC_ID
+    assert second.document(upload_id) == (DOC_ID, "filing.pdf")
+    with open(second.store.path(DOC_ID), "rb") as f:
+        assert f.read() == CONTENT
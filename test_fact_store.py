@@ -0,0 +1,86 @@
+"""Figure parsing and period attribution in fact_store"""
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from fact_store import iter_facts, find_periods, FactTable, FACT_DTYPE  # noqa: E402
+
+
+def _facts(pages, default_period=""):
+    return list(iter_facts(pages, default_period))
+
+
+def _table(pages, default_period=""):
+    return FactTable(np.array(_facts(pages, default_period), dtype=FACT_DTYPE), len(pages))
+
+
+def test_scale_words_parentheses_and_percentages():
+    facts = _facts(["Total revenue was $1.2 billion, net loss ($45 million) and gross margin 17.2%"])
+    values = {(metric, unit): value for _, _, _, metric, _, _, value, unit, _ in facts}
+    assert values[("revenue", "currency")] == pytest.approx(1.2e9)
+    assert values[("net_income", "currency")] == pytest.approx(-45e6)
+    assert values[("gross_margin", "percent")] == pytest.approx(17.2)
+
+
+def test_table_note_scales_amounts_but_not_per_share():
+    page = ("($ in millions, except per share data)\n"
+            "Q2-2025 Q2-2024\n"
+            "Total revenues 22,496 25,500\n"
+            "Diluted EPS 0.33 0.42")
+    facts = _facts([page])
+    revenue = [(period, value) for _, _, _, metric, _, period, value, _, _ in facts if metric == "revenue"]
+    eps = [value for _, _, _, metric, _, _, value, _, _ in facts if metric == "eps"]
+    assert revenue == [("Q2-2025", pytest.approx(22496e6)), ("Q2-2024", pytest.approx(25500e6))]
+    assert eps == [pytest.approx(0.33), pytest.approx(0.42)]
+
+
+def test_header_periods_end_with_the_table():
+    page = ("Q2-2025 Q2-2024\n"
+            "Total revenues 22,496 25,500\n"
+            "\n"
+            "Free cash flow 146 1,340")
+    facts = _facts([page], default_period="FY2025")
+    periods = {metric: period for _, _, column, metric, _, period, _, _, _ in facts if column == 0}
+    assert periods["revenue"] == "Q2-2025"
+    # After the blank line the figures are no longer under the table's column headers
+    assert periods["free_cash_flow"] == "FY2025"
+
+
+def test_prose_line_resets_header_periods():
+    page = ("2025 2024\n"
+            "Total revenues 22,496 25,500\n"
+            "Management expects that operating income will improve as the new factories ramp up output "
+            "to 1,200 units per week.\n"
+            "Net income 1,172 1,400")
+    facts = _facts([page])
+    net_income = [period for _, _, _, metric, _, period, _, _, _ in facts if metric == "net_income"]
+    assert net_income == ["", ""]
+
+
+def test_decreases_are_negative_changes_but_levels_are_not():
+    facts = _facts(["Revenue down 12% while gross margin declined by 1.5 percent and operating margin fell to 9%; "
+                    "net income 4% lower, free cash flow up 7%"])
+    values = [value for _, _, _, _, _, _, value, unit, _ in facts if unit == "percent"]
+    assert values == [pytest.approx(-12.0), pytest.approx(-1.5), pytest.approx(9.0), pytest.approx(-4.0),
+                      pytest.approx(7.0)]
+
+
+def test_find_periods_normalizes_spellings():
+    assert find_periods("Three months ended June 30, 2025 and Q2 2024") == ["Q2-2025", "Q2-2024"]
+    assert find_periods("second quarter of 2025 vs fiscal year 2024") == ["Q2-2025", "FY2024"]
+    assert find_periods("Nine months ended September 30, 2025") == ["9M-2025"]
+
+
+def test_by_period_keeps_one_unit_and_currency():
+    pages = [
+        "Q2-2025 revenue $25.5 billion",
+        "Q2-2025 revenue €3.1 billion",
+        "Q2-2025 revenue down 12%",
+        "Q1-2025 revenue $19.3 billion",
+    ]
+    table = _table(pages)
+    assert table.by_period("revenue") == {"Q1-2025": [pytest.approx(19.3e9)], "Q2-2025": [pytest.approx(25.5e9)]}
+    assert table.by_period("revenue", currency="EUR") == {"Q2-2025": [pytest.approx(3.1e9)]}
+    assert table.by_period("revenue", unit="percent") == {"Q2-2025": [pytest.approx(-12.0)]}
+    latest = table.latest()["revenue"]
+    assert (latest["period"], latest["currency"]) == ("Q2-2025", "USD")
@@ -0,0 +1,64 @@
+"""Chunking, page diffs and carry-over for incremental re-analysis"""
+from ingestion import build_chunks, diff_pages, hash_page
+from incremental import summarize_chunks, seed_chunk_summaries, carry_over, extract_chunk_summary, TASK_NAMES
+
+PAGES = [f"Page {number}\nSegment revenue {number},000\nNarrative text for page {number}." for number in range(1, 13)]
+
+
+def test_chunks_cover_every_page_once_and_are_content_defined():
+    chunks = build_chunks(PAGES, chunk_pages=3)
+    covered = [page for chunk in chunks for page in range(chunk["start_page"], chunk["end_page"] + 1)]
+    assert covered == list(range(1, len(PAGES) + 1))
+    assert all(chunk["end_page"] - chunk["start_page"] < 6 for chunk in chunks)
+    assert [chunk["hash"] for chunk in build_chunks(PAGES, chunk_pages=3)] == [chunk["hash"] for chunk in chunks]
+
+
+def test_diff_pages_reports_new_and_edited_pages():
+    amended = PAGES[:4] + ["Page 5\nSegment revenue 5,500\nRestated."] + PAGES[5:] + ["Page 13\nNew note."]
+    previous = [hash_page(text) for text in PAGES]
+    assert diff_pages(previous, [hash_page(text) for text in amended]) == [5, 13]
+    assert diff_pages(None, [hash_page(PAGES[0])]) == [1]
+
+
+def test_seed_summaries_keep_figure_lines():
+    seeds = seed_chunk_summaries(PAGES)
+    assert set(seeds) == {chunk["hash"] for chunk in build_chunks(PAGES)}
+    assert extract_chunk_summary({"text": "OVERVIEW\nSome prose.\nRevenue 1,200 million"}) == "OVERVIEW\nRevenue 1,200 million"
+
+
+def test_only_chunks_with_changed_pages_are_resummarized():
+    chunks = build_chunks(PAGES, chunk_pages=3)
+    cached = {chunk["hash"]: f"cached {chunk['index']}" for chunk in chunks}
+    target = chunks[-1]
+    summarized = []
+
+    def summarize(chunk):
+        summarized.append(chunk["index"])
+        return "fresh"
+
+    summaries, changed, sections = summarize_chunks(chunks, [target["end_page"]], cached, summarize=summarize)
+    assert summarized == changed == [target["index"]]
+    assert summaries[target["hash"]] == "fresh"
+    assert [section for section in sections if "[CHANGED]" in section] == [sections[-1]]
+    assert all(summaries[chunk["hash"]] == f"cached {chunk['index']}" for chunk in chunks[:-1])
+
+    # Nothing changed: no LLM call and no marker
+    _, changed, sections = summarize_chunks(chunks, [], cached, summarize=summarize)
+    assert changed == [] and not any("[CHANGED]" in section for section in sections)
+
+
+def test_rating_outputs_are_dropped_when_a_chunk_changed():
+    previous = {"_id": "a1", "task_outputs": {name: f"old {name}" for name in TASK_NAMES},
+                "structured": {name: {"old": name} for name in TASK_NAMES}}
+    task_outputs, structured, carried_over = carry_over(previous, changed=True)
+    assert set(task_outputs) == set(structured) == {"verification"}
+    assert carried_over == {"verification": "a1"}
+
+    task_outputs, _, carried_over = carry_over(previous, changed=False)
+    assert set(task_outputs) == {"verification", "investment_analysis", "risk_assessment"}
+    assert set(carried_over.values()) == {"a1"}
+
+
+def test_carried_over_follows_earlier_amendments():
+    amendment = {"_id": "a2", "task_outputs": {"verification": "old"}, "carried_over": {"verification": "a1"}}
+    assert carry_over(amendment, changed=True)[2] == {"verification": "a1"}
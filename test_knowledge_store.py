@@ -0,0 +1,48 @@
+"""Company knowledge store: tagging, lookup and freshness"""
+import time
+
+import pytest
+
+import knowledge_store
+from knowledge_store import KnowledgeStore, format_knowledge
+
+
+@pytest.fixture
+def store(tmp_path):
+    return KnowledgeStore(str(tmp_path / "knowledge.db"))
+
+
+def test_search_tagged_with_the_run_subject_is_found_by_lookup(store):
+    # A fresh store knows no companies, so the query alone would be saved untagged
+    store.put_search("electric vehicle deliveries outlook", ["result"], company="Tesla, Inc.", period="Q2 2025")
+    knowledge = store.lookup("TESLA", "Q2-2025")
+    assert [search["query"] for search in knowledge["searches"]] == ["electric vehicle deliveries outlook"]
+    assert knowledge["searches"][0]["period"] == "Q2-2025"
+
+
+def test_untagged_search_falls_back_to_known_companies(store):
+    store.put_search("ev market share", ["untagged"])
+    store.add_fact("Tesla Inc", "FY2024", "Revenue 97.7bn")
+    store.put_search("Tesla FY2024 guidance", ["tagged"])
+    assert [search["query"] for search in store.lookup("Tesla")["searches"]] == ["Tesla FY2024 guidance"]
+
+
+def test_repeated_search_is_served_in_any_word_order(store):
+    store.put_search("Tesla margin Q2 2025", ["cached"])
+    assert store.get_search("q2 2025 MARGIN tesla") == ["cached"]
+    assert store.get_search("Tesla margin Q3 2025") is None
+
+
+def test_stale_searches_and_facts_are_not_served(store, monkeypatch):
+    store.put_search("Tesla guidance", ["old"], company="Tesla", period="FY2024")
+    store.add_fact("Tesla", "FY2024", "Guidance withdrawn")
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + knowledge_store.KNOWLEDGE_SEARCH_TTL_SECONDS + 1)
+    assert store.get_search("Tesla guidance") is None
+    knowledge = store.lookup("Tesla", "FY2024")
+    assert knowledge["searches"] == [] and [fact["fact"] for fact in knowledge["facts"]] == ["Guidance withdrawn"]
+
+    monkeypatch.setattr(time, "time", lambda: now + knowledge_store.KNOWLEDGE_FACT_TTL_SECONDS + 1)
+    knowledge = store.lookup("Tesla", "FY2024")
+    assert knowledge["facts"] == []
+    assert format_knowledge(knowledge).startswith("No stored knowledge for TESLA FY2024")
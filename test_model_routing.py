@@ -0,0 +1,95 @@
+"""The local verification tier and the shared LLM response cache in model_routing"""
+import pytest
+
+pytest.importorskip("langchain_core")
+
+from langchain_core.messages import AIMessage, HumanMessage  # noqa: E402
+
+import ingestion  # noqa: E402
+import model_routing  # noqa: E402
+from schemas import VerificationReport  # noqa: E402
+from shared_cache import SharedCache, SQLiteCache  # noqa: E402
+from structured_output import parse_structured  # noqa: E402
+
+PAGES = [
+    "Quarterly report. Table of contents: income statement, balance sheet, cash flow",
+    "Consolidated income statement\nTotal revenue 25,500 22,496\nOperating income 923 2,688\n"
+    "Net income 1,172 1,400\nEarnings per share 0.33 0.42\nGross margin 17.2% 18.0%",
+    "Consolidated balance sheet\nTotal assets 128,567 122,070\nTotal liabilities 50,535 48,390\n"
+    "Shareholders' equity 77,314 72,913\nCash and cash equivalents 15,587 16,139",
+    "Consolidated statement of cash flows\nOperating cash flow 2,540 1,255\nCapital expenditures 2,394 2,777\n"
+    "Free cash flow 146 -1,522 Dividends 0 Debt 7,167 EBITDA 3,400 Revenue guidance",
+]
+
+
+def test_local_verification_answer_validates_as_report(tmp_path, monkeypatch):
+    path = tmp_path / "quarterly-update.pdf"
+    path.write_bytes(b"%PDF-1.4\n")
+    monkeypatch.setattr(ingestion, "get_pages", lambda file_path, *args, **kwargs: PAGES)
+
+    answer = model_routing.local_verification_answer(f"Verify the document at path: '{path}'")
+
+    assert answer is not None and "Final Answer:" in answer
+    report = parse_structured(answer, VerificationReport)
+    assert isinstance(report, VerificationReport)
+    assert len(report.statements_present) >= 2
+    assert report.confidence in ("Medium", "High")
+
+
+def test_local_verification_answer_declines_unknown_file():
+    assert model_routing.local_verification_answer("Verify the document at path: '/missing/file.pdf'") is None
+
+
+class _PassThroughClient:
+    def call(self, fn, *args, hedge=None, timeout_kwargs=None, **kwargs):
+        return fn(*args, **kwargs, **timeout_kwargs(30.0))
+
+
+class _CountingModel:
+    def __init__(self, message):
+        self.message = message
+        self.calls = 0
+
+    def invoke(self, messages, stop=None, timeout=None):
+        assert timeout == 30.0
+        self.calls += 1
+        return self.message
+
+
+@pytest.fixture
+def cached_llm(tmp_path, monkeypatch):
+    cache = SharedCache(SQLiteCache(str(tmp_path / "cache.db")))
+    monkeypatch.setattr(model_routing, "get_shared_cache", lambda: cache)
+    monkeypatch.setattr(model_routing, "get_client", lambda model_name: _PassThroughClient())
+    monkeypatch.setattr(model_routing, "LLM_CACHE_TTL_SECONDS", 60)
+
+    def invoke(message):
+        model = _CountingModel(message)
+        routed = model_routing.RoutedChatModel(agent="financial_analyst", primary=model, primary_model="test/model")
+        usage = model_routing.ModelUsage()
+        token = model_routing.current_usage.set(usage)
+        try:
+            first = routed._invoke(model, "test/model", [HumanMessage(content="Summarize page 3")], None)
+            second = routed._invoke(model, "test/model", [HumanMessage(content="Summarize page 3")], None)
+        finally:
+            model_routing.current_usage.reset(token)
+        return model, usage, first, second
+    return invoke
+
+
+def test_cache_hit_is_recorded_as_a_zero_cost_call(cached_llm):
+    model, usage, first, second = cached_llm(AIMessage(content="Revenue grew 13%."))
+    assert model.calls == 1
+    assert second.content == first.content
+    entry = usage.summary()["models"]["test/model"]
+    assert (entry["calls"], entry["cached_calls"]) == (2, 1)
+
+
+def test_cache_keeps_tool_calls_and_metadata(cached_llm):
+    message = AIMessage(content="", tool_calls=[{"name": "search_tool", "args": {"query": "TSLA Q2"}, "id": "call-1"}],
+                        response_metadata={"finish_reason": "tool_calls"})
+    model, _, _, second = cached_llm(message)
+    assert model.calls == 1
+    assert [call["name"] for call in second.tool_calls] == ["search_tool"]
+    assert second.tool_calls[0]["args"] == {"query": "TSLA Q2"}
+    assert second.response_metadata["finish_reason"] == "tool_calls"
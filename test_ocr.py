@@ -0,0 +1,77 @@
+"""OCR fallback: page fingerprints and the on-disk cache"""
+import pytest
+
+pypdf = pytest.importorskip("pypdf")
+
+import ocr
+from telemetry import registry
+
+
+def _write_pdf(path, sizes, rotate=None):
+    writer = pypdf.PdfWriter()
+    for width, height in sizes:
+        writer.add_blank_page(width=width, height=height)
+    if rotate is not None:
+        writer.pages[0].rotate(rotate)
+    with open(path, "wb") as f:
+        writer.write(f)
+    return str(path)
+
+
+def _fingerprint(path):
+    return ocr.page_fingerprint(pypdf.PdfReader(path).pages[0])
+
+
+@pytest.fixture
+def fake_ocr(tmp_path, monkeypatch):
+    """Recognize pages without pdfium or Tesseract, recording which ones were rendered"""
+    calls = []
+
+    def recognize(file_path, index, dpi=ocr.OCR_DPI, lang=ocr.OCR_LANG, lock=None):
+        calls.append(index)
+        if index == 2:
+            raise RuntimeError("tesseract crashed")
+        return f"recognized page {index + 1}"
+
+    monkeypatch.setattr(ocr, "OCR_CACHE_DIR", str(tmp_path / "ocr_cache"))
+    monkeypatch.setattr(ocr, "_available", True)
+    # Thread fallback: a spawned process pool would not see the patched _ocr_page
+    monkeypatch.setattr(ocr, "_get_pool", lambda: None)
+    monkeypatch.setattr(ocr, "_ocr_page", recognize)
+    return calls
+
+
+def test_rotation_and_page_box_change_the_fingerprint(tmp_path):
+    plain = _fingerprint(_write_pdf(tmp_path / "plain.pdf", [(612, 792)]))
+    assert _fingerprint(_write_pdf(tmp_path / "copy.pdf", [(612, 792)])) == plain
+    assert _fingerprint(_write_pdf(tmp_path / "rotated.pdf", [(612, 792)], rotate=90)) != plain
+    assert _fingerprint(_write_pdf(tmp_path / "a4.pdf", [(595, 842)])) != plain
+
+
+def test_scanned_pages_are_recognized_once_and_then_served_from_cache(tmp_path, fake_ocr):
+    path = _write_pdf(tmp_path / "scan.pdf", [(612, 792), (600, 800), (590, 790)])
+    pages = ["", "A page with a real text layer", ""]
+
+    first = ocr.fill_scanned_pages(path, pages)
+    assert first == ["recognized page 1", "A page with a real text layer", ""]
+    assert sorted(fake_ocr) == [0, 2]
+
+    fake_ocr.clear()
+    second = ocr.fill_scanned_pages(path, pages)
+    assert second == first
+    # Page 1 comes from the cache; the failed page was not cached and is tried again
+    assert fake_ocr == [2]
+
+
+def _failures():
+    for line in registry.render().splitlines():
+        if line.startswith("analyzer_ocr_failures_total "):
+            return float(line.split()[1])
+    return 0.0
+
+
+def test_failed_pages_are_counted(tmp_path, fake_ocr):
+    path = _write_pdf(tmp_path / "scan.pdf", [(612, 792), (600, 800), (590, 790)])
+    before = _failures()
+    assert ocr.ocr_pages(path, [2]) == {}
+    assert _failures() == before + 1
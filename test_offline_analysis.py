@@ -0,0 +1,88 @@
+"""Deterministic offline analysis (offline_analysis.analyze_pages)"""
+import math
+
+from offline_analysis import analyze_pages, build_series, compute_ratios, data_quality, red_flags, render_text, STATEMENTS
+from fact_store import iter_facts
+
+PAGES = [
+    "Synthetic Corp Q2 2025 Update",
+    "Consolidated income statement ($ in millions)\n"
+    "Q2-2024 Q2-2025\n"
+    "Total revenues 20,000 22,000\n"
+    "Gross profit 5,000 5,280\n"
+    "Income from operations 2,000 1,980\n"
+    "Net income 1,500 1,430",
+    "Consolidated balance sheet ($ in millions)\n"
+    "Q2-2024 Q2-2025\n"
+    "Total current assets 30,000 33,000\n"
+    "Total current liabilities 20,000 21,000\n"
+    "Total liabilities 40,000 42,000\n"
+    "Total stockholders' equity 60,000 64,000",
+    "Consolidated statement of cash flows ($ in millions)\n"
+    "Q2-2024 Q2-2025\n"
+    "Net cash provided by operating activities 2,500 2,700\n"
+    "Capital expenditures (1,800) (2,000)",
+]
+
+
+def test_series_and_ratios_follow_the_statements():
+    periods, series = build_series(list(iter_facts(PAGES)))
+    assert periods == ["Q2-2024", "Q2-2025"]
+    assert series["revenue"] == [20000e6, 22000e6]
+    ratios = compute_ratios(periods, series)
+    assert math.isclose(ratios["net_margin"][1], 1430 / 22000 * 100)
+    assert math.isclose(ratios["current_ratio"][1], 33000 / 21000)
+    assert math.isclose(ratios["free_cash_flow"][1], 700e6)
+
+
+def test_analysis_is_deterministic_and_complete():
+    first, second = analyze_pages(PAGES, "synthetic-q2-2025.pdf"), analyze_pages(PAGES, "synthetic-q2-2025.pdf")
+    first.pop("elapsed_ms"), second.pop("elapsed_ms")
+    assert first == second
+    metrics = first["financial_analysis"]["key_metrics"]
+    assert metrics["latest_period"] == "Q2-2025"
+    assert metrics["revenue_growth"].startswith("10.0% YoY")
+    verification = first["document_verification"]
+    assert all(verification["statements_found"].values())
+    assert verification["data_quality"] == "High"
+    assert set(render_text(analyze_pages(PAGES))) == {
+        "financial_summary", "key_metrics", "risk_assessment", "investment_recommendations", "document_verification"}
+
+
+def test_data_quality_ignores_unusable_figures():
+    # Plenty of figures, but none that form a statement or a ratio
+    pages = ["\n".join(f"Segment {i} units shipped 1,{i:03d}" for i in range(60))]
+    verification = analyze_pages(pages)["document_verification"]
+    assert verification["figures_extracted"] >= 20
+    assert verification["ratios_computed"] == []
+    assert verification["data_quality"] == "Low"
+
+
+def test_data_quality_grades():
+    assert data_quality(list(STATEMENTS), ["a", "b", "c", "d", "e"]) == "High"
+    assert data_quality(["income statement"], ["net_margin", "gross_margin"]) == "Medium"
+    assert data_quality([], ["net_margin", "gross_margin", "operating_margin"]) == "Low"
+
+
+def test_negated_boilerplate_is_not_a_red_flag():
+    boilerplate = ("We are not in default under any covenant. There is no substantial doubt about our ability to "
+                   "continue as a going concern. We test goodwill for impairment annually, and no material weakness "
+                   "was identified.")
+    assert red_flags(boilerplate) == []
+    analysis = analyze_pages(PAGES + [boilerplate])
+    assert analysis["financial_analysis"]["risk_assessment"] == analyze_pages(PAGES)["financial_analysis"][
+        "risk_assessment"]
+    assert analysis["financial_analysis"]["risk_flags"] == analyze_pages(PAGES)["financial_analysis"]["risk_flags"]
+
+
+def test_affirmative_red_flags_are_reported_but_not_rated():
+    text = ("These conditions raise substantial doubt about the Company's ability to continue as a going concern. "
+            "We are in default under our revolving credit facility.")
+    assert red_flags(text) == [("credit_risk", "Auditor or management going-concern doubt"),
+                               ("credit_risk", "Debt default")]
+    analysis = analyze_pages(PAGES + [text])["financial_analysis"]
+    baseline = analyze_pages(PAGES)["financial_analysis"]
+    assert {flag["message"] for flag in analysis["risk_flags"] if not flag["rated"]} == {
+        "Auditor or management going-concern doubt", "Debt default"}
+    assert analysis["risk_assessment"] == baseline["risk_assessment"]
+    assert analysis["investment_recommendation"]["rating"] == baseline["investment_recommendation"]["rating"]
@@ -0,0 +1,126 @@
+"""Circuit breaker and retry behaviour of resilient_llm.ResilientClient"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from resilient_llm import (CircuitOpenError, LLMCallNotStarted, LLMDeadlineExceeded, ResilienceConfig, ResilientClient,
+                           size_executor, THREADS_PER_RUN)
+from run_control import RunCancelled
+
+
+def _client(reset_timeout=0.0):
+    config = ResilienceConfig(timeout=5, max_retries=0, failure_threshold=1, reset_timeout=reset_timeout)
+    return ResilientClient("test", config)
+
+
+def _fail(error):
+    def call():
+        raise error
+    return call
+
+
+def _trip(client):
+    with pytest.raises(TimeoutError):
+        client.call(_fail(TimeoutError("provider timed out")))
+    assert client.breaker.state == "open"
+
+
+def test_open_breaker_rejects_calls():
+    client = _client(reset_timeout=60)
+    _trip(client)
+    with pytest.raises(CircuitOpenError):
+        client.call(lambda: "ok")
+
+
+def test_successful_probe_closes_breaker():
+    client = _client()
+    _trip(client)
+    assert client.call(lambda: "ok") == "ok"
+    assert client.breaker.state == "closed"
+
+
+def test_non_retryable_probe_reopens_breaker():
+    client = _client()
+    _trip(client)
+    with pytest.raises(ValueError):
+        client.call(_fail(ValueError("bad request")))
+    assert client.breaker.state == "open"
+    # The next probe is let through after the reset timeout instead of being rejected forever
+    assert client.call(lambda: "ok") == "ok"
+    assert client.breaker.state == "closed"
+
+
+def test_cancelled_probe_reopens_breaker():
+    client = _client()
+    _trip(client)
+    with pytest.raises(RunCancelled):
+        client.call(_fail(RunCancelled("deadline")))
+    assert client.breaker.state == "open"
+    assert client.call(lambda: "ok") == "ok"
+
+
+def test_non_retryable_error_leaves_closed_breaker_alone():
+    client = _client()
+    with pytest.raises(ValueError):
+        client.call(_fail(ValueError("bad request")))
+    assert client.breaker.state == "closed"
+    assert client.breaker.failures == 0
+
+
+def test_retryable_error_is_retried():
+    config = ResilienceConfig(timeout=5, max_retries=2, backoff_base=0, backoff_max=0, failure_threshold=5)
+    client = ResilientClient("test", config)
+    attempts = []
+
+    def flaky():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise ConnectionError("reset")
+        return "ok"
+
+    assert client.call(flaky) == "ok"
+    assert len(attempts) == 3
+
+
+def test_request_timeout_is_the_time_left():
+    client = _client()
+    seen = []
+    assert client.call(lambda timeout: seen.append(timeout) or "ok", timeout_kwargs=lambda s: {"timeout": s}) == "ok"
+    assert 4 < seen[0] <= 5
+
+
+def test_call_that_never_got_a_thread_is_not_a_provider_failure():
+    executor = ThreadPoolExecutor(max_workers=1)
+    release = threading.Event()
+    executor.submit(release.wait, 5)
+    config = ResilienceConfig(timeout=0.2, max_retries=0, failure_threshold=1)
+    client = ResilientClient("test", config, executor=executor)
+    sent = []
+    try:
+        with pytest.raises(LLMCallNotStarted):
+            client.call(lambda: sent.append(1))
+        assert client.breaker.state == "closed" and client.breaker.failures == 0
+    finally:
+        release.set()
+        executor.shutdown(wait=True)
+    # Cancelled while queued, so it never reaches the provider after the caller gave up
+    assert sent == []
+
+
+def test_provider_timeout_still_trips_the_breaker():
+    config = ResilienceConfig(timeout=0.1, max_retries=0, failure_threshold=1)
+    client = ResilientClient("test", config)
+    release = threading.Event()
+    with pytest.raises(LLMDeadlineExceeded) as error:
+        client.call(release.wait, 5)
+    release.set()
+    assert error.value.reached_provider
+    assert client.breaker.state == "open"
+
+
+def test_executor_is_sized_from_concurrency(monkeypatch):
+    monkeypatch.delenv("LLM_CLIENT_THREADS", raising=False)
+    assert size_executor(16) == 16 * THREADS_PER_RUN
+    monkeypatch.setenv("LLM_CLIENT_THREADS", "12")
+    assert size_executor(16) == 12
@@ -27,7 +27,7 @@ def test_imports():
         print("✓ PDF processing imports successful")
         
         # Test our modules
-        from tools import search_tool, financial_document_tool, investment_analysis_tool, risk_assessment_tool
+        from tools import search_tool, financial_document_tools, investment_analysis_tool, risk_assessment_tool
         print("✓ Tools module imports successful")
         
         from agents import financial_analyst, verifier, investment_advisor, risk_assessor
@@ -75,7 +75,7 @@ def test_tools():
     print("\nTesting tools...")
     
     try:
-        from tools import financial_document_tool, investment_analysis_tool, risk_assessment_tool
+        from tools import financial_document_tools, investment_analysis_tool, risk_assessment_tool
         
         # Test tool instantiation
         print("✓ Tools instantiated successfully")
@@ -0,0 +1,71 @@
+"""Prometheus registry exposition and crew task timing"""
+import pytest
+
+import telemetry
+from telemetry import MetricsRegistry, CrewTaskTimer, DURATION_BUCKETS, current_task
+
+
+def test_counters_and_gauges_render_with_help_and_type():
+    registry = MetricsRegistry()
+    registry.describe("jobs_total", "counter", "Jobs run")
+    registry.inc("jobs_total", labels={"queue": "llm"})
+    registry.inc("jobs_total", 2, labels={"queue": "llm"})
+    registry.set("queue_depth", 4)
+    lines = registry.render().splitlines()
+    assert lines[:3] == ["# HELP jobs_total Jobs run", "# TYPE jobs_total counter", 'jobs_total{queue="llm"} 3.0']
+    # Undescribed metrics still get a HELP line, named after themselves
+    assert lines[3:] == ["# HELP queue_depth queue_depth", "# TYPE queue_depth gauge", "queue_depth 4"]
+
+
+def test_histogram_buckets_are_cumulative_and_end_with_inf():
+    registry = MetricsRegistry()
+    registry.observe("wait_seconds", 0.02, {"queue": "celery"})
+    registry.observe("wait_seconds", 7, {"queue": "celery"})
+    lines = registry.render().splitlines()
+    assert lines[1] == "# TYPE wait_seconds histogram"
+    buckets = [line for line in lines if line.startswith("wait_seconds_bucket")]
+    assert len(buckets) == len(DURATION_BUCKETS) + 1
+    assert 'wait_seconds_bucket{queue="celery",le="0.01"} 0' in buckets
+    assert 'wait_seconds_bucket{queue="celery",le="0.05"} 1' in buckets
+    assert 'wait_seconds_bucket{queue="celery",le="10"} 2' in buckets
+    assert buckets[-1] == 'wait_seconds_bucket{queue="celery",le="+Inf"} 2'
+    assert 'wait_seconds_sum{queue="celery"} 7.02' in lines
+    assert 'wait_seconds_count{queue="celery"} 2' in lines
+
+
+def test_label_values_and_help_text_are_escaped():
+    registry = MetricsRegistry()
+    registry.describe("errors_total", "counter", "Errors by stage\nincluding C:\\paths")
+    registry.inc("errors_total", labels={"stage": 'tool "search"\\web\nretry'})
+    lines = registry.render().splitlines()
+    assert lines[0] == "# HELP errors_total Errors by stage\\nincluding C:\\\\paths"
+    assert lines[2] == 'errors_total{stage="tool \\"search\\"\\\\web\\nretry"} 1.0'
+
+
+def test_failed_stage_is_counted_and_timed(monkeypatch):
+    registry = MetricsRegistry()
+    monkeypatch.setattr(telemetry, "registry", registry)
+    with pytest.raises(ValueError):
+        with telemetry.stage("pdf.parse"):
+            raise ValueError("broken")
+    rendered = registry.render()
+    assert 'analyzer_stage_errors_total{stage="pdf.parse"} 1.0' in rendered
+    assert 'analyzer_stage_duration_seconds_count{stage="pdf.parse"} 1' in rendered
+
+
+def test_crew_task_timer_names_sequential_tasks(monkeypatch):
+    spans = []
+    monkeypatch.setattr(telemetry, "record_span", lambda name, start, end, **attributes: spans.append((name, start, end)))
+    clock = iter([100, 250, 400, 500])
+    monkeypatch.setattr(telemetry.time, "time_ns", lambda: next(clock))
+
+    timer = CrewTaskTimer(["verification", "analyze_financial_document"])
+    assert current_task.get() == "verification"
+    timer(object())
+    assert current_task.get() == "analyze_financial_document"
+    timer(object())
+    assert current_task.get() is None
+    # A task beyond the configured list (e.g. a manager step) still gets a span
+    timer(object())
+    assert spans == [("crew.task.verification", 100, 250), ("crew.task.analyze_financial_document", 250, 400),
+                     ("crew.task.task_2", 400, 500)]
@@ -0,0 +1,54 @@
+"""Task output compaction and the crew task_callback order"""
+from types import SimpleNamespace
+
+from token_budget import TokenBudget, chain_task_callbacks, compact, count_tokens, COMPACT_CONTEXT_TOKENS
+
+NARRATIVE = [f"Paragraph {index} retells the company history and its founders in general terms." for index in range(400)]
+OUTPUT = "\n".join([
+    "## Verification",
+    "Revenue was $25.5 billion, up 12% year over year.",
+    "Liquidity risk is limited given cash of $36.8 billion.",
+    *NARRATIVE,
+    "Overall confidence in the figures: high. Recommendation: HOLD.",
+])
+
+
+def test_compaction_keeps_conclusions_figures_and_risks_within_budget():
+    summary = compact(OUTPUT)
+    assert count_tokens(OUTPUT) > COMPACT_CONTEXT_TOKENS
+    assert count_tokens(summary) <= COMPACT_CONTEXT_TOKENS
+    assert summary.splitlines() == [
+        "[Compacted summary]",
+        "Conclusions:",
+        "- Overall confidence in the figures: high. Recommendation: HOLD.",
+        "Key figures:",
+        "- Revenue was $25.5 billion, up 12% year over year.",
+        "- Liquidity risk is limited given cash of $36.8 billion.",
+        "Structure:",
+        "- ## Verification",
+    ]
+    assert compact("Short output") == "Short output"
+
+
+def test_budget_compacts_context_outputs_but_not_the_final_answer():
+    budget = TokenBudget(["verification", "analyze_financial_document"])
+    verification, final = SimpleNamespace(raw=OUTPUT), SimpleNamespace(raw=OUTPUT)
+    budget(verification)
+    budget(final)
+    assert verification.raw == compact(OUTPUT)
+    assert budget.originals == {"verification": OUTPUT}
+    assert budget.saved_tokens == count_tokens(OUTPUT) - count_tokens(verification.raw)
+    assert final.raw == OUTPUT
+
+
+def test_observers_see_the_full_output_before_the_budget_compacts_it():
+    budget = TokenBudget(["verification", "analyze_financial_document"])
+    seen = []
+    timer = lambda task_output: seen.append(("timer", task_output.raw))
+    structured = lambda task_output: seen.append(("structured", task_output.raw))
+    on_task_done = chain_task_callbacks(budget, timer, None, structured)
+
+    task_output = SimpleNamespace(raw=OUTPUT)
+    on_task_done(task_output)
+    assert seen == [("timer", OUTPUT), ("structured", OUTPUT)]
+    assert task_output.raw.startswith("[Compacted summary]")
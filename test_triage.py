@@ -0,0 +1,95 @@
+"""Pre-flight triage decisions"""
+import pytest
+
+pytest.importorskip("pypdf")
+
+import ocr
+from triage import triage_document, content_hash
+
+FINANCIAL_PAGE = ("Quarterly report for the quarterly period ended June 30, 2025. Revenue grew and net income "
+                  "rose on higher gross margin. Operating income, total assets and free cash flow are shown in "
+                  "the balance sheet and income statement below. The board kept its guidance for the fiscal year.")
+OTHER_PAGE = ("The hiking trail climbs through pine forest to a quiet lake where visitors can swim, picnic and "
+              "watch the sunset over the ridge. Bring water, a map and sturdy shoes, and leave no trace behind "
+              "when you head back down the valley toward the village.")
+
+
+def _pdf(pages: list) -> bytes:
+    """A minimal PDF with one line-wrapped Helvetica text block per page"""
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None,
+               "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for text in pages:
+        lines = [text[start:start + 80] for start in range(0, len(text), 80)] or [""]
+        stream = "BT /F1 10 Tf 40 750 Td 12 TL " + " ".join(f"({line}) Tj T*" for line in lines) + " ET"
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+                       f"/Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects)} 0 R >>")
+        kids.append(f"{len(objects)} 0 R")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(kids)} >>"
+
+    body, offsets = b"%PDF-1.4\n", []
+    for number, obj in enumerate(objects, start=1):
+        offsets.append(len(body))
+        body += f"{number} 0 obj\n{obj}\nendobj\n".encode("latin-1")
+    xref = len(body)
+    body += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    body += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode()
+    body += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    return body
+
+
+@pytest.fixture(autouse=True)
+def no_ocr(monkeypatch):
+    monkeypatch.setattr(ocr, "_available", False)
+
+
+def test_non_pdf_and_textless_documents_are_rejected():
+    assert triage_document(b"just some text", "notes.txt")["decision"] == "reject"
+    blank = triage_document(_pdf(["", ""]), "scan.pdf")
+    assert blank["decision"] == "reject" and "little or no extractable text" in blank["reason"]
+    assert blank["page_count"] == 2
+
+
+def test_non_financial_document_is_rejected():
+    result = triage_document(_pdf([OTHER_PAGE]), "trail.pdf")
+    assert result["decision"] == "reject"
+    assert result["financial_score"] < 3
+
+
+def test_short_financial_document_goes_to_the_light_pipeline():
+    result = triage_document(_pdf([FINANCIAL_PAGE, FINANCIAL_PAGE]), "tsla-q2-2025.pdf")
+    assert result["decision"] == "light"
+    assert result["document_type"] == "Quarterly Report (10-Q)"
+    assert result["page_count"] == 2
+
+
+def test_long_financial_document_goes_to_the_full_crew():
+    result = triage_document(_pdf([FINANCIAL_PAGE] * 6), "tsla-q2-2025.pdf")
+    assert (result["decision"], result["page_count"]) == ("full", 6)
+
+
+def test_exact_duplicate_is_served_before_parsing():
+    content = b"%PDF-1.4 not parsed because the hash already has a result"
+    seen = []
+
+    def lookup_duplicate(digest):
+        seen.append(digest)
+        return {"analysis": "cached"}
+
+    result = triage_document(content, "report.pdf", lookup_duplicate=lookup_duplicate)
+    assert result["decision"] == "duplicate"
+    assert result["cached_result"] == {"analysis": "cached"}
+    assert seen == [content_hash(content)]
+
+
+def test_near_duplicate_is_served_and_similar_filings_prime_the_crew():
+    content = _pdf([FINANCIAL_PAGE] * 6)
+    similar = {"matches": [{"score": 0.99}], "prior_summary": "Earlier Q2 analysis", "cached_result": None}
+    primed = triage_document(content, "q2.pdf", lookup_duplicate=lambda digest: None,
+                             lookup_similar=lambda text: similar)
+    assert primed["decision"] == "full" and primed["prior_summary"] == "Earlier Q2 analysis"
+
+    similar["cached_result"] = {"analysis": "same filing"}
+    served = triage_document(content, "q2.pdf", lookup_similar=lambda text: similar)
+    assert served["decision"] == "duplicate" and served["cached_result"] == {"analysis": "same filing"}
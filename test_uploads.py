@@ -0,0 +1,90 @@
+"""Resumable chunked uploads (uploads.UploadSessions)"""
+import asyncio
+import hashlib
+
+import pytest
+
+from document_store import DocumentStore
+from uploads import UploadSessions, UploadError
+
+CONTENT = b"%PDF-1.4\n" + bytes(range(256)) * 40 + b"\n%%EOF\n"
+
+
+@pytest.fixture
+def sessions(tmp_path):
+    return UploadSessions(DocumentStore(str(tmp_path / "store")))
+
+
+def _send(sessions, upload_id, offset, data, checksum=None):
+    async def stream():
+        # Split like a network read would
+        for start in range(0, len(data), 1000):
+            yield data[start:start + 1000]
+    return asyncio.run(sessions.receive_chunk(upload_id, offset, stream(), checksum))
+
+
+def test_chunks_in_any_order_complete_into_the_store(sessions):
+    upload = sessions.create("filing.pdf", len(CONTENT), hashlib.sha256(CONTENT).hexdigest())
+    upload_id = upload["upload_id"]
+    half = len(CONTENT) // 2
+    _send(sessions, upload_id, half, CONTENT[half:])
+    assert sessions.status(upload_id)["next_offset"] == 0
+    _send(sessions, upload_id, 0, CONTENT[:half], hashlib.sha256(CONTENT[:half]).hexdigest())
+    assert sessions.status(upload_id)["received"] == len(CONTENT)
+
+    result = sessions.complete(upload_id)
+    content_hash = hashlib.sha256(CONTENT).hexdigest()
+    assert result["content_hash"] == content_hash
+    assert sessions.complete(upload_id)["content_hash"] == content_hash
+    assert sessions.document(upload_id) == (content_hash, "filing.pdf")
+    with open(sessions.store.path(content_hash), "rb") as f:
+        assert f.read() == CONTENT
+
+
+def test_resent_chunk_is_accepted(sessions):
+    upload_id = sessions.create("filing.pdf", len(CONTENT))["upload_id"]
+    _send(sessions, upload_id, 0, CONTENT[:500])
+    _send(sessions, upload_id, 0, CONTENT)
+    assert sessions.status(upload_id)["next_offset"] is None
+
+
+def test_checksum_mismatch_is_not_recorded(sessions):
+    upload_id = sessions.create("filing.pdf", len(CONTENT))["upload_id"]
+    _send(sessions, upload_id, 0, CONTENT[:1000])
+    with pytest.raises(UploadError) as error:
+        _send(sessions, upload_id, 500, CONTENT[500:2000], checksum="0" * 64)
+    assert error.value.status == 422
+    # The bad chunk overlapped the first one, which has to be sent again too
+    assert sessions.status(upload_id)["received"] == 0
+
+
+def test_incomplete_upload_cannot_complete(sessions):
+    upload_id = sessions.create("filing.pdf", len(CONTENT))["upload_id"]
+    _send(sessions, upload_id, 0, CONTENT[:1000])
+    with pytest.raises(UploadError) as error:
+        sessions.complete(upload_id)
+    assert error.value.status == 409
+
+
+def test_chunk_past_declared_size_is_rejected(sessions):
+    upload_id = sessions.create("filing.pdf", 100)["upload_id"]
+    with pytest.raises(UploadError) as error:
+        _send(sessions, upload_id, 0, CONTENT[:200])
+    assert error.value.status == 413
+
+
+def test_non_pdf_and_unknown_uploads_are_rejected(sessions):
+    with pytest.raises(UploadError):
+        sessions.create("notes.txt", 10)
+    with pytest.raises(UploadError) as error:
+        sessions.status("0" * 32)
+    assert error.value.status == 404
+
+
+def test_delete_releases_the_document(sessions):
+    upload_id = sessions.create("filing.pdf", len(CONTENT))["upload_id"]
+    _send(sessions, upload_id, 0, CONTENT)
+    content_hash = sessions.complete(upload_id)["content_hash"]
+    assert sessions.store.refcount(content_hash) == 1
+    sessions.delete(upload_id)
+    assert sessions.store.refcount(content_hash) == 0
@@ -0,0 +1,63 @@
+"""Celery worker profile settings, the delivery cap and recycling"""
+from types import SimpleNamespace
+
+import pytest
+
+import worker_profiles
+from shared_cache import SharedCache, SQLiteCache
+from worker_profiles import apply_worker_profile, delivery_exceeded, recycle_reason, get_profile
+
+
+class _Conf(dict):
+    def __getattr__(self, name):
+        return self.get(name)
+
+
+@pytest.fixture
+def app(monkeypatch):
+    monkeypatch.setattr(worker_profiles, "_install_recycling", lambda profile: None)
+    monkeypatch.setattr(worker_profiles, "size_executor", lambda concurrency: concurrency)
+    return SimpleNamespace(conf=_Conf(broker_transport_options={"region": "local"}))
+
+
+def test_llm_profile_acks_late_with_a_bounded_requeue(app):
+    apply_worker_profile(app, "llm")
+    profile = get_profile("llm")
+    assert app.conf["worker_prefetch_multiplier"] == 1
+    assert app.conf["task_acks_late"] and app.conf["task_reject_on_worker_lost"]
+    assert profile["max_deliveries"] >= 1
+    assert app.conf["broker_transport_options"] == {
+        "region": "local", "visibility_timeout": profile["time_limit"] + worker_profiles.VISIBILITY_MARGIN_SECONDS}
+
+
+def test_requeue_on_worker_loss_needs_a_delivery_cap(app, monkeypatch):
+    monkeypatch.setitem(worker_profiles.WORKER_PROFILES, "uncapped", {**get_profile("llm"), "max_deliveries": 0})
+    apply_worker_profile(app, "uncapped")
+    assert app.conf["task_acks_late"] and not app.conf["task_reject_on_worker_lost"]
+
+
+def test_default_profile_keeps_celery_settings(app):
+    apply_worker_profile(app, "default")
+    assert app.conf == {"broker_transport_options": {"region": "local"}}
+    assert worker_profiles.task_deadline("default") is None
+    with pytest.raises(ValueError):
+        get_profile("turbo")
+
+
+def test_task_is_rejected_after_max_deliveries(tmp_path, monkeypatch):
+    monkeypatch.setitem(worker_profiles.WORKER_PROFILES, "capped", {**get_profile("llm"), "max_deliveries": 2})
+    cache = SharedCache(SQLiteCache(str(tmp_path / "cache.db")))
+    assert [delivery_exceeded("task-1", "capped", cache) for _ in range(3)] == [False, False, True]
+    assert delivery_exceeded("task-2", "capped", cache) is False
+    # Eager calls have no task id, and the default profile has no cap
+    assert delivery_exceeded(None, "capped", cache) is False
+    assert delivery_exceeded("task-1", "default", cache) is False
+
+
+def test_recycle_after_max_tasks_or_memory(monkeypatch):
+    profile = {"max_tasks_per_child": 3, "max_memory_per_child_kb": 1000}
+    monkeypatch.setattr(worker_profiles, "_rss_kb", lambda: 500)
+    assert recycle_reason(2, profile) is None
+    assert recycle_reason(3, profile) == "max_tasks"
+    monkeypatch.setattr(worker_profiles, "_rss_kb", lambda: 1000)
+    assert recycle_reason(1, profile) == "max_memory"
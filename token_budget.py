@@ -0,0 +1,245 @@
+"""
+Prompt-token budgeting for crew runs.
+
+Downstream tasks receive the full text of their context tasks, and every
+agent that reads the document pulls it into its prompt. A TokenBudget is
+created per crew run and:
+
+- counts prompt tokens for every LLM call, per agent;
+- compacts each task's output into a structured summary before it is passed
+  on as context (the last task's output, which is the final answer, is kept);
+- caps document-tool output to a share of the reading agent's ceiling;
+- enforces per-agent prompt ceilings (warn, or raise with TOKEN_BUDGET_STRICT=1);
+- logs the tokens saved at the end of the run.
+
+Ceilings can be overridden with AGENT_TOKEN_CEILINGS, a JSON object keyed by
+agent name (verifier, financial_analyst, investment_advisor, risk_assessor).
+"""
+import os
+import re
+import json
+import contextvars
+
+try:
+    from langchain_core.callbacks import BaseCallbackHandler
+except ImportError:
+    BaseCallbackHandler = object
+
+from telemetry import current_task, registry
+
+DEFAULT_AGENT_CEILINGS = {
+    "verifier": 8000,
+    "financial_analyst": 12000,
+    "investment_advisor": 6000,
+    "risk_assessor": 6000,
+}
+
+# Which agent runs each crew task (task names as used in telemetry/incremental)
+TASK_AGENTS = {
+    "verification": "verifier",
+    "analyze_financial_document": "financial_analyst",
+    "incremental_synthesis": "financial_analyst",
+    "quick_analysis": "financial_analyst",
+    "investment_analysis": "investment_advisor",
+    "risk_assessment": "risk_assessor",
+}
+
+# Token target for a compacted task output passed on as context
+COMPACT_CONTEXT_TOKENS = int(os.getenv("COMPACT_CONTEXT_TOKENS", "1200"))
+
+# Fraction of an agent's ceiling a single document-tool result may use
+TOOL_OUTPUT_SHARE = float(os.getenv("TOOL_OUTPUT_SHARE", "0.5"))
+
+STRICT = os.getenv("TOKEN_BUDGET_STRICT", "").lower() in ("1", "true", "yes")
+
+registry.describe("analyzer_prompt_tokens_saved_total", "counter", "Prompt tokens avoided by context compaction and tool output caps")
+registry.describe("analyzer_token_ceiling_exceeded_total", "counter", "LLM calls whose prompt exceeded the agent's token ceiling")
+
+current_budget = contextvars.ContextVar("current_budget", default=None)
+
+_encoder = None
+_FIGURE = re.compile(r"[$€£¥]\s?\d|\d[\d,.]*\s?(%|percent|million|billion|thousand|bn|mn|m\b|k\b)", re.IGNORECASE)
+_CONCLUSION = re.compile(r"\b(BUY|HOLD|SELL|recommend\w*|conclu\w*|confidence|overall|rating|target)\b", re.IGNORECASE)
+_RISK = re.compile(r"\b(risk\w*|concern\w*|weakness\w*|issue\w*|missing|inconsisten\w*|exposure)\b", re.IGNORECASE)
+_HEADING = re.compile(r"^\s*(#{1,6}\s+.+|\*\*[^*]+\*\*:?|[A-Z][A-Za-z /&-]{2,60}:)\s*$")
+
+
+class TokenBudgetExceeded(Exception):
+    """An agent's prompt exceeded its configured ceiling in strict mode"""
+
+
+def count_tokens(text: str) -> int:
+    """Count tokens with tiktoken when available, else estimate ~4 characters per token"""
+    global _encoder
+    if not text:
+        return 0
+    if _encoder is None:
+        try:
+            import tiktoken
+            _encoder = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            _encoder = False
+    if _encoder:
+        return len(_encoder.encode(text, disallowed_special=()))
+    return max(len(text) // 4, 1)
+
+
+def load_ceilings() -> dict:
+    ceilings = dict(DEFAULT_AGENT_CEILINGS)
+    override = os.getenv("AGENT_TOKEN_CEILINGS")
+    if override:
+        ceilings.update({k: int(v) for k, v in json.loads(override).items()})
+    return ceilings
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Cut text to roughly max_tokens, on a line boundary where possible"""
+    if count_tokens(text) <= max_tokens:
+        return text
+    # Proportional cut, then trim until it fits
+    cut = text[:max(int(len(text) * max_tokens / count_tokens(text)), 1)]
+    while cut and count_tokens(cut) > max_tokens:
+        cut = cut[:int(len(cut) * 0.9)]
+    newline = cut.rfind("\n")
+    return cut[:newline] if newline > len(cut) // 2 else cut
+
+
+def compact(text: str, max_tokens: int = COMPACT_CONTEXT_TOKENS) -> str:
+    """
+    Compact a task output into a structured summary within max_tokens.
+
+    Keeps conclusions, lines carrying figures, risks and section headings,
+    in that priority order, and drops narrative prose.
+    """
+    if count_tokens(text) <= max_tokens:
+        return text
+
+    lines = list(dict.fromkeys(line.strip() for line in text.splitlines() if line.strip()))
+    sections = {"Conclusions": [], "Key figures": [], "Risks and issues": [], "Structure": []}
+    for line in lines:
+        if _CONCLUSION.search(line):
+            sections["Conclusions"].append(line)
+        elif _FIGURE.search(line):
+            sections["Key figures"].append(line)
+        elif _RISK.search(line):
+            sections["Risks and issues"].append(line)
+        elif _HEADING.match(line):
+            sections["Structure"].append(line)
+
+    parts = []
+    used = count_tokens("[Compacted summary]")
+    for title, items in sections.items():
+        if not items:
+            continue
+        header = f"\n{title}:"
+        used += count_tokens(header)
+        kept = []
+        for item in items:
+            bullet = f"- {item.lstrip('-*• ')}"
+            cost = count_tokens(bullet)
+            if used + cost > max_tokens:
+                break
+            kept.append(bullet)
+            used += cost
+        if kept:
+            parts.append(header + "\n" + "\n".join(kept))
+    summary = "[Compacted summary]" + "".join(parts)
+    return summary if len(parts) else truncate_to_tokens(text, max_tokens)
+
+
+class TokenBudget:
+    """Per-run token accounting, compaction and ceiling enforcement"""
+
+    def __init__(self, task_names: list, ceilings: dict = None):
+        self.task_names = task_names
+        self.ceilings = ceilings or load_ceilings()
+        self.prompt_tokens = {}
+        self.saved_tokens = 0
+        self.violations = []
+        self.originals = {}
+        self._index = 0
+
+    def ceiling_for(self, task_name: str) -> int:
+        return self.ceilings.get(TASK_AGENTS.get(task_name, ""), max(self.ceilings.values()))
+
+    def _saved(self, before: int, after: int):
+        if before > after:
+            self.saved_tokens += before - after
+            registry.inc("analyzer_prompt_tokens_saved_total", before - after)
+
+    def __call__(self, task_output):
+        """task_callback: compact each non-final task output before it becomes context"""
+        name = self.task_names[self._index] if self._index < len(self.task_names) else f"task_{self._index}"
+        self._index += 1
+        if self._index >= len(self.task_names) or not hasattr(task_output, "raw"):
+            return
+        original = task_output.raw or ""
+        compacted = compact(original)
+        if compacted is not original:
+            self.originals[name] = original
+            task_output.raw = compacted
+            self._saved(count_tokens(original), count_tokens(compacted))
+
+    def limit_tool_output(self, text: str) -> str:
+        """Cap a document-tool result to a share of the calling agent's ceiling"""
+        limit = int(self.ceiling_for(current_task.get()) * TOOL_OUTPUT_SHARE)
+        before = count_tokens(text)
+        if before <= limit:
+            return text
+        truncated = truncate_to_tokens(text, limit)
+        self._saved(before, count_tokens(truncated))
+        return truncated + f"\n[... truncated {before - limit} tokens to stay within the token budget]"
+
+    def record_prompt(self, task_name: str, tokens: int):
+        agent = TASK_AGENTS.get(task_name, task_name or "none")
+        self.prompt_tokens[agent] = self.prompt_tokens.get(agent, 0) + tokens
+        ceiling = self.ceiling_for(task_name)
+        if tokens > ceiling:
+            self.violations.append((agent, tokens, ceiling))
+            registry.inc("analyzer_token_ceiling_exceeded_total", labels={"agent": agent})
+            message = f"Prompt for {agent} is {tokens} tokens, above its ceiling of {ceiling}"
+            if STRICT:
+                raise TokenBudgetExceeded(message)
+            print(f"Token budget warning: {message}")
+
+    def log_summary(self):
+        used = ", ".join(f"{agent}={tokens}" for agent, tokens in self.prompt_tokens.items()) or "none recorded"
+        print(f"Token budget: saved {self.saved_tokens} prompt tokens; prompt tokens by agent: {used}")
+
+
+def chain_task_callbacks(budget: TokenBudget, *observers):
+    """
+    Crew task_callback that passes each task output to the observers (timer,
+    streaming tracker, structured parse), then to the budget.
+
+    The budget comes last because it replaces task_output.raw with the
+    compacted summary; observers given None are skipped.
+    """
+    observers = [observer for observer in observers if observer is not None]
+
+    def on_task_done(task_output):
+        for observer in observers:
+            observer(task_output)
+        budget(task_output)
+    return on_task_done
+
+
+class TokenBudgetCallbackHandler(BaseCallbackHandler):
+    """LangChain callback that counts prompt tokens against the current run's budget"""
+
+    raise_error = True
+
+    def on_chat_model_start(self, serialized, messages, **kwargs):
+        budget = current_budget.get()
+        if budget is None:
+            return
+        text = "\n".join(str(getattr(m, "content", m)) for batch in messages for m in batch)
+        budget.record_prompt(current_task.get(), count_tokens(text))
+
+    def on_llm_start(self, serialized, prompts, **kwargs):
+        budget = current_budget.get()
+        if budget is not None:
+            budget.record_prompt(current_task.get(), count_tokens("\n".join(prompts)))
+
+
+token_budget_callback_handler = TokenBudgetCallbackHandler()
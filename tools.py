@@ -1,30 +1,123 @@
 # Import the decorator from the main 'crewai' library's submodule
 from crewai.tools import tool
 
-# Import the pre-built tools that we know are working
-from crewai_tools import FileReadTool
-
 # Import the DuckDuckGo library directly
 from duckduckgo_search import DDGS
 
+from telemetry import stage
+from token_budget import current_budget
+from ingestion import get_pages
+from knowledge_store import get_knowledge_store, format_knowledge, current_subject
+from fact_store import get_facts
+import document_reader
+
 # --- DEFINE YOUR CUSTOM TOOLS HERE ---
 
-# 1. Document Reading Tool (from crewai_tools)
-financial_document_tool = FileReadTool()
+def _bounded(result: str) -> str:
+    """Apply the current run's token budget to a tool result"""
+    budget = current_budget.get()
+    return budget.limit_tool_output(result) if budget is not None else result
+
+# 1. Document Reading Tools (paginated views over the parsed-text store)
+@tool("Document Overview")
+def document_overview_tool(file_path: str) -> str:
+    """
+    Get the page count, the pages where the main financial statements and sections
+    start, and an excerpt of the first page. Use this first to decide which pages to read.
+    """
+    with stage("tool.document_overview"):
+        return _bounded(document_reader.outline(get_pages(file_path)))
+
+@tool("Read Document Pages")
+def read_pages_tool(file_path: str, start_page: int, end_page: int) -> str:
+    """
+    Read the text of pages start_page to end_page (1-based, inclusive) of the document.
+    Output is limited in size, so request only the few pages you need.
+    """
+    with stage("tool.read_pages"):
+        return _bounded(document_reader.read_pages(get_pages(file_path), start_page, end_page))
+
+@tool("Search Document")
+def search_document_tool(file_path: str, term: str) -> str:
+    """
+    Find a word or phrase in the document. Returns matching snippets with page numbers.
+    """
+    with stage("tool.search_document"):
+        return _bounded(document_reader.search(get_pages(file_path), term))
+
+@tool("Get Document Section")
+def get_section_tool(file_path: str, section: str) -> str:
+    """
+    Get a named section of the document, e.g. "balance sheet", "income statement",
+    "cash flow", "risk factors", "highlights" or "outlook".
+    """
+    with stage("tool.get_section"):
+        return _bounded(document_reader.get_section(get_pages(file_path), section))
+
+@tool("Financial Figures")
+def financial_figures_tool(file_path: str, metric: str = "", period: str = "") -> str:
+    """
+    List the figures extracted from the document, with page, period, label and normalized value.
+    Filter by metric (e.g. "revenue", "net_income", "operating_income", "eps", "operating_cash_flow",
+    "free_cash_flow", "total_assets", "cash") and/or period (e.g. "Q2-2025", "FY2024").
+    Leave both empty to get the latest value of every recognized metric.
+    """
+    with stage("tool.financial_figures"):
+        facts = get_facts(file_path)
+        if not metric and not period:
+            latest = facts.latest()
+            if not latest:
+                return _bounded(facts.format())
+            return _bounded("\n".join(f"{name}: {item['value']:,.2f} ({item['unit']}, {item['period']})"
+                                       for name, item in latest.items()))
+        return _bounded(facts.select(metric=metric or None, period=period or None).format())
+
+financial_document_tools = [document_overview_tool, read_pages_tool, search_document_tool, get_section_tool,
+                            financial_figures_tool]
+
+# 2. Company knowledge store (checked before searching the web)
+@tool("Company Knowledge Lookup")
+def knowledge_lookup_tool(company: str, period: str = "") -> str:
+    """
+    Look up stored facts and earlier web-search results about a company (name or ticker),
+    optionally for one reporting period such as "Q2 2025" or "FY2024". Entries show how old
+    they are. Always check here before using the Web Search Tool.
+    """
+    with stage("tool.knowledge_lookup"):
+        return _bounded(format_knowledge(get_knowledge_store().lookup(company, period or None)))
+
+@tool("Save Company Fact")
+def save_fact_tool(company: str, period: str, fact: str, source: str = "") -> str:
+    """
+    Save a short fact about a company and reporting period (e.g. a reported figure, guidance
+    or a market event you found) so later analyses can reuse it without searching again.
+    """
+    with stage("tool.save_fact"):
+        get_knowledge_store().add_fact(company, period, fact, source)
+    return "Fact saved."
+
+knowledge_tools = [knowledge_lookup_tool, save_fact_tool]
 
-# 2. Custom Web Search Tool (our own stable version)
+# 3. Custom Web Search Tool (our own stable version)
 @tool("Web Search Tool")
 def search_tool(query: str) -> str:
     """
     A custom tool to search the web using DuckDuckGo.
     This is more stable than importing from crewai_tools.
+    Recent identical searches are answered from the company knowledge store.
     """
-    print(f"Searching the web for: {query}")
-    with DDGS() as ddgs:
-        results = [r for r in ddgs.text(query, max_results=5)]
+    store = get_knowledge_store()
+    results = store.get_search(query)
+    if results is None:
+        print(f"Searching the web for: {query}")
+        with stage("tool.search_tool"), DDGS() as ddgs:
+            results = [r for r in ddgs.text(query, max_results=5)]
+        # Tag with the analyzed document's issuer; the query alone rarely names a company the store knows yet
+        company, period = current_subject.get()
+        store.put_search(query, results, company=company, period=period)
     return "\n".join(str(res) for res in results) if results else "No results found."
 
-# 3. Placeholder Investment Analysis Tool
+# 4. Placeholder Investment Analysis Tool
 @tool("Investment Analysis Tool")
 def investment_analysis_tool(query: str) -> str:
     """
@@ -32,7 +125,7 @@ def investment_analysis_tool(query: str) -> str:
     """
     return f"Investment analysis for '{query}' has been noted and will be incorporated."
 
-# 4. Placeholder Risk Assessment Tool
+# 5. Placeholder Risk Assessment Tool
 @tool("Risk Assessment Tool")
 def risk_assessment_tool(query: str) -> str:
     """
@@ -0,0 +1,185 @@
+"""
+Pre-flight triage of uploads before any LLM call.
+
+Runs in milliseconds on the raw bytes (plus OCR of sampled pages for scanned
+filings, cached for the full parse later) and decides what to do with a
+document:
+
+    reject      not a PDF, unreadable, blank/scanned, or not a financial document
+    duplicate   the same file was already analyzed for the same query
+    light       short financial document: a single-task crew is enough
+    full        everything else goes to the four-agent crew
+"""
+import io
+import os
+import re
+import time
+import hashlib
+
+from pypdf import PdfReader
+
+import ocr
+
+# Pages sampled for text density and classification
+SAMPLE_PAGES = int(os.getenv("TRIAGE_SAMPLE_PAGES", "8"))
+# Average characters per sampled page below which a document counts as blank/scanned
+MIN_CHARS_PER_PAGE = int(os.getenv("TRIAGE_MIN_CHARS_PER_PAGE", "200"))
+# Distinct financial terms required to treat a document as financial
+MIN_FINANCIAL_SCORE = int(os.getenv("TRIAGE_MIN_FINANCIAL_SCORE", "3"))
+# Documents up to this many pages go to the light pipeline
+LIGHT_MAX_PAGES = int(os.getenv("TRIAGE_LIGHT_MAX_PAGES", "3"))
+
+FINANCIAL_TERMS = [
+    "revenue", "net income", "operating income", "gross margin", "gross profit", "earnings per share",
+    "total assets", "total liabilities", "cash flow", "balance sheet", "income statement",
+    "shareholders' equity", "stockholders' equity", "ebitda", "operating expenses", "free cash flow",
+    "fiscal year", "quarter", "dividend", "guidance", "capital expenditures", "net loss",
+]
+
+# (document type, patterns that identify it from content), checked in order
+DOCUMENT_TYPES = [
+    ("Annual Report (10-K)", [r"\bform\s+10-k\b", r"\bannual report\b", r"\bfor the fiscal year ended\b"]),
+    ("Quarterly Report (10-Q)", [r"\bform\s+10-q\b", r"\bquarterly report\b", r"\bfor the quarterly period ended\b"]),
+    ("Prospectus", [r"\bprospectus\b", r"\bunderwriters?\b", r"\bofferings?\b.*\bshares\b"]),
+    ("Earnings Release / Shareholder Update", [r"\bshareholder (deck|letter|update)\b", r"\bearnings (release|call)\b",
+                                               r"\bq[1-4]\s*'?\d{2,4}\b.*\bupdate\b", r"\bquarterly update\b"]),
+    ("Balance Sheet", [r"\bbalance sheets?\b", r"\bstatements? of financial position\b"]),
+    ("Financial Statement", [r"\bincome statement\b", r"\bstatements? of operations\b", r"\bcash flows?\b"]),
+]
+
+_FILENAME_TYPES = [
+    (("10-k", "10k", "annual"), "Annual Report (10-K)"),
+    (("10-q", "10q", "quarterly"), "Quarterly Report (10-Q)"),
+    (("earnings", "financial"), "Financial Statement"),
+    (("balance", "sheet"), "Balance Sheet"),
+]
+
+
+def content_hash(content: bytes) -> str:
+    """SHA-256 of the raw upload, used for duplicate lookups"""
+    return hashlib.sha256(content).hexdigest()
+
+
+def financial_score(text: str) -> int:
+    """Number of distinct financial terms present in the text"""
+    lowered = text.lower()
+    return sum(1 for term in FINANCIAL_TERMS if term in lowered)
+
+
+def classify_document(text: str, filename: str = "") -> str:
+    """Detect the financial document type from content, falling back to the filename"""
+    lowered = text.lower()
+    best, best_hits = None, 0
+    for doc_type, patterns in DOCUMENT_TYPES:
+        hits = sum(1 for pattern in patterns if re.search(pattern, lowered))
+        if hits > best_hits:
+            best, best_hits = doc_type, hits
+    if best:
+        return best
+    filename_lower = (filename or "").lower()
+    for terms, doc_type in _FILENAME_TYPES:
+        if any(term in filename_lower for term in terms):
+            return doc_type
+    return "Financial Document"
+
+
+def _sample_indexes(page_count: int, sample: int = SAMPLE_PAGES) -> list:
+    """First pages plus an even spread over the rest of the document"""
+    if page_count <= sample:
+        return list(range(page_count))
+    head = list(range(sample // 2))
+    stride = max((page_count - len(head)) // (sample - len(head)), 1)
+    return head + list(range(len(head), page_count, stride))[:sample - len(head)]
+
+
+def sample_pages(pages: list) -> list:
+    """The page texts triage samples, for callers that already have every page"""
+    return [pages[index] for index in _sample_indexes(len(pages))]
+
+
+def triage_document(content: bytes, filename: str = "", lookup_duplicate=None, lookup_similar=None,
+                    known_hash: str = None, path: str = None) -> dict:
+    """
+    Decide how an upload should be handled.
+
+    content may be a memory-mapped view of a stored document (a completed
+    resumable upload); pass its known_hash and path so it is neither hashed
+    nor copied again.
+
+    lookup_duplicate(content_hash) may return a previously stored result for the
+    same content (and query); if it does, the decision is "duplicate" and the
+    stored result is returned under "cached_result".
+
+    lookup_similar(sample_text) is consulted for financial documents that are
+    not exact duplicates. It returns a dict with "matches", "prior_summary" and
+    "cached_result"; a cached result (a near-identical filing) also makes the
+    decision "duplicate".
+    """
+    started = time.perf_counter()
+    result = {"decision": "full", "reason": "", "content_hash": known_hash or content_hash(content),
+              "page_count": 0, "chars_per_page": 0, "document_type": None, "financial_score": 0}
+
+    def finish(decision, reason):
+        result["decision"] = decision
+        result["reason"] = reason
+        result["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 2)
+        return result
+
+    if b"%PDF-" not in content[:1024]:
+        return finish("reject", "File is not a PDF (missing %PDF header)")
+
+    if lookup_duplicate is not None:
+        cached = lookup_duplicate(result["content_hash"])
+        if cached is not None:
+            result["cached_result"] = cached
+            return finish("duplicate", "Identical document was already analyzed for this query")
+
+    try:
+        reader = PdfReader(io.BytesIO(content) if isinstance(content, bytes) else content)
+        if reader.is_encrypted and not reader.decrypt(""):
+            return finish("reject", "PDF is encrypted")
+        page_count = len(reader.pages)
+        indexes = _sample_indexes(page_count)
+        sampled = [reader.pages[index].extract_text() or "" for index in indexes]
+    except Exception as e:
+        return finish("reject", f"PDF could not be parsed: {e}")
+
+    scanned = [index for index, page_text in zip(indexes, sampled) if ocr.needs_ocr(page_text)]
+    if scanned and ocr.available():
+        # Same page texts the worker's full parse will see (served from the OCR cache there)
+        recognized = ocr.ocr_pages(path, scanned) if path else ocr.ocr_content(content, scanned)
+        sampled = [recognized.get(index, page_text) for index, page_text in zip(indexes, sampled)]
+        result["ocr_pages"] = len(recognized)
+
+    result["page_count"] = page_count
+    if page_count == 0:
+        return finish("reject", "PDF has no pages")
+
+    text = "\n".join(sampled)
+    result["chars_per_page"] = len(text.strip()) // max(len(sampled), 1)
+    if result["chars_per_page"] < MIN_CHARS_PER_PAGE:
+        scanned_hint = "blank" if ocr.available() else "blank, or scanned and OCR is not installed"
+        return finish("reject", f"Document has little or no extractable text ({scanned_hint})")
+
+    result["financial_score"] = financial_score(text)
+    result["document_type"] = classify_document(text, filename)
+    if result["financial_score"] < MIN_FINANCIAL_SCORE:
+        return finish("reject", "Document does not appear to be a financial document")
+
+    if lookup_similar is not None:
+        similar = lookup_similar(text)
+        result["similar"] = similar["matches"]
+        result["prior_summary"] = similar["prior_summary"]
+        if similar["cached_result"] is not None:
+            result["cached_result"] = similar["cached_result"]
+            return finish("duplicate", "A near-identical document was already analyzed for this query")
+
+    if page_count <= LIGHT_MAX_PAGES:
+        return finish("light", f"Short document ({page_count} pages)")
+    return finish("full", "")
+
+
+def triage_stored_document(store, doc_id: str, filename: str = "", **lookups) -> dict:
+    """triage_document for a document already in a document store, read through a memory map"""
+    with store.view(doc_id) as content:
+        return triage_document(content, filename, known_hash=doc_id, path=store.path(doc_id), **lookups)
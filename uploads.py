@@ -0,0 +1,272 @@
+"""
+Resumable chunked uploads into the document store.
+
+A single multipart POST of a several-hundred-megabyte prospectus over a slow
+link fails and has to start again from the first byte. The upload protocol
+splits the transfer instead:
+
+    POST   /uploads                    filename, size (and optionally sha256)
+                                       -> upload_id, chunk_size
+    PUT    /uploads/{id}?offset=N      raw chunk bytes; optional X-Chunk-SHA256
+    GET    /uploads/{id}               received ranges and the next missing offset
+    POST   /uploads/{id}/complete      -> content_hash (and any cached result)
+    DELETE /uploads/{id}               abandon the upload
+
+Chunks are streamed from the request straight to their offset in a file
+preallocated at the declared size, so nothing is buffered in memory and
+chunks may arrive in any order or be re-sent. Each chunk's SHA-256 is
+checked as it is written; a chunk that does not match is not recorded and
+must be sent again. Received ranges are marker files, like the store's
+references, so any API process on the node can take the next chunk of an
+upload. Sessions live in the node's store directory: with several API nodes,
+route /uploads/{id} requests by upload_id (or share DOCUMENT_STORE_DIR).
+
+complete() hashes the assembled file and moves it into the store under that
+hash, which is the same content hash triage uses, so duplicate and cache
+lookups happen before any analysis is started. /analyze then takes the
+upload_id instead of a file. With a non-shared DOCUMENT_TRANSPORT the
+completed document is published right away, together with a record of the
+upload, so any API node can resolve the upload_id. A session holds a store reference on its
+document until it is deleted or expires: the store's janitor drops sessions
+and references older than DOCUMENT_STORE_MAX_AGE_SECONDS.
+"""
+import os
+import re
+import json
+import shutil
+import uuid
+import hashlib
+
+from telemetry import registry
+from document_store import get_store
+from document_transport import share_upload, find_upload, materialize
+
+# Chunk size suggested to clients, and the largest chunk accepted
+UPLOAD_CHUNK_BYTES = int(os.getenv("UPLOAD_CHUNK_BYTES", str(8 * 1024 ** 2)))
+UPLOAD_MAX_CHUNK_BYTES = int(os.getenv("UPLOAD_MAX_CHUNK_BYTES", str(64 * 1024 ** 2)))
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(1024 ** 3)))
+# Read size when hashing the assembled file
+HASH_BLOCK_BYTES = 1024 * 1024
+
+registry.describe("analyzer_upload_chunks_total", "counter", "Resumable upload chunks by outcome")
+registry.describe("analyzer_upload_bytes_total", "counter", "Bytes received through resumable uploads")
+
+_UPLOAD_ID = re.compile(r"^[0-9a-f]{32}$")
+
+
+class UploadError(Exception):
+    """A request the upload protocol cannot accept; status is the HTTP status to answer with"""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+def _public(result: dict) -> dict:
+    """A session's result without its store reference"""
+    return {key: value for key, value in result.items() if key != "document_ref"}
+
+
+class UploadSessions:
+    """Resumable uploads assembled on disk next to the store, then adopted into it"""
+
+    def __init__(self, store=None):
+        self.store = store or get_store()
+        self.root = self.store.uploads_dir
+        os.makedirs(self.root, exist_ok=True)
+
+    def _dir(self, upload_id: str) -> str:
+        if not _UPLOAD_ID.match(upload_id or ""):
+            raise UploadError(404, "Unknown upload")
+        path = os.path.join(self.root, upload_id)
+        if not os.path.isdir(path):
+            raise UploadError(404, "Unknown or expired upload. Uploads are assembled on the API node that created "
+                                   "them; route /uploads/{upload_id} requests by upload_id")
+        return path
+
+    def _is_local(self, upload_id: str) -> bool:
+        return bool(_UPLOAD_ID.match(upload_id or "")) and os.path.isdir(os.path.join(self.root, upload_id))
+
+    def _shared_record(self, upload_id: str):
+        """The record another API node shared when it completed this upload, or None"""
+        if self._is_local(upload_id) or not _UPLOAD_ID.match(upload_id or ""):
+            return None
+        return find_upload(upload_id)
+
+    def _meta(self, upload_id: str) -> dict:
+        with open(os.path.join(self._dir(upload_id), "meta.json")) as f:
+            return json.load(f)
+
+    def create(self, filename: str, size: int, sha256: str = None) -> dict:
+        if not filename.lower().endswith(".pdf"):
+            raise UploadError(400, "Only PDF files are supported")
+        if size <= 0:
+            raise UploadError(400, "Upload size must be positive")
+        if size > UPLOAD_MAX_BYTES:
+            raise UploadError(413, f"Upload exceeds {UPLOAD_MAX_BYTES} bytes")
+        upload_id = uuid.uuid4().hex
+        path = os.path.join(self.root, upload_id)
+        os.makedirs(os.path.join(path, "ranges"))
+        # Sparse until written; chunks land at their offsets
+        with open(os.path.join(path, "data"), "wb") as f:
+            f.truncate(size)
+        meta = {"upload_id": upload_id, "filename": filename, "size": size,
+                "sha256": sha256.lower() if sha256 else None}
+        with open(os.path.join(path, "meta.json"), "w") as f:
+            json.dump(meta, f)
+        return dict(meta, chunk_size=UPLOAD_CHUNK_BYTES, max_chunk_size=UPLOAD_MAX_CHUNK_BYTES)
+
+    def _ranges(self, upload_id: str) -> list:
+        """Received byte ranges, merged"""
+        spans = sorted(tuple(int(part) for part in name.split("-"))
+                       for name in os.listdir(os.path.join(self._dir(upload_id), "ranges")))
+        merged = []
+        for start, end in spans:
+            if merged and start <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+        return merged
+
+    def status(self, upload_id: str) -> dict:
+        record = self._shared_record(upload_id)
+        if record is not None:
+            return dict(record, received=record["size"], next_offset=None, ranges=[[0, record["size"]]])
+        meta = self._meta(upload_id)
+        result = self._result(upload_id)
+        if result is not None:
+            return dict(meta, received=meta["size"], next_offset=None, ranges=[[0, meta["size"]]], **_public(result))
+        ranges = self._ranges(upload_id)
+        next_offset = ranges[0][1] if ranges and ranges[0][0] == 0 else 0
+        return dict(meta, received=sum(end - start for start, end in ranges),
+                    next_offset=next_offset if next_offset < meta["size"] else None, ranges=ranges, completed=False)
+
+    async def receive_chunk(self, upload_id: str, offset: int, stream, checksum: str = None) -> dict:
+        """Write a chunk from an async byte stream at offset; recorded only if complete and intact"""
+        meta = self._meta(upload_id)
+        path = self._dir(upload_id)
+        if self._result(upload_id) is not None:
+            raise UploadError(409, "Upload is already complete")
+        if offset < 0 or offset >= meta["size"]:
+            raise UploadError(416, f"Offset must be within 0..{meta['size'] - 1}")
+
+        digest = hashlib.sha256()
+        position = offset
+        fd = os.open(os.path.join(path, "data"), os.O_WRONLY)
+        try:
+            async for data in stream:
+                if not data:
+                    continue
+                if position + len(data) > meta["size"] or position + len(data) - offset > UPLOAD_MAX_CHUNK_BYTES:
+                    registry.inc("analyzer_upload_chunks_total", labels={"outcome": "too_large"})
+                    raise UploadError(413, "Chunk extends past the declared size or the chunk limit")
+                digest.update(data)
+                view = memoryview(data)
+                while view:
+                    written = os.pwrite(fd, view, position)
+                    view = view[written:]
+                    position += written
+        finally:
+            os.close(fd)
+
+        if position == offset:
+            raise UploadError(400, "Empty chunk")
+        if checksum and checksum.lower() != digest.hexdigest():
+            registry.inc("analyzer_upload_chunks_total", labels={"outcome": "checksum_mismatch"})
+            # The bad bytes may have overwritten ranges received earlier; those have to be sent again
+            for name in os.listdir(os.path.join(path, "ranges")):
+                start, end = (int(part) for part in name.split("-"))
+                if start < position and end > offset:
+                    os.remove(os.path.join(path, "ranges", name))
+            raise UploadError(422, "Chunk checksum mismatch; send the chunk again")
+        # The marker is what makes the range count as received
+        open(os.path.join(path, "ranges", f"{offset}-{position}"), "w").close()
+        registry.inc("analyzer_upload_chunks_total", labels={"outcome": "stored"})
+        registry.inc("analyzer_upload_bytes_total", position - offset)
+        status = self.status(upload_id)
+        return {"upload_id": upload_id, "offset": offset, "length": position - offset,
+                "sha256": digest.hexdigest(), "received": status["received"], "next_offset": status["next_offset"]}
+
+    def _result(self, upload_id: str):
+        try:
+            with open(os.path.join(self._dir(upload_id), "result.json")) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def complete(self, upload_id: str) -> dict:
+        """Hash the assembled file and move it into the store; idempotent"""
+        record = self._shared_record(upload_id)
+        if record is not None:
+            return record
+        result = self._result(upload_id)
+        if result is not None:
+            return dict(self._meta(upload_id), **_public(result))
+        meta = self._meta(upload_id)
+        path = self._dir(upload_id)
+        ranges = self._ranges(upload_id)
+        if ranges != [[0, meta["size"]]]:
+            missing = meta["size"] - sum(end - start for start, end in ranges)
+            raise UploadError(409, f"Upload is missing {missing} bytes; see next_offset in its status")
+
+        data_path = os.path.join(path, "data")
+        digest = hashlib.sha256()
+        with open(data_path, "rb") as f:
+            for block in iter(lambda: f.read(HASH_BLOCK_BYTES), b""):
+                digest.update(block)
+        content_hash = digest.hexdigest()
+        if meta["sha256"] and meta["sha256"] != content_hash:
+            raise UploadError(422, "Assembled file does not match the declared sha256")
+        with open(data_path, "rb") as f:
+            if b"%PDF-" not in f.read(1024):
+                raise UploadError(422, "File is not a PDF (missing %PDF header)")
+
+        known = os.path.exists(self.store.path(content_hash))
+        ref = self.store.adopt(data_path, content_hash)
+        result = {"content_hash": content_hash, "document_ref": ref, "already_stored": known, "completed": True}
+        temp_path = os.path.join(path, f"result.{uuid.uuid4().hex}.tmp")
+        with open(temp_path, "w") as f:
+            json.dump(result, f)
+        os.replace(temp_path, os.path.join(path, "result.json"))
+        try:
+            share_upload(upload_id, dict(meta, **_public(result)), self.store.path(content_hash))
+        except Exception as e:
+            # The upload still works through this node; /analyze elsewhere answers 404
+            print(f"Could not share completed upload {upload_id}: {e}")
+        return dict(meta, **_public(result))
+
+    def document(self, upload_id: str) -> tuple:
+        """(content hash, filename) of a completed upload, for /analyze; fetched here if completed elsewhere"""
+        record = self._shared_record(upload_id)
+        if record is not None:
+            try:
+                _, ref = materialize(record["content_hash"], self.store)
+            except FileNotFoundError:
+                raise UploadError(410, "Uploaded document has expired; upload it again")
+            # Releasing marks the document as just used; /analyze takes its own reference next
+            self.store.release(record["content_hash"], ref)
+            return record["content_hash"], record["filename"]
+        result = self._result(upload_id)
+        if result is None:
+            raise UploadError(409, "Upload is not complete")
+        if not os.path.exists(self.store.path(result["content_hash"])):
+            raise UploadError(410, "Uploaded document has expired; upload it again")
+        return result["content_hash"], self._meta(upload_id)["filename"]
+
+    def delete(self, upload_id: str):
+        path = self._dir(upload_id)
+        result = self._result(upload_id)
+        if result is not None:
+            self.store.release(result["content_hash"], result["document_ref"])
+        shutil.rmtree(path, ignore_errors=True)
+
+
+_sessions = None
+
+
+def get_upload_sessions() -> UploadSessions:
+    """The process-wide upload sessions"""
+    global _sessions
+    if _sessions is None:
+        _sessions = UploadSessions()
+    return _sessions
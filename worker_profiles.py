@@ -0,0 +1,194 @@
+"""
+Celery worker profiles for long, LLM-bound analysis tasks.
+
+A crew run spends minutes waiting on LLM calls and almost no time on the
+CPU, so Celery's defaults (a prefork child per core, prefetching four tasks
+each, acking on receipt, no time limits) leave cores idle while queued
+documents wait, and lose every prefetched task when a worker dies. The
+"llm" profile (the default, CELERY_WORKER_PROFILE) instead runs:
+
+    pool        gevent when installed, otherwise threads, with high
+                concurrency (CELERY_POOL, CELERY_CONCURRENCY, default 32)
+    prefetch    one task per slot, so a busy worker does not hoard the queue
+    acks_late   a task is acknowledged when it finishes and re-queued if the
+                worker is lost; the broker's visibility timeout is kept above
+                the hard time limit so running tasks are not redelivered. A
+                task delivered more than CELERY_MAX_DELIVERIES times (default
+                3) is rejected without re-queueing, so a document that crashes
+                the worker cannot loop forever
+    limits      soft/hard time limits (CELERY_SOFT_TIME_LIMIT, default 900 s,
+                CELERY_TIME_LIMIT, default 1200 s); the soft limit is also the
+                run's cooperative deadline (run_control.py), which the threads
+                pool needs since it cannot interrupt a task itself
+    recycling   a worker is restarted after CELERY_MAX_TASKS_PER_CHILD tasks
+                (default 50) or above CELERY_MAX_MEMORY_PER_CHILD_KB resident
+                memory (default 1 GiB): natively per child under prefork, by a
+                warm shutdown of the whole worker otherwise, which relies on
+                the process supervisor to start it again
+
+The "default" profile keeps Celery's own settings. The pool has to be chosen
+on the command line, before gevent patches the process, so start workers with
+
+    python worker_profiles.py [--profile llm] [extra celery worker args]
+"""
+import os
+import sys
+import signal
+import argparse
+import resource
+import importlib.util
+
+from telemetry import registry
+from resilient_llm import size_executor
+from shared_cache import get_shared_cache
+
+registry.describe("analyzer_worker_recycles_total", "counter", "Worker shutdowns for recycling, by reason")
+registry.describe("analyzer_task_deliveries_exceeded_total", "counter",
+                  "Tasks rejected without re-queueing after too many deliveries")
+
+WORKER_PROFILE = os.getenv("CELERY_WORKER_PROFILE", "llm")
+
+WORKER_PROFILES = {
+    "default": {},
+    "llm": {
+        "pool": os.getenv("CELERY_POOL") or ("gevent" if importlib.util.find_spec("gevent") else "threads"),
+        "concurrency": int(os.getenv("CELERY_CONCURRENCY", "32")),
+        "prefetch_multiplier": 1,
+        "acks_late": True,
+        "soft_time_limit": int(os.getenv("CELERY_SOFT_TIME_LIMIT", "900")),
+        "time_limit": int(os.getenv("CELERY_TIME_LIMIT", "1200")),
+        "max_tasks_per_child": int(os.getenv("CELERY_MAX_TASKS_PER_CHILD", "50")),
+        "max_memory_per_child_kb": int(os.getenv("CELERY_MAX_MEMORY_PER_CHILD_KB", str(1024 * 1024))),
+        "max_deliveries": int(os.getenv("CELERY_MAX_DELIVERIES", "3")),
+    },
+}
+
+# Margin between the hard time limit and the broker redelivering an unacknowledged task
+VISIBILITY_MARGIN_SECONDS = 300
+# How long a task's delivery count is kept (well beyond max_deliveries visibility timeouts)
+DELIVERY_COUNT_TTL_SECONDS = 24 * 3600
+
+
+def get_profile(name: str = None) -> dict:
+    name = name or WORKER_PROFILE
+    if name not in WORKER_PROFILES:
+        raise ValueError(f"Unknown worker profile {name!r}; expected one of {', '.join(WORKER_PROFILES)}")
+    return WORKER_PROFILES[name]
+
+
+def apply_worker_profile(app, name: str = None):
+    """Apply a profile's task and broker settings to a Celery app"""
+    profile = get_profile(name)
+    if not profile:
+        return
+    app.conf.update(
+        worker_prefetch_multiplier=profile["prefetch_multiplier"],
+        task_acks_late=profile["acks_late"],
+        # Re-queue (rather than fail) tasks whose worker process died mid-run; bounded by max_deliveries
+        task_reject_on_worker_lost=profile["acks_late"] and bool(profile.get("max_deliveries")),
+        task_soft_time_limit=profile["soft_time_limit"],
+        task_time_limit=profile["time_limit"],
+        worker_max_tasks_per_child=profile["max_tasks_per_child"],
+        worker_max_memory_per_child=profile["max_memory_per_child_kb"],
+        broker_transport_options={
+            **(app.conf.broker_transport_options or {}),
+            "visibility_timeout": profile["time_limit"] + VISIBILITY_MARGIN_SECONDS,
+        },
+    )
+    # Each concurrently running task makes its LLM calls on the shared client pool
+    size_executor(profile["concurrency"])
+    _install_recycling(profile)
+
+
+def task_deadline(name: str = None):
+    """Cooperative deadline for one task run (the soft time limit), or None under the default profile"""
+    profile = get_profile(name)
+    return profile.get("soft_time_limit")
+
+
+def delivery_exceeded(task_id: str, name: str = None, cache=None) -> bool:
+    """
+    Count one delivery of a task; True once it has been delivered more than the
+    profile's max_deliveries times.
+
+    With acks_late, a task whose run kills the worker is redelivered, and would be
+    forever. Counts live in the shared cache tier (per host, or across hosts with
+    SHARED_CACHE_URL).
+    """
+    limit = get_profile(name).get("max_deliveries")
+    if not limit or not task_id:
+        return False
+    cache = cache or get_shared_cache()
+    deliveries = (cache.get("deliveries", task_id) or 0) + 1
+    cache.set("deliveries", task_id, deliveries, DELIVERY_COUNT_TTL_SECONDS)
+    if deliveries <= limit:
+        return False
+    registry.inc("analyzer_task_deliveries_exceeded_total")
+    return True
+
+
+def _rss_kb() -> int:
+    try:
+        with open("/proc/self/status") as f:
+            return next(int(line.split()[1]) for line in f if line.startswith("VmRSS:"))
+    except (OSError, StopIteration):
+        # Peak rather than current RSS, but still bounds growth
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def recycle_reason(completed: int, profile: dict):
+    """Why a worker that has completed this many tasks should be recycled, or None"""
+    if completed >= profile["max_tasks_per_child"]:
+        return "max_tasks"
+    if _rss_kb() >= profile["max_memory_per_child_kb"]:
+        return "max_memory"
+    return None
+
+
+def _install_recycling(profile: dict):
+    """max-tasks/max-memory recycling for pools that run every task in the worker process itself"""
+    from celery.signals import worker_init, task_postrun
+
+    state = {"worker_pid": None, "completed": 0, "recycling": False}
+
+    @worker_init.connect(weak=False)
+    def _record_worker(**kwargs):
+        state["worker_pid"] = os.getpid()
+
+    @task_postrun.connect(weak=False)
+    def _recycle(**kwargs):
+        # Prefork children (a worker started with --pool prefork) are recycled by Celery itself
+        if os.getpid() != state["worker_pid"] or state["recycling"]:
+            return
+        state["completed"] += 1
+        reason = recycle_reason(state["completed"], profile)
+        if reason is None:
+            return
+        state["recycling"] = True
+        registry.inc("analyzer_worker_recycles_total", labels={"reason": reason})
+        print(f"Recycling worker after {reason}; running tasks finish first")
+        # Warm shutdown: stop consuming, finish running tasks, exit for the supervisor to restart
+        os.kill(os.getpid(), signal.SIGTERM)
+
+
+def worker_argv(name: str = None, app: str = "celery_tasks") -> list:
+    """celery worker arguments for a profile (pool and concurrency)"""
+    profile = get_profile(name)
+    argv = ["-m", "celery", "-A", app, "worker"]
+    if profile:
+        argv += ["--pool", profile["pool"], "--concurrency", str(profile["concurrency"])]
+    return argv
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Start a Celery worker with a tuning profile")
+    parser.add_argument("--profile", default=WORKER_PROFILE, choices=sorted(WORKER_PROFILES))
+    args, extra = parser.parse_known_args()
+    os.environ["CELERY_WORKER_PROFILE"] = args.profile
+    argv = [sys.executable] + worker_argv(args.profile) + (extra or ["--loglevel=info"])
+    print("Starting:", " ".join(argv[1:]))
+    os.execv(sys.executable, argv)
+
+
+if __name__ == "__main__":
+    main()